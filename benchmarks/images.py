@@ -0,0 +1,62 @@
+"""
+Deterministic synthetic test images. The same name, size and seed always give the same pixels, so benchmark runs
+on different machines work on identical data without needing any image files.
+"""
+import numpy as np
+from PIL import Image
+
+
+def gradient(size, seed=0):
+    """A smooth RGB gradient, with a distinct color for almost every pixel"""
+    width, height = size
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    pixels = np.stack(np.broadcast_arrays(x, y, (x + y) / 2), axis=-1)
+    return Image.fromarray(pixels.round().astype(np.uint8), 'RGB')
+
+
+def flat_art(size, colors=12, seed=0):
+    """Rectangles of a few flat colors, like a logo or UI screenshot"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    palette = rng.integers(0, 256, (colors, 3), dtype=np.uint8)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = palette[0]
+    for color in palette[1:]:
+        for _ in range(3):
+            left, right = np.sort(rng.integers(0, width + 1, 2))
+            top, bottom = np.sort(rng.integers(0, height + 1, 2))
+            pixels[top:bottom, left:right] = color
+    return Image.fromarray(pixels, 'RGB')
+
+
+def noisy_photo(size, seed=0):
+    """A few blurry regions of color with sensor-like noise, so nearly every pixel is a unique color"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    centers = rng.uniform(0, 1, (6, 2)) * (width, height)
+    colors = rng.uniform(30, 225, (6, 3))
+    y, x = np.mgrid[0:height, 0:width]
+    distances = np.stack([np.hypot(x - cx, y - cy) for cx, cy in centers], axis=-1)
+    weights = np.exp(-distances / (0.2 * max(size)))
+    pixels = weights @ colors / weights.sum(axis=-1, keepdims=True)
+    pixels += rng.normal(0, 8, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).round().astype(np.uint8), 'RGB')
+
+
+def rgba_alpha(size, seed=0):
+    """A noisy photo with a soft-edged alpha channel"""
+    width, height = size
+    rgb = np.asarray(noisy_photo(size, seed))
+    y, x = np.mgrid[0:height, 0:width]
+    alpha = 255 * np.clip(1.5 - 2 * np.hypot(x / width - 0.5, y / height - 0.5) * 2, 0, 1)
+    pixels = np.dstack((rgb, alpha.round().astype(np.uint8)))
+    return Image.fromarray(pixels, 'RGBA')
+
+
+PROFILES = {
+    'gradient': gradient,
+    'flat-art': flat_art,
+    'noisy-photo': noisy_photo,
+    'rgba-alpha': rgba_alpha,
+}
@@ -0,0 +1,150 @@
+"""
+Times the clustering and remapping algorithms on synthetic images, across image profiles, sizes and every
+distance function, and saves the results as JSON.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output results.json --compare baseline.json --tolerance 0.25
+
+With --compare, each case is checked against the same case in the baseline, and the run fails (exit code 1) if any
+case is more than `tolerance` slower. Each case is timed `repeat` times and the fastest time is kept, since slower
+runs are noise from the rest of the machine. Random starts are seeded, so every run does the same work.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import PIL
+from colorclusters import distance, mean_shift
+from colorclusters.closest_color import map_pixels_to_closest_color_index
+from colorclusters.image_utils import add_transparency_grid, image_to_pixels
+from colorclusters.k_means import KMeans
+from colorclusters.median_cut import median_cut
+from benchmarks.images import PROFILES
+
+DISTANCES = {
+    'euclidean': distance.euclidean,
+    'manhattan': distance.manhattan,
+    'chebyshev': distance.chebyshev,
+    'hamming': distance.hamming,
+    'norm(3)': distance.norm(3),
+    'scaled(euclidean)': distance.scaled(distance.euclidean, (2, 4, 3, 1)),
+}
+
+# the number of K-Means iterations timed, so that every run does the same amount of work
+_k_means_iterations = 5
+_k_value = 16
+_palette = [(0, 0, 0, 255), (255, 255, 255, 255), (200, 30, 30, 128), (30, 200, 30, 255), (30, 30, 200, 0),
+            (128, 128, 128, 255), (250, 200, 20, 200), (20, 200, 250, 255)]
+
+
+def time_call(function, repeat):
+    """Runs the function `repeat` times, and returns the fastest time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def k_means_case(pixels, dist, use_histogram, seeding):
+    def run():
+        k_means = KMeans(_k_value, pixels, dist, use_histogram=use_histogram, seeding=seeding, random_state=0)
+        for _ in range(_k_means_iterations):
+            k_means.shift_centroids()
+    return run
+
+
+def get_cases(sizes, profiles, distances):
+    """
+    Lists every benchmark case
+    :return: a list of (name, parameters, function) tuples
+    """
+    cases = []
+    for size in sizes:
+        for profile in profiles:
+            image = PROFILES[profile]((size, size))
+            pixels = image_to_pixels(image)
+            # median cut only looks at the channels, so it doesn't depend on the distance
+            cases.append(('median-cut', {'size': size, 'profile': profile},
+                          lambda pixels=pixels: median_cut(*mean_shift.get_unique_points(pixels), _k_value)))
+            for dist_name in distances:
+                dist = DISTANCES[dist_name]
+                params = {'size': size, 'profile': profile, 'distance': dist_name}
+                for use_histogram in (True, False):
+                    for seeding in ('random', 'k-means++', 'k-means||', 'median-cut'):
+                        name = 'k-means%s, %s' % ('' if use_histogram else ' (no histogram)', seeding)
+                        cases.append((name, params, k_means_case(pixels, dist, use_histogram, seeding)))
+                cases.append(('mean-shift', params,
+                              lambda pixels=pixels, dist=dist: mean_shift.mine(pixels, None, dist,
+                                                                               max_centroids=64)))
+                cases.append(('remap', params,
+                              lambda pixels=pixels, dist=dist: map_pixels_to_closest_color_index(pixels, _palette,
+                                                                                                 dist)))
+        cases.append(('transparency-grid', {'size': size},
+                      lambda image=PROFILES['rgba-alpha']((size, size)): add_transparency_grid(image)))
+    return cases
+
+
+def get_key(result):
+    """Identifies a case across runs"""
+    return json.dumps([result['name'], result['params']], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Finds the cases that got slower than the baseline
+    :return: a list of (result, baseline seconds) tuples for the cases more than `tolerance` slower
+    """
+    baseline_times = {get_key(result): result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = baseline_times.get(get_key(result))
+        if old is not None and result['seconds'] > old * (1 + tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='file the JSON results are written to (default: stdout)')
+    parser.add_argument('--compare', help='a previous results file to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower (as a fraction) a case can be before it counts as a regression')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256], help='image widths (images are square)')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=sorted(PROFILES))
+    parser.add_argument('--distances', nargs='+', choices=list(DISTANCES), default=list(DISTANCES))
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each case')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name, params, function in get_cases(args.sizes, args.profiles, args.distances):
+        seconds = time_call(function, args.repeat)
+        results.append({'name': name, 'params': params, 'seconds': round(seconds, 6)})
+        print('%-36s %-60s %9.4fs' % (name, json.dumps(params), seconds), file=sys.stderr)
+
+    report = {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'pillow': PIL.__version__,
+                 'machine': platform.machine(), 'platform': platform.platform(), 'repeat': args.repeat},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for result, old in regressions:
+            print('REGRESSION %s %s: %.4fs -> %.4fs' % (result['name'], json.dumps(result['params']), old,
+                                                        result['seconds']), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
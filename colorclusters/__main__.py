@@ -0,0 +1,4 @@
+import sys
+from colorclusters.cli import main
+
+sys.exit(main())
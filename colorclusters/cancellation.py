@@ -0,0 +1,80 @@
+"""
+Cooperative cancellation for the algorithms.
+
+A CancelToken is cancelled when cancel() is called (e.g. from the GUI thread), when its time budget runs out, or when
+its keep_running function returns False. The algorithms check it between chunks of work, and when it's cancelled they
+stop and finish with the best result they have so far, rather than raising. That way a time budget puts a bound on
+how long an image takes, and still produces an image.
+
+    token = CancelToken(budget=2.5)
+    image, stats = quantize_k_means(image, 16, cancel=token)
+"""
+import time
+
+
+class CancelToken:
+    """Tells the algorithms when to stop. Safe to cancel from another thread"""
+
+    def __init__(self, budget=None, keep_running=None):
+        """
+        :param budget: the number of seconds from now until the token cancels itself, or None for no time limit
+        :param keep_running: a function returning False when the algorithms should stop, or None
+        """
+        self.deadline = None if budget is None else time.monotonic() + budget
+        self.keep_running = keep_running
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self):
+        """
+        :return: True once the token has been cancelled, the budget has run out, or keep_running returned False.
+                    stays True from then on
+        """
+        if not self.cancelled:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.cancelled = True
+            elif self.keep_running is not None and not self.keep_running():
+                self.cancelled = True
+        return self.cancelled
+
+    def remaining(self):
+        """
+        :return: the seconds left in the budget (0 once cancelled), or None if there is no time limit
+        """
+        if self.is_cancelled():
+            return 0
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+class NeverCancel:
+    """Stands in for a CancelToken when the algorithms should always run to completion"""
+    cancelled = False
+
+    def cancel(self):
+        raise TypeError('NEVER_CANCEL can not be cancelled. Create a CancelToken instead')
+
+    def is_cancelled(self):
+        return False
+
+    def remaining(self):
+        return None
+
+
+NEVER_CANCEL = NeverCancel()
+
+
+def as_token(cancel):
+    """
+    Gets the token to check, for functions that also accept a keep_running function
+    :param cancel: a CancelToken, None to never cancel, or a function returning False when the algorithm should stop
+    :return: a CancelToken or NEVER_CANCEL
+    """
+    if cancel is None:
+        return NEVER_CANCEL
+    if isinstance(cancel, (CancelToken, NeverCancel)):
+        return cancel
+    return CancelToken(keep_running=cancel)
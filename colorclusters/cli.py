@@ -0,0 +1,328 @@
+"""
+Command line tool for quantizing many images at once, without the GUI.
+
+    python -m colorclusters "photos/**/*.jpg" -o out/ -a k-means -k 16 -d euclidean
+
+Each image is saved as a paletted PNG in the output directory, under its path relative to the directory its pattern
+starts from, so photos/**/*.jpg saves photos/a/1.jpg as out/a/1.png. Outputs newer than their input are skipped unless
+--force is given. One JSON line per input is written to the report, with its status, timing and SSE (and with
+--profile, the time spent in each phase and counters such as distance evaluations).
+
+With --strip-rows, .npy inputs of (height, width, channels) uint8 pixels are read from the file a strip at a time,
+so huge images can be quantized without holding them in memory. Other formats are decoded in full first,
+since PIL can't decode a range of rows.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from colorclusters import distance as dist_func
+from colorclusters.progress import Progress, format_event
+from colorclusters.cancellation import CancelToken
+from colorclusters.image_utils import image_to_array
+from colorclusters.palette_cache import PaletteCache
+from colorclusters.quantize import quantize_k_means, quantize_mean_shift, quantize_median_cut
+from colorclusters.seeding import SEEDINGS
+from colorclusters.sequence import quantize_sequence, save_animation, sort_numbered
+from colorclusters.streaming import quantize_streaming
+
+ALGORITHMS = ('k-means', 'mean-shift', 'median-cut')
+
+
+def parse_bits(text):
+    """Reads the bits per channel for --bin-bits, e.g. '5' or '6,6,6,4'"""
+    try:
+        bits = [int(value) for value in text.replace('-', ',').split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected bits per channel, like 5,5,5 or 6,6,6,4: %s' % text)
+    if not all(1 <= value <= 8 for value in bits):
+        raise argparse.ArgumentTypeError('bits per channel must be from 1 to 8: %s' % text)
+    return bits[0] if len(bits) == 1 else bits
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m colorclusters', description='Convert images to paletted PNGs.')
+    parser.add_argument('inputs', nargs='+', help='input files or glob patterns (** matches subdirectories)')
+    parser.add_argument('-o', '--output-dir', required=True, help='directory the paletted images are saved to')
+    parser.add_argument('-a', '--algorithm', choices=ALGORITHMS, default='k-means')
+    parser.add_argument('-k', '--k-value', type=int, default=16, help='number of colors for k-means and median-cut')
+    parser.add_argument('-d', '--distance', default='euclidean',
+                        help="distance function, e.g. euclidean, manhattan, chebyshev or 'norm(3)'")
+    parser.add_argument('--max-shift', type=float, default=3, help='stop once no centroid shifts more than this')
+    parser.add_argument('--max-centroids', type=int, default=256, help='initial sampling for mean-shift')
+    parser.add_argument('--shift-seeding', choices=('occupancy', 'lattice'), default='occupancy',
+                        help='where mean-shift starts its centroids: only in cells that hold enough of the colors, or '
+                             'evenly over the whole color space')
+    parser.add_argument('--max-seeds', type=int, default=4096, help='most centroids occupancy seeding starts')
+    parser.add_argument('--reuse-basins', action='store_true',
+                        help='stop mean-shift centroids once they are headed for a color already found. fewer '
+                             'searches, but a few colors can be lost')
+    parser.add_argument('--seeding', choices=('random',) + tuple(SEEDINGS), default='k-means++',
+                        help='how k-means chooses its initial centroids. k-means|| makes a few large passes over '
+                             'the colors instead of one per centroid, and median-cut starts from the median-cut '
+                             'palette')
+    parser.add_argument('--random-start', action='store_true', help='same as --seeding random')
+    parser.add_argument('--seed', type=int, help='random seed, so runs can be repeated exactly')
+    parser.add_argument('--batch-size', type=int, default=0, help='k-means mini-batch size (0 for full passes)')
+    parser.add_argument('--bounds', action='store_true',
+                        help='skip the k-means distance computations the triangle inequality rules out, for metric '
+                             'distances. the result is the same. not with --batch-size')
+    parser.add_argument('--strip-rows', type=int, default=0,
+                        help='read k-means images this many rows at a time. memory is only bounded for .npy inputs, '
+                             'which are read a strip at a time, as other formats have to be decoded in full')
+    parser.add_argument('--bin-bits', type=parse_bits,
+                        help='cluster colors binned to this many bits per channel (e.g. 5,5,5 or 6,6,6,4), which is '
+                             'much faster on noisy photos. the report gives the error it introduced')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, default=0,
+                        help='most images queued or in progress at once (default: twice the number of jobs)')
+    parser.add_argument('--report', help='JSON lines report file (default: report.jsonl in the output directory)')
+    parser.add_argument('--force', action='store_true', help='redo images whose output is already up to date')
+    parser.add_argument('--time-budget', type=float, default=0,
+                        help='seconds each image (or frame) may take. once they run out, the colors found so far '
+                             'are used')
+    parser.add_argument('--cache', help='SQLite file of palettes found before. images with the same colors and '
+                                        'options reuse their palette instead of clustering again')
+    parser.add_argument('--cache-size', type=int, default=10000, help='most palettes kept in the cache')
+    parser.add_argument('--frames', action='store_true',
+                        help='quantize every frame of animated GIF and APNG inputs with k-means, starting each frame '
+                             'from the colors of the frame before')
+    parser.add_argument('--sequence', action='store_true',
+                        help='treat the inputs as the numbered frames of one animation, like --frames. each frame is '
+                             'saved as its own PNG')
+    parser.add_argument('--global-palette', action='store_true',
+                        help='with --frames or --sequence, use one palette for every frame')
+    parser.add_argument('--profile', action='store_true',
+                        help='add phase timings and counters, such as distance evaluations, to the report')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the progress of each image to stderr')
+    args = parser.parse_args(argv)
+    if dist_func.decode_string(args.distance) is None:
+        parser.error('unknown distance function: %s' % args.distance)
+    if (args.frames or args.sequence) and args.algorithm != 'k-means':
+        parser.error('--frames and --sequence only work with k-means')
+    if args.bounds and args.batch_size:
+        parser.error('--bounds can not be used with --batch-size')
+    if args.frames or args.sequence:
+        # the frames are clustered one after another from the previous frame's colors, which these don't apply to
+        unsupported = [flag for flag, value in (('--cache', args.cache), ('--bin-bits', args.bin_bits),
+                                                ('--batch-size', args.batch_size), ('--strip-rows', args.strip_rows),
+                                                ('--bounds', args.bounds))
+                       if value]
+        if unsupported:
+            parser.error('--frames and --sequence can not be used with %s' % ', '.join(unsupported))
+    return args
+
+
+def get_pattern_root(pattern):
+    """Gets the directory a pattern's matches are named relative to: the part of it before the first wildcard"""
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root
+
+
+def find_inputs(patterns):
+    """
+    Expands the input patterns, keeping the first occurrence of each file
+    :return: a list of (path, name) tuples. the name is the path relative to the pattern's root, which the output is
+                saved under
+    """
+    inputs = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        root = get_pattern_root(pattern)
+        for match in matches:
+            if os.path.isfile(match) and match not in inputs:
+                inputs[match] = os.path.relpath(match, root or os.curdir)
+    return list(inputs.items())
+
+
+def get_output_path(name, output_dir, options=None):
+    """
+    Gets the path an input is saved to
+    :param name: the input's name, from find_inputs
+    """
+    name, extension = os.path.splitext(name)
+    # animated GIFs stay GIFs, since not every viewer plays APNGs
+    if options and options['frames'] and extension.lower() == '.gif':
+        return os.path.join(output_dir, name + '.gif')
+    return os.path.join(output_dir, name + '.png')
+
+
+def read_pixels(input_path):
+    """
+    Gets the pixels of an input for quantize_streaming
+    :return: the path of a .npy file, which is read a strip at a time, or the (height, width, channels) array of a
+                decoded image
+    """
+    if os.path.splitext(input_path)[1].lower() == '.npy':
+        return input_path
+    with Image.open(input_path) as image:
+        return image_to_array(image)
+
+
+def is_up_to_date(input_path, output_path):
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def get_progress(name, options):
+    """Gets the Progress for one input, printing its events if the output is verbose"""
+    progress = Progress() if options['profile'] or options['verbose'] else None
+    if options['verbose']:
+        progress.subscribe(lambda event: print('%s: %s' % (name, format_event(event).replace('\n', ', ')),
+                                               file=sys.stderr))
+    return progress
+
+
+def quantize_file(input_path, output_path, options):
+    """
+    Quantizes one image and saves the result. Runs in a worker process
+    :param options: a dictionary of the parsed command line arguments
+    :return: a report record
+    """
+    record = {'input': input_path, 'output': output_path, 'algorithm': options['algorithm']}
+    progress = get_progress(input_path, options)
+    start = time.perf_counter()
+    cancel = CancelToken(budget=options['time_budget'] or None)
+    seeding = 'random' if options['random_start'] else options['seeding']
+    cache = None
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if options['cache']:
+            cache = PaletteCache(options['cache'], options['cache_size'])
+        distance = dist_func.decode_string(options['distance'])
+        if options['algorithm'] == 'k-means' and options['strip_rows']:
+            result, stats = quantize_streaming(read_pixels(input_path), options['k_value'], options['max_shift'],
+                                               distance, seeding != 'random', options['strip_rows'], progress, cancel,
+                                               seeding, options['seed'], cache, options['bin_bits'],
+                                               use_bounds=options['bounds'])
+        else:
+            with Image.open(input_path) as image:
+                if options['frames'] and getattr(image, 'n_frames', 1) > 1:
+                    # the budget is per frame
+                    cancel = CancelToken(budget=options['time_budget'] * image.n_frames or None)
+                    frames, stats = quantize_sequence(image, options['k_value'], options['max_shift'], distance,
+                                                      seeding, options['seed'], options['global_palette'], progress,
+                                                      cancel)
+                    save_animation(frames, output_path, image.info.get('loop', 0))
+                    result = None
+                elif options['algorithm'] == 'k-means':
+                    result, stats = quantize_k_means(image, options['k_value'], options['max_shift'], distance,
+                                                     seeding != 'random', options['batch_size'] or None,
+                                                     progress=progress, cancel=cancel, seeding=seeding,
+                                                     random_state=options['seed'], cache=cache,
+                                                     bits=options['bin_bits'], use_bounds=options['bounds'])
+                elif options['algorithm'] == 'median-cut':
+                    result, stats = quantize_median_cut(image, options['k_value'], distance, progress, cancel)
+                else:
+                    result, stats = quantize_mean_shift(image, options['max_shift'], options['max_centroids'],
+                                                        distance, progress=progress, cancel=cancel, cache=cache,
+                                                        bits=options['bin_bits'], seeding=options['shift_seeding'],
+                                                        max_seeds=options['max_seeds'],
+                                                        reuse_basins=options['reuse_basins'])
+        if result is not None:
+            result.save(output_path)
+        record.update(stats, status='done')
+    except Exception as error:
+        record.update(status='error', error='%s: %s' % (type(error).__name__, error))
+    finally:
+        if cache is not None:
+            cache.close()
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    if options['profile']:
+        record['profile'] = progress.summary()
+    return record
+
+
+def quantize_sequence_files(inputs, output_dir, options):
+    """
+    Quantizes numbered images as the frames of one animation, saving each frame as a paletted PNG
+    :param inputs: the (path, name) of each frame, in order
+    :param options: a dictionary of the parsed command line arguments
+    :return: a report record
+    """
+    input_paths = [input_path for input_path, _ in inputs]
+    record = {'input': input_paths[0] if input_paths else None, 'output': output_dir,
+              'algorithm': 'k-means (sequence)'}
+    progress = get_progress('sequence', options)
+    start = time.perf_counter()
+    cancel = CancelToken(budget=options['time_budget'] * len(input_paths) or None)
+    seeding = 'random' if options['random_start'] else options['seeding']
+    try:
+        if not input_paths:
+            raise ValueError('no inputs found')
+        output_paths = [get_output_path(name, output_dir) for _, name in inputs]
+        if len(set(output_paths)) < len(output_paths):
+            raise ValueError('some frames would be saved to the same path')
+        frames, stats = quantize_sequence(input_paths, options['k_value'], options['max_shift'],
+                                          dist_func.decode_string(options['distance']), seeding, options['seed'],
+                                          options['global_palette'], progress, cancel)
+        for output_path, frame in zip(output_paths, frames):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            frame.save(output_path)
+        record.update(stats, status='done')
+    except Exception as error:
+        record.update(status='error', error='%s: %s' % (type(error).__name__, error))
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    if options['profile']:
+        record['profile'] = progress.summary()
+    return record
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = vars(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = args.report or os.path.join(args.output_dir, 'report.jsonl')
+    max_in_flight = args.max_in_flight or 2 * args.jobs
+    failures = 0
+
+    if args.sequence:
+        # the frames depend on each other, so they're done in order in this process
+        with open(report_path, 'a') as report:
+            inputs = dict(find_inputs(args.inputs))
+            record = quantize_sequence_files([(path, inputs[path]) for path in sort_numbered(inputs)], args.output_dir,
+                                             options)
+            report.write(json.dumps(record) + '\n')
+        return 1 if record['status'] == 'error' else 0
+
+    with open(report_path, 'a') as report, ProcessPoolExecutor(args.jobs) as pool:
+        def write(record):
+            report.write(json.dumps(record) + '\n')
+            report.flush()
+
+        in_flight = set()
+        # the input saved to each output path, so two inputs with the same name don't overwrite each other
+        outputs = {}
+        for input_path, name in find_inputs(args.inputs):
+            output_path = get_output_path(name, args.output_dir, options)
+            if output_path in outputs:
+                failures += 1
+                write({'input': input_path, 'output': output_path, 'algorithm': args.algorithm, 'status': 'error',
+                       'error': 'the output of %s is already saved to %s' % (outputs[output_path], output_path)})
+                continue
+            outputs[output_path] = input_path
+            if not args.force and is_up_to_date(input_path, output_path):
+                write({'input': input_path, 'output': output_path, 'algorithm': args.algorithm, 'status': 'skipped'})
+                continue
+            # don't queue up more work than the workers can get through soon
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    failures += future.result()['status'] == 'error'
+                    write(future.result())
+            in_flight.add(pool.submit(quantize_file, input_path, output_path, options))
+
+        for future in wait(in_flight).done:
+            failures += future.result()['status'] == 'error'
+            write(future.result())
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
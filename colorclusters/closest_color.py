@@ -1,11 +1,38 @@
 from math import inf
-from colorclusters.distance import euclidean
+import numpy as np
+from colorclusters.distance import euclidean, has_batch, closest_indices
+from colorclusters.histogram import ColorHistogram, can_pack, pack_colors, unpack_colors
+from colorclusters.palette_lookup import get_palette_lookup
+from colorclusters.progress import as_progress
+from colorclusters.cancellation import as_token
 
+# the number of distinct colors matched between progress updates
+_progress_chunk = 1 << 16
 
-def get_sum_squared_error(pixels, clustering, centroids, distance=euclidean):
+
+def get_sum_squared_error(pixels, clustering, centroids, distance=euclidean, weights=None):
+    """
+    Computes the Sum Squared Error of a clustering
+    :param pixels: a list of n-tuples or an (N, D) array
+    :param clustering: the index of the centroid each pixel belongs to
+    :param centroids: a list of n-tuples
+    :param distance: a distance function. uses euclidean by default
+    :param weights: the number of times each pixel occurs, if the pixels are a histogram
+    :return: the sum of the squared distance from each pixel to its centroid
+    """
+    if has_batch(distance):
+        pixels = np.asarray(pixels, dtype=np.float64)
+        centroids = np.asarray(centroids, dtype=np.float64)
+        squared = distance.batch(centroids[np.asarray(clustering)], pixels) ** 2
+        if weights is not None:
+            squared *= weights
+        return float(squared.sum())
+
+    if weights is None:
+        weights = [1] * len(pixels)
     error = 0
-    for i, pixel in zip(clustering, pixels):
-        error += distance(centroids[i], pixel) ** 2
+    for i, pixel, weight in zip(clustering, pixels, weights):
+        error += distance(centroids[i], pixel) ** 2 * weight
     return error
 
 
@@ -28,32 +55,99 @@ def get_closest_color_index(pixel, colors, distance=euclidean):
     return index
 
 
-def map_pixels_to_closest_color_index(pixels, colors, distance=euclidean, output_queue=None):
+def map_pixels_to_closest_color_index(pixels, colors, distance=euclidean, progress=None, cancel=None):
     """
     Computes the closest color for all of a list of points to a color list.
-    Remembers past results for repeat pixels to improve performance.
+    Remembers past results for repeat pixels to improve performance. Colors with up to 4 channels of 0-255 values
+    are looked up in a PaletteLookup table, which is kept for reuse with the same palette.
     :param pixels: a list of n-tuples representing points
     :param colors: a list of n-tuples to compare against
-    :param output_queue: Queue for printing info to the UI
     :param distance: a distance function. uses euclidean by default
-    :return: a list of color array indexes, representing the closest color to each pixel
+    :param progress: a Progress to report to, or a queue for text updates. counts repeat pixels that were already
+                        matched as 'color cache hits', and the others as 'color cache misses'
+    :param cancel: a CancelToken checked between chunks of pixels. once it's cancelled, the rest of the pixels are
+                    matched in one pass through a PaletteLookup table for the same distance, as batch distances on
+                    8-bit colors always are. only the progress reports stop early, so the result is the same
+    :return: a list (or array) of color array indexes, representing the closest color to each pixel
     """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    if has_batch(distance) and len(pixels) > 0:
+        if can_pack(pixels):
+            progress.report('Remapping pixels', final=True)
+            return get_palette_lookup(colors, distance, len(pixels[0])).lookup(pixels, progress)
+        return _map_pixels_batch(pixels, colors, distance, progress, cancel)
+    if len(pixels) > 0 and can_pack(pixels):
+        return _map_pixels_histogram(pixels, colors, distance, progress, cancel)
+
+    if isinstance(pixels, np.ndarray):
+        # array rows can't be used as dictionary keys
+        pixels = [tuple(pixel) for pixel in pixels.tolist()]
     data = []
     color_map = {}
-    percent_complete = 0
     num_pixels = len(pixels)
-    for i, pixel in enumerate(list(pixels)):
-        if output_queue is not None:
-            percent = int((i/num_pixels)*100)
-            if percent > percent_complete:
-                percent_complete = percent
-                output_queue.put("%d distinct colors found\nDrawing new image\nRemapping pixels: %d%% complete" % (len(colors), percent_complete))
-        # if we've already computed the nearest color, use it
-        if pixel in color_map:
-            data.append(color_map[pixel])
-        else:
-            index = get_closest_color_index(pixel, colors, distance)
-            # remember the result
-            color_map[pixel] = index
-            data.append(index)
-    return data
\ No newline at end of file
+    matched = num_pixels
+    for start in range(0, num_pixels, _progress_chunk):
+        if cancel.is_cancelled():
+            matched = start
+            data.extend(_match_rest(pixels[start:], colors, distance, progress).tolist())
+            break
+        progress.report('Remapping pixels', start / num_pixels)
+        for pixel in pixels[start:start + _progress_chunk]:
+            # if we've already computed the nearest color, use it
+            if pixel in color_map:
+                data.append(color_map[pixel])
+            else:
+                index = get_closest_color_index(pixel, colors, distance)
+                # remember the result
+                color_map[pixel] = index
+                data.append(index)
+    progress.count('color cache misses', len(color_map))
+    progress.count('color cache hits', matched - len(color_map))
+    return data
+
+
+def _map_pixels_batch(pixels, colors, distance, progress, cancel):
+    """Vectorized form of map_pixels_to_closest_color_index. Each distinct color is only matched once"""
+    unique, inverse = np.unique(np.asarray(pixels), axis=0, return_inverse=True)
+    unique_index = np.empty(len(unique), dtype=np.intp)
+    for start in range(0, len(unique), _progress_chunk):
+        if cancel.is_cancelled():
+            unique_index[start:] = _match_rest(unique[start:], colors, distance, progress)
+            break
+        progress.report('Remapping pixels', start / len(unique))
+        stop = start + _progress_chunk
+        unique_index[start:stop] = closest_indices(unique[start:stop], colors, distance)
+        progress.count('distance evaluations', len(unique[start:stop]) * len(colors))
+    progress.count('color cache misses', len(unique))
+    progress.count('color cache hits', len(inverse) - len(unique))
+    return unique_index[inverse.reshape(-1)]
+
+
+def _map_pixels_histogram(pixels, colors, distance, progress, cancel):
+    """
+    Form of map_pixels_to_closest_color_index for distances without a batch form. The pixels are counted in a
+    ColorHistogram, so each distinct color is only matched once, without hashing a tuple per pixel
+    """
+    packed = pack_colors(pixels)
+    histogram = ColorHistogram.from_packed(packed, len(pixels[0]))
+    unique = unpack_colors(histogram.keys, histogram.channels)
+    unique_index = np.empty(len(unique), dtype=np.intp)
+    for start in range(0, len(unique), _progress_chunk):
+        if cancel.is_cancelled():
+            unique_index[start:] = _match_rest(unique[start:], colors, distance, progress)
+            break
+        progress.report('Remapping pixels', start / len(unique))
+        for i, color in enumerate(map(tuple, unique[start:start + _progress_chunk].tolist()), start):
+            unique_index[i] = get_closest_color_index(color, colors, distance)
+    progress.count('color cache misses', len(unique))
+    progress.count('color cache hits', len(packed) - len(unique))
+    return unique_index[histogram.find(packed)]
+
+
+def _match_rest(pixels, colors, distance, progress):
+    """Matches the pixels left over when remapping is cancelled all at once, with the same distance"""
+    progress.count('matched after cancel', len(pixels))
+    if can_pack(pixels):
+        return get_palette_lookup(colors, distance, len(pixels[0])).lookup(pixels)
+    return closest_indices(pixels, colors, distance)
@@ -1,6 +1,17 @@
 """
 This module provides a collection of distance formulas for comparing colors.
+
+Every distance is a function taking two tuples, but the built-in distances also carry a vectorized
+form in their `batch` attribute. `batch(x, y)` takes numpy arrays whose last axis holds the color
+channels, broadcasts them against each other, and returns the distances over the remaining axes.
+`pairwise_distances` and `closest_indices` use the batch form automatically, and fall back to calling
+the distance once per pair for functions that don't have one (e.g. user functions from decode_string).
 """
+import numpy as np
+
+# the number of values the batch helpers compute at once. keeps the temporary (chunk, K, D) arrays
+# at a few MB, no matter how many colors are compared
+_chunk_elements = 1 << 20
 
 
 def decode_string(string):
@@ -11,11 +22,33 @@ def decode_string(string):
         # the algorithm must be a function
         if not callable(alg):
             alg = None
-    except SyntaxError:
+    except Exception:
+        # not valid python, or names something that doesn't exist
         alg = None
     return alg
 
 
+def _add_batch(func, kernel, is_metric):
+    """
+    Attaches a vectorized form of a distance function to it
+    :param func: the per-pair distance function
+    :param kernel: a function computing the distance over the last axis of two broadcastable arrays
+    :param is_metric: True if the distance satisfies the triangle inequality
+    :return: the same function, with `batch` and `is_metric` attributes
+    """
+
+    def batch(x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        # like the per-pair functions, only the shared dimensions are compared
+        dimensions = min(x.shape[-1], y.shape[-1])
+        return kernel(x[..., :dimensions], y[..., :dimensions])
+
+    func.batch = batch
+    func.is_metric = is_metric
+    return func
+
+
 def norm_distance(p=2):
     """
     Creates a function that computes the p-norm distance.
@@ -32,7 +65,19 @@ def norm_distance(p=2):
         dist = dist ** (1 / p)
         return dist
 
-    return calculate_dist
+    def kernel(x, y):
+        diff = x - y
+        if p == 2:
+            # a dot product of each difference with itself is much faster than summing over the short last axis
+            return np.sqrt(np.einsum('...i,...i->...', diff, diff))
+        diff = np.abs(diff)
+        if p == 1:
+            return diff.sum(axis=-1)
+        return (diff ** p).sum(axis=-1) ** (1 / p)
+
+    calculate_dist.at_least_chebyshev = True
+    calculate_dist.name = 'norm(%r)' % p
+    return _add_batch(calculate_dist, kernel, p >= 1)
 
 
 euclidean = norm_distance(2)
@@ -64,6 +109,27 @@ def hamming(x,y):
         dist += bin(int(xi)^int(yi)).count("1")
     return dist
 
+
+def _popcount(values):
+    """Counts the set bits of each element of a non-negative integer array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    # numpy < 2.0 doesn't have a popcount, so shift through the bits instead
+    count = np.zeros(values.shape, dtype=np.int64)
+    while values.any():
+        count += values & 1
+        values = values >> 1
+    return count
+
+
+chebyshev.at_least_chebyshev = True
+chebyshev.name = 'chebyshev'
+hamming.name = 'hamming'
+_add_batch(chebyshev, lambda x, y: np.abs(x - y).max(axis=-1, initial=0), True)
+_add_batch(hamming, lambda x, y: _popcount(np.abs(np.bitwise_xor(
+    np.trunc(x).astype(np.int64), np.trunc(y).astype(np.int64)))).sum(axis=-1), True)
+
+
 def scaled_distance(distance, scale_vector):
     """
     Creates a distance function that scales the input vectors before computing the distance
@@ -88,7 +154,20 @@ def scaled_distance(distance, scale_vector):
                 y[i] *= scale_vector[i]
         return distance(x, y)
 
-    return calculate_dist
+    if get_name(distance) is not None:
+        calculate_dist.name = 'scaled(%s, %r)' % (distance.name, tuple(scale_vector))
+    if not has_batch(distance):
+        return calculate_dist
+
+    def kernel(x, y):
+        scale = np.zeros(x.shape[-1])
+        shared = min(len(scale), len(scale_vector))
+        scale[:shared] = scale_vector[:shared]
+        return distance.batch(x * scale, y * scale)
+
+    # scaling by non-negative factors keeps the triangle inequality intact
+    is_metric = getattr(distance, 'is_metric', False) and all(s >= 0 for s in scale_vector)
+    return _add_batch(calculate_dist, kernel, is_metric)
 
 
 # shortened names
@@ -98,3 +177,113 @@ def norm(p=2):
 
 def scaled(distance, scale_vector):
     return scaled_distance(distance, scale_vector)
+
+
+def has_batch(distance):
+    """True if the distance function has a vectorized form"""
+    return callable(getattr(distance, 'batch', None))
+
+
+def get_name(distance):
+    """
+    Gets a name that identifies a built-in distance (including its parameters) across runs
+    :return: a string, or None for user functions
+    """
+    return getattr(distance, 'name', None)
+
+
+def is_at_least_chebyshev(distance):
+    """
+    True if the distance between two points is never less than their chebyshev distance, which holds for
+    every p-norm. Points within such a distance d of each other are always within d along every dimension.
+    """
+    return getattr(distance, 'at_least_chebyshev', False)
+
+
+def _as_color_array(colors):
+    """Converts a list of n-tuples (or an array) to an (N, D) float array"""
+    colors = np.asarray(colors, dtype=np.float64)
+    if colors.ndim == 1:
+        colors = colors.reshape(-1, 1) if colors.size == 0 else colors.reshape(1, -1)
+    return colors
+
+
+def pairwise_distances(colors, palette, distance=euclidean):
+    """
+    Computes the distance between every color and every palette color
+    :param colors: an (N, D) array or a list of n-tuples
+    :param palette: a (K, D) array or a list of n-tuples
+    :param distance: a distance function. Uses euclidean distance by default
+    :return: an (N, K) float array of distances
+    """
+    if has_batch(distance):
+        colors = _as_color_array(colors)
+        palette = _as_color_array(palette)
+        # float like the pairs below, even for kernels that count in integers (e.g. hamming)
+        return distance.batch(colors[:, None, :], palette[None, :, :]).astype(np.float64, copy=False)
+
+    result = np.empty((len(colors), len(palette)))
+    for i, color in enumerate(colors):
+        for j, other in enumerate(palette):
+            result[i, j] = distance(color, other)
+    return result
+
+
+def closest_indices(colors, palette, distance=euclidean):
+    """
+    Finds the closest palette color for each color. Ties go to the lowest palette index.
+    :param colors: an (N, D) array or a list of n-tuples
+    :param palette: a (K, D) array or a list of n-tuples
+    :param distance: a distance function. Uses euclidean distance by default
+    :return: an (N,) array of indexes into the palette
+    """
+    indices = np.full(len(colors), -1, dtype=np.intp)
+    if len(colors) == 0:
+        return indices
+
+    if not has_batch(distance):
+        for i, color in enumerate(colors):
+            min_dist = np.inf
+            for j, other in enumerate(palette):
+                dist = distance(color, other)
+                if dist < min_dist:
+                    min_dist = dist
+                    indices[i] = j
+        return indices
+
+    colors = _as_color_array(colors)
+    palette = _as_color_array(palette)
+    # work through the colors in chunks, to bound the size of the (chunk, K, D) difference array
+    chunk = max(1, _chunk_elements // max(1, palette.size))
+    for start in range(0, len(colors), chunk):
+        block = colors[start:start + chunk]
+        indices[start:start + chunk] = distance.batch(block[:, None, :], palette[None, :, :]).argmin(axis=1)
+    return indices
+
+
+def closest_two(colors, palette, distance=euclidean):
+    """
+    Finds the closest palette color for each color, along with the distances to the closest and second closest
+    palette colors. Requires a distance with a batch form.
+    :param colors: an (N, D) array or a list of n-tuples
+    :param palette: a (K, D) array or a list of n-tuples
+    :param distance: a distance function with a batch form. Uses euclidean distance by default
+    :return: an (indexes, closest, second) tuple of (N,) arrays. second is inf if the palette has one color
+    """
+    colors = _as_color_array(colors)
+    palette = _as_color_array(palette)
+    indices = np.empty(len(colors), dtype=np.intp)
+    closest = np.empty(len(colors))
+    second = np.full(len(colors), np.inf)
+    chunk = max(1, _chunk_elements // max(1, palette.size))
+    for start in range(0, len(colors), chunk):
+        stop = start + chunk
+        # some kernels (e.g. hamming) count in integers, which can't hold the inf that masks out the closest
+        dist = distance.batch(colors[start:stop, None, :], palette[None, :, :]).astype(np.float64, copy=False)
+        indices[start:stop] = dist.argmin(axis=1)
+        rows = np.arange(len(dist))
+        closest[start:stop] = dist[rows, indices[start:stop]]
+        if len(palette) > 1:
+            dist[rows, indices[start:stop]] = np.inf
+            second[start:stop] = dist.min(axis=1)
+    return indices, closest, second
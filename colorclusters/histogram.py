@@ -0,0 +1,275 @@
+"""
+This module packs colors into single integers, so that color histograms can be stored as two parallel arrays
+(packed colors and counts) rather than a dictionary of tuples.
+RGB colors pack into 24 bits and RGBA colors into 32 bits, with the first channel in the highest byte.
+ColorHistogram keeps the two arrays together, and is the color set that KMeans, mean_shift and closest_color share.
+"""
+import struct
+import numpy as np
+
+# colors with more channels than this don't fit in a 32-bit key
+_max_channels = 4
+
+
+def can_pack(colors):
+    """
+    Checks if a set of colors can be packed into 32-bit keys
+    :param colors: an (N, D) array or a list of n-tuples
+    :return: True if there are at most 4 channels, and every value is an integer from 0 to 255
+    """
+    colors = np.asarray(colors)
+    if colors.ndim != 2 or not 0 < colors.shape[1] <= _max_channels:
+        return False
+    if colors.size == 0 or colors.dtype == np.uint8:
+        return True
+    if colors.dtype.kind not in 'iuf':
+        return False
+    return bool(colors.min() >= 0 and colors.max() <= 255 and np.array_equal(colors, np.floor(colors)))
+
+
+def pack_colors(colors):
+    """
+    Packs each color into one integer
+    :param colors: an (N, D) array or a list of n-tuples, with D <= 4 and values from 0 to 255
+    :return: an (N,) uint32 array of keys
+    """
+    colors = np.asarray(colors)
+    keys = np.zeros(len(colors), dtype=np.uint32)
+    for d in range(colors.shape[1]):
+        keys <<= 8
+        keys |= colors[:, d].astype(np.uint32)
+    return keys
+
+
+def unpack_colors(keys, dimensions):
+    """
+    Reverses pack_colors
+    :param keys: an array of packed colors
+    :param dimensions: the number of channels in each color
+    :return: an (N, dimensions) uint8 array of colors
+    """
+    keys = np.asarray(keys, dtype=np.uint32)
+    colors = np.empty((len(keys), dimensions), dtype=np.uint8)
+    for d in range(dimensions):
+        colors[:, d] = keys >> (8 * (dimensions - 1 - d)) & 0xFF
+    return colors
+
+
+def color_histogram(colors):
+    """
+    Counts the occurrences of each distinct color
+    :param colors: an (N, D) array or a list of n-tuples, with D <= 4 and values from 0 to 255
+    :return: a (keys, counts) tuple of uint32 arrays. keys are sorted packed colors
+    """
+    keys, counts = np.unique(pack_colors(colors), return_counts=True)
+    return keys, counts.astype(np.uint32)
+
+
+def merge_histograms(keys, counts, other_keys, other_counts):
+    """
+    Adds two histograms together
+    :param keys: sorted packed colors
+    :param counts: the count of each color
+    :param other_keys: sorted packed colors of the other histogram
+    :param other_counts: the count of each color of the other histogram
+    :return: a (keys, counts) tuple for the combined histogram. counts are uint64, since the total may not fit in 32 bits
+    """
+    keys, inverse = np.unique(np.concatenate((keys, other_keys)), return_inverse=True)
+    counts = np.bincount(inverse.reshape(-1), weights=np.concatenate((counts, other_counts)), minlength=len(keys))
+    return keys, counts.astype(np.uint64)
+
+
+def update_histogram(keys, counts, removed, added):
+    """
+    Removes and adds colors to a histogram, without recounting the colors that stayed the same. Used for the pixels
+    that changed between two frames of an animation
+    :param keys: sorted packed colors
+    :param counts: the count of each color
+    :param removed: the packed colors to remove, one per pixel. each one must be counted in the histogram
+    :param added: the packed colors to add, one per pixel
+    :return: a (keys, counts) tuple. colors whose count drops to 0 are left out, and counts keep their type
+    """
+    keys, inverse = np.unique(np.concatenate((keys, removed, added)), return_inverse=True)
+    changes = np.concatenate((counts.astype(np.int64), np.full(len(removed), -1), np.ones(len(added), np.int64)))
+    # the counts are whole numbers well below 2^53, so the float sums from bincount are exact
+    new_counts = np.bincount(inverse.reshape(-1), weights=changes, minlength=len(keys))
+    present = new_counts > 0
+    return keys[present], new_counts[present].astype(counts.dtype)
+
+
+def get_channel_bits(bits, channels):
+    """
+    Gets the number of bits kept in each channel by bin_histogram
+    :param bits: an int for every channel, or a sequence with one per channel. channels past the end of the sequence
+                    keep all 8 bits, and values past the last channel are ignored, so (6, 6, 6, 4) works for RGB too
+    :param channels: the number of channels of the colors
+    :return: a tuple of ints from 1 to 8
+    """
+    bits = (bits,) * channels if isinstance(bits, int) else tuple(bits)[:channels]
+    bits += (8,) * (channels - len(bits))
+    if not all(1 <= value <= 8 for value in bits):
+        raise ValueError('bits per channel must be from 1 to 8: %s' % (bits,))
+    return bits
+
+
+def bin_histogram(keys, counts, channels, bits):
+    """
+    Merges similar colors of a histogram by keeping only the top bits of each channel, e.g. 5-5-5 or 6-6-6 with 4-bit
+    alpha. Each bin is represented by the weighted mean of its colors rather than its corner, so noisy images with
+    millions of distinct colors shrink to a few thousand points, while each color only moves a little
+    :param keys: sorted packed colors
+    :param counts: the count of each color
+    :param channels: the number of channels of the colors
+    :param bits: the bits kept in each channel (see get_channel_bits)
+    :return: a (colors, counts, error) tuple. colors is an (M, D) float array of the mean color of each bin, counts
+                are the total count of each bin as floats, and error is a dictionary with the number of 'bins', and
+                the largest ('max_error') and mean ('mean_error') euclidean distance a pixel moved to its bin's mean
+    """
+    colors = unpack_colors(keys, channels)
+    shifts = 8 - np.array(get_channel_bits(bits, channels))
+    _, inverse = np.unique(pack_colors(colors >> shifts), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    weights = np.asarray(counts, dtype=np.float64)
+
+    bin_counts = np.bincount(inverse, weights=weights)
+    sums = np.stack([np.bincount(inverse, weights=colors[:, d] * weights) for d in range(channels)], axis=1)
+    means = sums / bin_counts[:, None]
+
+    moved = np.sqrt(((colors - means[inverse]) ** 2).sum(axis=1))
+    error = {'bins': len(means),
+             'max_error': float(moved.max()) if len(moved) else 0.0,
+             'mean_error': float((moved * weights).sum() / weights.sum()) if len(moved) else 0.0}
+    return means, bin_counts, error
+
+
+# the header of a serialized ColorHistogram: a magic string, the format version, the channels and the number of colors
+_header = struct.Struct('<4sBBxxQ')
+_magic = b'CHST'
+_version = 1
+
+
+class ColorHistogram:
+    """
+    The distinct colors of an image and the number of times each occurs, as a sorted array of packed colors and a
+    parallel array of counts. With millions of distinct colors, this takes 12 bytes per color rather than the
+    hundreds a dictionary of tuples would, and the arrays can go straight to numpy
+    """
+
+    def __init__(self, keys, counts, channels):
+        """
+        :param keys: the sorted, distinct packed colors
+        :param counts: the number of times each color occurs
+        :param channels: the number of channels of the colors
+        """
+        self.keys = np.asarray(keys, dtype=np.uint32)
+        self.counts = np.asarray(counts)
+        self.channels = channels
+        # the unpacked colors, only created when needed
+        self._colors = None
+
+    @classmethod
+    def from_colors(cls, colors):
+        """
+        Counts the occurrences of each distinct color
+        :param colors: an (N, D) array or a list of n-tuples, with D <= 4 and values from 0 to 255
+        """
+        colors = np.asarray(colors)
+        return cls(*color_histogram(colors), colors.shape[1])
+
+    @classmethod
+    def from_packed(cls, packed, channels):
+        """
+        Counts the occurrences of each distinct packed color
+        :param packed: an (N,) array of packed colors, e.g. from pack_colors
+        """
+        keys, counts = np.unique(packed, return_counts=True)
+        return cls(keys, counts.astype(np.uint32), channels)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def colors(self):
+        """The distinct colors as an (N, D) float array, unpacked on first use"""
+        if self._colors is None:
+            self._colors = unpack_colors(self.keys, self.channels).astype(np.float64)
+        return self._colors
+
+    def total(self):
+        """Gets the number of pixels counted"""
+        return int(self.counts.sum())
+
+    def merge(self, other):
+        """
+        Adds two histograms together
+        :return: a new ColorHistogram, with uint64 counts
+        """
+        return ColorHistogram(*merge_histograms(self.keys, self.counts, other.keys, other.counts), self.channels)
+
+    def update(self, removed, added):
+        """
+        Removes and adds colors, without recounting the rest (see update_histogram)
+        :param removed: the packed colors to remove, one per pixel
+        :param added: the packed colors to add, one per pixel
+        :return: a new ColorHistogram
+        """
+        return ColorHistogram(*update_histogram(self.keys, self.counts, removed, added), self.channels)
+
+    def find(self, colors):
+        """
+        Finds colors in the histogram
+        :param colors: an (N, D) array of colors, or an (N,) array of packed colors
+        :return: an (N,) array with the index of each color in keys (and counts), or -1 if it isn't in the histogram
+        """
+        keys = np.asarray(colors)
+        if keys.ndim == 2:
+            keys = pack_colors(keys)
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.intp)
+        index = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[index] == keys, index, -1)
+
+    def count_of(self, colors):
+        """
+        Looks up the number of times colors occur
+        :param colors: an (N, D) array of colors, or an (N,) array of packed colors
+        :return: an (N,) array of counts, which are 0 for colors that aren't in the histogram
+        """
+        index = self.find(colors)
+        return np.where(index >= 0, self.counts[index], 0)
+
+    def __iter__(self):
+        """Goes through the (color tuple, count) pairs in key order, like the items of a Counter"""
+        return zip(map(tuple, unpack_colors(self.keys, self.channels).tolist()), self.counts.tolist())
+
+    def chunks(self, size):
+        """
+        Goes through the colors and their counts a slice at a time, for weighted work in bounded memory
+        :param size: the most colors in each slice
+        :return: a generator of (colors, counts) tuples, with an (n, D) float array of colors
+        """
+        for start in range(0, len(self.keys), size):
+            stop = start + size
+            yield unpack_colors(self.keys[start:stop], self.channels).astype(np.float64), self.counts[start:stop]
+
+    def bin(self, bits):
+        """Merges similar colors, keeping the top bits of each channel (see bin_histogram)"""
+        return bin_histogram(self.keys, self.counts, self.channels, bits)
+
+    def to_bytes(self):
+        """
+        Serializes the histogram as a small header followed by the little-endian keys and counts
+        :return: a bytes object for from_bytes
+        """
+        return (_header.pack(_magic, _version, self.channels, len(self.keys)) +
+                self.keys.astype('<u4').tobytes() + self.counts.astype('<u8').tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Reverses to_bytes. The counts come back as uint64"""
+        magic, version, channels, length = _header.unpack_from(data)
+        if magic != _magic or version != _version:
+            raise ValueError('not a serialized ColorHistogram')
+        keys = np.frombuffer(data, dtype='<u4', count=length, offset=_header.size)
+        counts = np.frombuffer(data, dtype='<u8', count=length, offset=_header.size + 4 * length)
+        return cls(keys.astype(np.uint32), counts.astype(np.uint64), channels)
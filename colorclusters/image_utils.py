@@ -1,53 +1,87 @@
-from PIL import Image, ImagePalette
-from .distance import euclidean
+from functools import lru_cache
+from PIL import Image
+import numpy as np
+from .distance import euclidean, has_batch
+from .palette_lookup import get_palette_lookup
 from .closest_color import map_pixels_to_closest_color_index
+from .progress import as_progress
+
+# the number of transparency grids kept by get_transparency_grid
+_grid_cache_size = 16
+
+
+def image_to_array(img):
+    """
+    Reads the pixels of an image without creating a Python object per pixel
+    :param img: an Image object. images that aren't RGB or RGBA are converted to RGBA (if they have transparency)
+                or RGB first
+    :return: a contiguous (height, width, channels) uint8 array
+    """
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    return np.asarray(img)
+
+
+def image_to_pixels(img):
+    """
+    Reads the pixels of an image as a list of colors, in the same order as img.getdata()
+    :param img: an Image object
+    :return: an (width * height, channels) uint8 array
+    """
+    array = image_to_array(img)
+    return array.reshape(-1, array.shape[-1])
 
 
 def map_index_to_paletted_image(size, index_data, colors):
     """
     Creates a paletted image from the given data
     :param size: an (x,y) tuple
-    :param index_data: a list of indexes of length x*y, corresponding to indexes in the color array
+    :param index_data: a list or array of indexes of length x*y, corresponding to indexes in the color array.
+                        a uint8 array is used as the image data without any conversion
     :param colors: a list of (r,g,b) or (r,g,b,a) tuples
     :return: a paletted image with the given pixel data
     """
     if not (0 < len(colors) <= 256):
         raise ValueError('Number of colors out of bounds')
 
-    # store the result in a paletted image
-    palette_image = Image.new('P', size)
+    # store the result in a paletted image, straight from the index bytes
+    index_data = np.ascontiguousarray(index_data, dtype=np.uint8)
+    palette_image = Image.frombuffer('P', size, index_data, 'raw', 'P', 0, 1)
 
     # if there's a transparency channel, it needs to be recorded in img.info
     if len(colors[0]) > 3:
         transparency = [0] * 256
-        transparency[0:len(colors)] = [color[3] for color in colors]
+        transparency[0:len(colors)] = [int(color[3]) for color in colors]
         palette_image.info['transparency'] = bytes(transparency)
 
-    # store the RGB channels in an ImagePalette
-    palette_data = [color[i] for i in range(3) for color in colors]
-    palette = ImagePalette.ImagePalette('RGB', palette_data, 3 * len(colors))
-
-    # use the indexed colors in the image palette
-    palette_image.putpalette(palette)
-    # record indexed data
-    palette_image.putdata(index_data)
+    # store the RGB channels of each color in the image palette
+    palette_image.putpalette([int(color[i]) for color in colors for i in range(3)], 'RGB')
 
     return palette_image
 
 
-def map_to_paletted_image(img, colors, distance=euclidean, output_queue=None):
+def map_to_paletted_image(img, colors, distance=euclidean, progress=None, cancel=None):
     """
     Converts an RGB or RGBA image to an Indexed-Color image.
     :param img: an Image object with 'RGB' or 'RGBA' mode
     :param colors: a list of 3-tuples (r,g,b) or 4-tuples (r,g,b,a) used as the color palette
     :param distance: the function used to compute the closest palette color for each pixel's color
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken. see closest_color.map_pixels_to_closest_color_index
     :return: an indexed-color image using the given colors for the palette
     """
     # palettes work off of RGB values, so the image must be in this format
     if img.mode not in ('RGB', 'RGBA'):
         raise ValueError('Incompatible image format')
 
-    index_data = map_pixels_to_closest_color_index(list(img.getdata()), colors, distance=distance, output_queue=output_queue)
+    pixels = image_to_pixels(img)
+    progress = as_progress(progress)
+    with progress.phase('Remapping pixels'):
+        if has_batch(distance) and len(colors) <= 256:
+            index_data = get_palette_lookup(colors, distance, pixels.shape[1]).lookup(pixels, progress)
+        else:
+            index_data = map_pixels_to_closest_color_index(pixels, colors, distance=distance, progress=progress,
+                                                           cancel=cancel)
 
     return map_index_to_paletted_image(img.size, index_data, colors)
 
@@ -66,14 +100,31 @@ def add_transparency_grid(img=None, *_, dest=(0,0), source=(0,0),
     elif size is None:
         size = img.size
 
-    # draw the grey grid
-    color_diff = color2-color1
-    bg_img = Image.new("RGBA", size)
-    bg_img.putdata(
-        [color1 + (x // grid_spacing + y // grid_spacing) % 2 * color_diff
-         for x in range(size[0]) for y in range(size[1])])
+    # copy the cached grey grid, since compositing draws on it
+    bg_img = get_transparency_grid(tuple(size), grid_spacing, color1, color2).copy()
 
     # draw the RGBA image on top of it
     if img is not None:
         bg_img.alpha_composite(img.convert('RGBA'),dest,source)
-    return bg_img
\ No newline at end of file
+    return bg_img
+
+@lru_cache(maxsize=_grid_cache_size)
+def get_transparency_grid(size, grid_spacing, color1, color2):
+    """
+    Draws a grid of grey squares. Results are cached, so don't draw on them
+    :param size: an (x,y) tuple
+    :param grid_spacing: the width of each square
+    :param color1: the color of the top left square, as a 0xAABBGGRR int
+    :param color2: the other color, as a 0xAABBGGRR int
+    :return: an RGBA image
+    """
+    # build one 2x2 block of squares, then repeat it over the whole image
+    tile = np.empty((2 * grid_spacing, 2 * grid_spacing, 4), dtype=np.uint8)
+    tile[:] = list(color1.to_bytes(4, 'little'))
+    tile[:grid_spacing, grid_spacing:] = list(color2.to_bytes(4, 'little'))
+    tile[grid_spacing:, :grid_spacing] = list(color2.to_bytes(4, 'little'))
+
+    rows = -(-size[1] // (2 * grid_spacing))
+    columns = -(-size[0] // (2 * grid_spacing))
+    grid = np.tile(tile, (rows, columns, 1))[:size[1], :size[0]]
+    return Image.fromarray(np.ascontiguousarray(grid), 'RGBA')
@@ -1,15 +1,44 @@
 from math import inf
-from random import randrange
-from collections import Counter
-from .distance import euclidean
-from .closest_color import get_closest_color_index, map_pixels_to_closest_color_index, get_sum_squared_error
+import numpy as np
+from .distance import euclidean, has_batch, closest_indices, closest_two, pairwise_distances
+from .histogram import ColorHistogram, can_pack, pack_colors, unpack_colors
+from .parallel import SharedArrays, create_worker_pool, split_shards, worker_state
+from .cancellation import as_token
+from .seeding import SEEDINGS, get_random, k_means_plus_plus
+from .closest_color import get_sum_squared_error
 
-can_use_choices = True
-try:
-    from random import choices
-except ImportError:
-    # if kmeans is run on python 3.5 or earlier, it wont have access to choices
-    can_use_choices = False
+# how much each mini-batch shift contributes to the smoothed shift_distance
+_batch_smoothing = 0.3
+
+def _sum_shard(start, stop, centroids):
+    """Counts and sums the clusters of one shard, in a worker process"""
+    points = worker_state['points'][start:stop]
+    weights = worker_state['weights'][start:stop] if 'weights' in worker_state else None
+    clustering = closest_indices(points, centroids, worker_state['distance'])
+    return cluster_sums(points, weights, clustering, worker_state['k_value'])
+
+
+def _as_point(point):
+    """Copies a point out of the data as a list, so array rows don't carry their integer type into the centroids"""
+    return np.asarray(point).tolist()
+
+
+def cluster_sums(points, weights, clustering, k_value):
+    """
+    Counts and sums the points in each cluster
+    :param points: an (N, D) array of points
+    :param weights: an (N,) array with the number of times each point occurs, or None if they all occur once
+    :param clustering: an (N,) array with the index of the cluster each point belongs to
+    :param k_value: the number of clusters
+    :return: a (count, sums) tuple of a (k,) array and a (k, D) array
+    """
+    # colors and counts are integers, so the sums are exact no matter what order they're added in
+    count = np.bincount(clustering, weights=weights, minlength=k_value)
+    if weights is not None:
+        points = points * weights[:, None]
+    sums = np.stack([np.bincount(clustering, weights=points[:, d], minlength=k_value)
+                     for d in range(points.shape[1])], axis=1)
+    return count, sums
 
 
 class KMeans:
@@ -17,75 +46,144 @@ class KMeans:
     Stores the state of the current iteration of K-Means. Allows more control over how the algorithm proceeds
     between iterations, and allows for more types of result data.
     """
-    def __init__(self, k_value, datapoints, distance=euclidean, use_histogram=True, use_kmeans_plus_plus=False):
+    def __init__(self, k_value, datapoints, distance=euclidean, use_histogram=True, use_kmeans_plus_plus=False,
+                 batch_size=None, learning_rate=None, use_bounds=False, workers=None, weights=None, cancel=None,
+                 seeding=None, random_state=None, initial_centroids=None):
         """
         Begins the K-Means algorithm on the given datapoints.
         :param k_value: the number of clusters to split the data into
-        :param datapoints: the data to be clustered
+        :param datapoints: the data to be clustered, as a list of n-tuples or an (N, D) array
+                            (e.g. from image_utils.image_to_pixels), or a ColorHistogram of the distinct colors
         :param distance: the distance formula used to determine which cluster a point belongs in
+        :param batch_size: if given, each iteration only samples this many points (see shift_centroids_mini_batch)
+        :param learning_rate: a function taking the iteration number and returning how far (0 to 1) each centroid
+                                moves towards its mini-batch average. by default each centroid moves by
+                                (points in this batch / points it has seen in total), keeping it at a running average
+        :param use_bounds: True to skip distance computations that the triangle inequality proves unnecessary
+                            (see assign_with_bounds). Only used if the distance is a metric with a batch form.
+                            can't be combined with batch_size or workers, which don't keep bounds
+        :param workers: if given, each iteration is split across this many worker processes
+                            (see shift_centroids_sharded). call close() to stop them once done
+        :param weights: the number of times each datapoint occurs, if the datapoints are already distinct points
+                            (e.g. from histogram.bin_histogram). the histogram is always used in this case
+        :param cancel: a CancelToken checked while choosing the initial centroids. if it's cancelled part way through
+                        K-Means++, the remaining centroids are chosen randomly
+        :param seeding: how the initial centroids are chosen: 'random', 'k-means++', 'k-means||' or 'median-cut'
+                        (see seeding.py). by default, 'k-means++' if use_kmeans_plus_plus is True, and 'random' otherwise
+        :param random_state: an int seed or numpy Generator for every random choice made, so runs can be repeated
+        :param initial_centroids: k centroids to start from instead of seeding, e.g. the centroids found for the
+                                    previous frame of an animation. similar data then converges in an iteration or two
         """
+        # the histogram of the distinct colors, when the data are colors and it's needed
+        self.histogram = None
+        if isinstance(datapoints, ColorHistogram):
+            self.histogram = datapoints
+            datapoints, weights = datapoints.colors, datapoints.counts
         # to prevent things breaking on empty data, adds one point
         if len(datapoints) == 0:
             datapoints = [(0, 0, 0)]
+            weights = None
 
         self.k_value = k_value
         self.data = datapoints
-        self.use_histogram = use_histogram
+        # the data as a float array. only created when the histogram isn't used
+        self.data_array = None
+        # the distinct points of the data, and the index of each datapoint among them. only found when the
+        # clustering of the data itself is needed
+        self.unique_points = None
+        self.unique_inverse = None
+        # the datapoints of a histogram can't be clustered without their weights
+        self.use_histogram = use_histogram or weights is not None
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        # the number of mini-batch iterations run so far
+        self.iteration = 0
+        # the initial centroids and mini-batches are sampled using numpy's random generator
+        self.random = get_random(random_state)
+        if seeding is None:
+            seeding = 'k-means++' if use_kmeans_plus_plus else 'random'
+        elif seeding != 'random' and seeding not in SEEDINGS:
+            raise ValueError('unknown seeding: %s' % seeding)
+        if use_bounds and (batch_size or workers):
+            raise ValueError('use_bounds can not be combined with batch_size or workers')
+        if initial_centroids is not None and len(initial_centroids) != k_value:
+            raise ValueError('expected %d initial centroids, got %d' % (k_value, len(initial_centroids)))
+        self.seeding = seeding
 
-        # k_means_plus_plus requires the histogram and a list of unique points
-        if use_histogram or use_kmeans_plus_plus:
-            self.histogram = self.create_histogram()
-            if use_kmeans_plus_plus:
-                self.unique = list(self.histogram)
+        # k_means_plus_plus and mini-batches require the histogram of unique points
+        self.histogram_counts = None
+        if weights is not None:
+            self.histogram_counts = np.asarray(weights)
+            self.histogram_colors = np.asarray(datapoints, dtype=np.float64)
+        elif self.use_histogram or batch_size or (seeding != 'random' and initial_centroids is None):
+            self.histogram, self.histogram_colors, self.histogram_counts = self.create_histogram()
+        # the running total of the counts, which mini-batches are sampled from. the counts never change, so it's
+        # only added up once
+        self.cumulative_counts = None
+        if batch_size:
+            self.cumulative_counts = np.cumsum(self.histogram_counts, dtype=np.float64)
 
         self.dist = distance
         # the dimensionality of the data space. typically 3 for RGB or 4 for RGBA
         self.dimensions = len(datapoints[0])
         # the distance each centroid moved after the previous iteration of the algorithm
         self.shift_distance = [inf] * k_value
+        # the number of sampled points each centroid has absorbed. only used by mini-batches
+        self.batch_counts = np.zeros(k_value)
+        # the bounds need the triangle inequality to hold
+        self.use_bounds = use_bounds and getattr(distance, 'is_metric', False) and has_batch(distance)
+        # for each point: its centroid, an upper bound on the distance to it,
+        # and a lower bound on the distance to every other centroid. None until the first bounded assignment
+        self.bound_clustering = None
+        self.upper_bounds = None
+        self.lower_bounds = None
+        # the number of point-to-centroid distances computed while shifting the centroids
+        self.distance_evaluations = 0
+        # the worker processes, their shared memory, and the (start, stop) range of each shard. started on demand
+        self.workers = workers
+        self.pool = None
+        self.shared = None
+        self.shards = None
         # the index of the centroid each data point maps to. stored to avoid repeated computation
         self.clustering = None
         # the Sum Squared Error of the current clustering. only computed when needed
         self.error = None
-        # the centers of each cluster. Initially chosen randomly
-        if use_kmeans_plus_plus:
-            self.k_means_plus_plus()
+        self.cancel = as_token(cancel)
+        # the centers of each cluster
+        if initial_centroids is not None:
+            self.centroids = [_as_point(centroid) for centroid in initial_centroids]
+        elif seeding == 'random' and weights is not None:
+            # each distinct point stands for as many pixels as its count, so it's picked that much more often
+            counts = np.asarray(weights, dtype=np.float64)
+            picks = self.random.choice(len(datapoints), size=k_value, p=counts / counts.sum())
+            self.centroids = [_as_point(datapoints[i]) for i in picks]
+        elif seeding == 'random':
+            self.centroids = [_as_point(datapoints[i]) for i in self.random.integers(len(datapoints), size=k_value)]
         else:
-            self.centroids = [datapoints[randrange(len(datapoints))] for i in range(k_value)]
+            # k-means|| can split its passes across the workers too
+            options = {'workers': workers} if seeding == 'k-means||' else {}
+            self.centroids = SEEDINGS[seeding](self.histogram_colors, self.histogram_counts, k_value, distance,
+                                               self.random, cancel=self.cancel, **options).tolist()
 
     def k_means_plus_plus(self):
         """Uses weighted probability to choose the initial centroids"""
-        if not can_use_choices:
-            # we need access to the random choices method for this implementation to run
-            self.centroids = [self.data[randrange(len(self.data))] for i in range(self.k_value)]
-            return
-
-        self.centroids = []
-
-        #pick a first point
-        point = self.data[randrange(len(self.data))]
-        self.centroids.append(point)
-        weights = [(self.dist(point,x)**2) * self.histogram[x] for x in self.unique]
-
-        for i in range(1,self.k_value):
-            point = choices(self.unique,weights)[0]
-            self.centroids.append(point)
-            #update new weights
-            for j,x in enumerate(self.unique):
-                weight = (self.dist(point,x)**2) * self.histogram[x]
-                if weight < weights[j]:
-                    weights[j] = weight
+        self.centroids = k_means_plus_plus(self.histogram_colors, self.histogram_counts, self.k_value, self.dist,
+                                           self.random, self.cancel).tolist()
 
     def create_histogram(self):
-        """gets the counts of items in data."""
-
-        # histogram = {}
-        # for pixel in self.data:
-        #     histogram[pixel] = histogram.get(pixel, 0) + 1
-        # return histogram
+        """
+        Counts the distinct points of the data
+        :return: a (histogram, points, counts) tuple. histogram is a ColorHistogram if the data are colors, and None
+                    otherwise. points is an (N, D) float array of the distinct points, unpacked once so every
+                    iteration can reuse them, and counts is the number of times each occurs
+        """
+        if can_pack(self.data):
+            histogram = ColorHistogram.from_colors(self.data)
+            return histogram, histogram.colors, histogram.counts
 
-        # supposedly Counter is more efficient
-        return Counter(self.data)
+        # data that doesn't fit in a packed key is made unique row by row instead
+        points, counts = np.unique(np.asarray(self.data, dtype=np.float64), axis=0, return_counts=True)
+        return None, points, counts.astype(np.uint32)
 
     def compute_until_predicate(self, predicate, debug=False):
         """
@@ -110,57 +208,150 @@ class KMeans:
         Computes one iteration of K-means, and shifts the centroids to a better position.
         Uses the histogram to improve efficiency
         """
-        centroids = [[0] * self.dimensions for i in range(self.k_value)]
-        count = [0] * self.k_value
+        if self.use_bounds:
+            clustering = self.assign_with_bounds(self.histogram_colors)
+        else:
+            clustering = closest_indices(self.histogram_colors, self.centroids, self.dist)
+            self.distance_evaluations += len(self.histogram_colors) * self.k_value
+        self.move_centroids(self.histogram_colors, self.histogram_counts, clustering)
+
+    def shift_centroids(self):
+        """Computes one iteration of K-means, and shifts the centroids to a better position"""
+        if self.batch_size:
+            self.shift_centroids_mini_batch()
+            return
+        if self.workers:
+            self.shift_centroids_sharded()
+            return
+        if self.use_histogram:
+            self.shift_centroids_histogram()
+            return
+
+        if self.data_array is None:
+            # converted once, rather than on every iteration
+            self.data_array = np.asarray(self.data, dtype=np.float64)
+        if self.use_bounds:
+            clustering = self.assign_with_bounds(self.data_array)
+        else:
+            clustering = self.get_clustering()
+            self.distance_evaluations += len(self.unique_points) * self.k_value
+        self.move_centroids(self.data_array, None, clustering)
+
+    def assign_with_bounds(self, points):
+        """
+        Finds the closest centroid to each point, using Hamerly's bounds to skip most of the distance computations.
+        Each point keeps an upper bound on the distance to its centroid, and a lower bound on the distance to
+        every other centroid. When the centroids move, the bounds are loosened by shift_distance. A point whose
+        upper bound is below its lower bound, or below half the distance from its centroid to the nearest other
+        centroid, can't have changed clusters, so the result is the same as comparing against every centroid.
+        :param points: an (N, D) array. must be the same points on every call
+        :return: an (N,) array with the index of the closest centroid to each point
+        """
+        centroids = np.asarray(self.centroids, dtype=np.float64)
+        if self.bound_clustering is None:
+            self.bound_clustering, self.upper_bounds, self.lower_bounds = closest_two(points, centroids, self.dist)
+            self.distance_evaluations += len(points) * self.k_value
+            return self.bound_clustering
 
-        # count and sum each cluster set in preparation for averaging
-        for pixel in self.histogram:
-            i = get_closest_color_index(pixel,self.centroids, self.dist)
-            count[i] += self.histogram[pixel]
-            for d in range(self.dimensions):
-                centroids[i][d] += pixel[d]*self.histogram[pixel]
+        # the previous iteration's shifts loosen the bounds. a point's lower bound is on the other centroids, so it only
+        # loosens by the furthest any other centroid moved: the largest shift, or the second largest for the point
+        # whose own centroid moved furthest
+        shift = np.asarray(self.shift_distance, dtype=np.float64)
+        self.upper_bounds += shift[self.bound_clustering]
+        furthest = int(shift.argmax())
+        others = np.delete(shift, furthest)
+        other_shift = np.where(self.bound_clustering == furthest, others.max() if len(others) else 0, shift[furthest])
+        self.lower_bounds -= other_shift
 
-        # take the average of all points in the cluster
+        # half the distance from each centroid to its nearest neighbour
+        centroid_distance = pairwise_distances(centroids, centroids, self.dist)
+        np.fill_diagonal(centroid_distance, np.inf)
+        half_gap = centroid_distance.min(axis=1) / 2
+        self.distance_evaluations += self.k_value * (self.k_value - 1) // 2
+
+        # a point on the limit may be tied with another centroid, and ties go to the lowest index like closest_indices,
+        # so only points strictly inside it are skipped
+        limit = np.maximum(half_gap[self.bound_clustering], self.lower_bounds)
+        candidates = np.flatnonzero(self.upper_bounds >= limit)
+        # tighten the upper bound, and check again before comparing against every centroid
+        self.upper_bounds[candidates] = self.dist.batch(points[candidates],
+                                                        centroids[self.bound_clustering[candidates]])
+        self.distance_evaluations += len(candidates)
+        candidates = candidates[self.upper_bounds[candidates] >= limit[candidates]]
+
+        clustering, closest, second = closest_two(points[candidates], centroids, self.dist)
+        self.bound_clustering[candidates] = clustering
+        self.upper_bounds[candidates] = closest
+        self.lower_bounds[candidates] = second
+        self.distance_evaluations += len(candidates) * self.k_value
+        return self.bound_clustering
+
+    def shift_centroids_mini_batch(self):
+        """
+        Computes one iteration of mini-batch K-means. Samples batch_size points from the histogram, weighted by their
+        counts, and moves each centroid part of the way towards the average of its sampled points.
+        Since one batch is noisy, shift_distance holds a smoothed shift, so that convergence tests like
+        compute_until_max_distance still behave.
+        """
+        self.iteration += 1
+        # sample pixels by searching the cumulative counts, so common colors are picked more often
+        cumulative = self.cumulative_counts
+        samples = np.searchsorted(cumulative, self.random.random(self.batch_size) * cumulative[-1], side='right')
+        points = self.histogram_colors[samples]
+        clustering = closest_indices(points, self.centroids, self.dist)
+
+        count = np.bincount(clustering, minlength=self.k_value)
+        sums = np.stack([np.bincount(clustering, weights=points[:, d], minlength=self.k_value)
+                         for d in range(self.dimensions)], axis=1)
+        self.batch_counts += count
+
+        centroids = []
         for i in range(self.k_value):
-            # if none of the points were closest to this point, leave it where it is
             if count[i] == 0:
-                centroids[i] = self.centroids[i]
-                self.shift_distance[i] = 0
-                continue
-            for d in range(self.dimensions):
-                centroids[i][d] /= count[i]
-            self.shift_distance[i] = self.dist(self.centroids[i], centroids[i])
+                centroids.append(self.centroids[i])
+                shift = 0
+            else:
+                if self.learning_rate is None:
+                    rate = count[i] / self.batch_counts[i]
+                else:
+                    rate = self.learning_rate(self.iteration)
+                old = np.asarray(self.centroids[i], dtype=np.float64)
+                centroids.append((old + rate * (sums[i] / count[i] - old)).tolist())
+                shift = self.dist(self.centroids[i], centroids[i])
+            # smooth the shift over recent batches. the first batch has nothing to smooth against
+            if self.shift_distance[i] == inf:
+                self.shift_distance[i] = shift
+            else:
+                self.shift_distance[i] += _batch_smoothing * (shift - self.shift_distance[i])
 
-        # update the centroids to the new averages
         self.centroids = centroids
-        # we don't know the new derived values for this set of centroids
         self.clustering = None
         self.error = None
 
-    def shift_centroids(self):
-        """Computes one iteration of K-means, and shifts the centroids to a better position"""
-        if self.use_histogram:
-            self.shift_centroids_histogram()
-            return
-
-        centroids = [[0] * self.dimensions for i in range(self.k_value)]
-        count = [0] * self.k_value
-
-        # count and sum each cluster set in preparation for averaging
-        for i, pixel in zip(self.get_clustering(), self.data):
-            count[i] += 1
-            for d in range(self.dimensions):
-                centroids[i][d] += pixel[d]
+    def move_centroids(self, points, weights, clustering):
+        """
+        Moves each centroid to the weighted average of the points in its cluster
+        :param points: an (N, D) array of points
+        :param weights: an (N,) array with the number of times each point occurs, or None if they all occur once
+        :param clustering: an (N,) array with the index of the centroid each point belongs to
+        """
+        self.move_to_averages(*cluster_sums(points, weights, clustering, self.k_value))
 
+    def move_to_averages(self, count, sums):
+        """
+        Moves each centroid to the average of its cluster
+        :param count: a (k,) array with the (weighted) number of points in each cluster
+        :param sums: a (k, D) array with the (weighted) sum of the points in each cluster
+        """
         # take the average of all points in the cluster
+        centroids = []
         for i in range(self.k_value):
             # if none of the points were closest to this point, leave it where it is
             if count[i] == 0:
-                centroids[i] = self.centroids[i]
+                centroids.append(self.centroids[i])
                 self.shift_distance[i] = 0
                 continue
-            for d in range(self.dimensions):
-                centroids[i][d] /= count[i]
+            centroids.append((sums[i] / count[i]).tolist())
             self.shift_distance[i] = self.dist(self.centroids[i], centroids[i])
 
         # update the centroids to the new averages
@@ -169,17 +360,87 @@ class KMeans:
         self.clustering = None
         self.error = None
 
+    def shift_centroids_sharded(self):
+        """
+        Computes one iteration of K-means across the worker processes. Each worker sums the clusters of its own
+        shard of the histogram (or data), and the partial sums are added together in shard order.
+        """
+        if self.pool is None:
+            self.start_workers()
+
+        centroids = np.asarray(self.centroids, dtype=np.float64)
+        futures = [self.pool.submit(_sum_shard, start, stop, centroids) for start, stop in self.shards]
+        count = np.zeros(self.k_value)
+        sums = np.zeros((self.k_value, self.dimensions))
+        # reduce in a fixed order, so the result doesn't depend on which worker finishes first
+        for future in futures:
+            shard_count, shard_sums = future.result()
+            count += shard_count
+            sums += shard_sums
+        self.move_to_averages(count, sums)
+
+    def start_workers(self):
+        """Shares the histogram (or data) with a new pool of worker processes, split into one shard per worker"""
+        if self.use_histogram:
+            self.shared = SharedArrays(points=self.histogram_colors, weights=self.histogram_counts)
+            num_points = len(self.histogram_colors)
+        else:
+            if self.data_array is None:
+                self.data_array = np.asarray(self.data, dtype=np.float64)
+            self.shared = SharedArrays(points=self.data_array)
+            num_points = len(self.data_array)
+
+        self.shards = split_shards(num_points, self.workers)
+        self.pool = create_worker_pool(self.workers, self.shared, distance=self.dist, k_value=self.k_value)
+
+    def close(self):
+        """Stops the worker processes and frees their shared memory. Safe to call if no workers were started"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get_unique_points(self):
+        """
+        Finds the distinct points of the data, so each is only matched once per iteration
+        :return: a (points, inverse) tuple. points is an (M, D) float array, and inverse the index in it of each
+                    datapoint
+        """
+        if self.unique_points is None:
+            if can_pack(self.data):
+                keys, inverse = np.unique(pack_colors(self.data), return_inverse=True)
+                points = unpack_colors(keys, self.dimensions).astype(np.float64)
+            else:
+                points, inverse = np.unique(np.asarray(self.data, dtype=np.float64), axis=0, return_inverse=True)
+            self.unique_points, self.unique_inverse = points, inverse.reshape(-1)
+        return self.unique_points, self.unique_inverse
+
     def get_clustering(self):
         """Gets the closest-color index for each pixel of data for the current centroids."""
         # dont re-compute the clustering if it's already been computed
         if self.clustering is None:
-            self.clustering = map_pixels_to_closest_color_index(self.data, self.centroids, distance=self.dist)
+            # the centroids change every iteration, so a PaletteLookup table for them wouldn't be used again
+            points, inverse = self.get_unique_points()
+            self.clustering = closest_indices(points, self.centroids, self.dist)[inverse]
         return self.clustering
 
     def get_sum_square_error(self):
-        """Calculates the Sum Square Error of the current clustering."""
+        """Calculates the Sum Square Error of the current clustering. Uses the histogram if there is one"""
         if self.error is None:
-            self.error = get_sum_squared_error(self.data, self.clustering, self.centroids, self.dist)
+            if self.histogram_counts is not None:
+                clustering = closest_indices(self.histogram_colors, self.centroids, self.dist)
+                self.error = get_sum_squared_error(self.histogram_colors, clustering, self.centroids, self.dist,
+                                                   self.histogram_counts)
+            else:
+                self.error = get_sum_squared_error(self.data, self.get_clustering(), self.centroids, self.dist)
         return self.error
 
     def get_exact_centroids(self):
@@ -1,33 +1,67 @@
+from concurrent.futures import as_completed
+from itertools import product
+import numpy as np
 from colorclusters import distance
+from colorclusters.cancellation import as_token
+from colorclusters.histogram import ColorHistogram, can_pack
+from colorclusters.parallel import SharedArrays, create_worker_pool, worker_state
+from colorclusters.progress import as_progress
 from datastructures.EuclideanSpace import EuclideanSpace
 
+# the most centroids mine will start with
+_max_seeds = 4096
+# the least fraction of the pixels a cell must hold for occupancy seeding to start a centroid there
+_min_seed_support = 0.0002
+# the most colours mine will return
+_max_colors = 256
+# a centroid stops once this fraction of the weight around it is around one settled centroid
+_max_claimed = 0.95
 
-def mine(points, output_thread, distance_alg=distance.euclidean, min_movement=3, max_centroids=256):
+
+def mine(points, progress=None, distance_alg=distance.euclidean, min_movement=3, max_centroids=256, workers=None,
+         weights=None, cancel=None, seeding='occupancy', max_seeds=_max_seeds, min_seed_support=_min_seed_support,
+         reuse_basins=False):
     """
     Uses the mean-shift algorithm to produce the set of average points that best represents the points given
-    :param points: The points to be mined
-    :param output_thread: 
+    :param points: The points to be mined, or a ColorHistogram of the distinct colors
+    :param progress: a Progress to report to, or a queue for text updates. counts the points tested against
+                        spheres as 'distance evaluations' (only when running in this process)
     :param distance_alg: Distance algorithm used in calculation
-    :param max_centroids: The number of centroids to start mining with. Defaults to 256 as that is the maximum
-                                number of colours image_utils.map_to_paletted_images will accept
+    :param max_centroids: The number of centroids in the lattice (at most 4096), which also sets the radius of the
+                                spheres. If more than 256 distinct colours are found, only the 256 with the most
+                                support are kept, as that is the maximum number of colours
+                                image_utils.map_to_paletted_images will accept
+    :param workers: if given, the centroids are moved in parallel by this many worker processes
+    :param weights: the number of times each point occurs. if not given, repeated points are counted up first,
+                        so the work depends on the number of distinct points rather than the total
+    :param cancel: a CancelToken. once it's cancelled, the centroid being moved stops where it is and the rest of the
+                    starting centroids are dropped, so the colours found so far are returned
+    :param seeding: where the centroids start. 'occupancy' starts one in each lattice-sized cell that holds enough
+                        of the points (see occupied_cell_seeds), and 'lattice' spreads them evenly over the whole space
+    :param max_seeds: the most centroids occupancy seeding starts, keeping the cells with the most points
+    :param min_seed_support: the least fraction of the points a cell must hold for occupancy seeding to use it
+    :param reuse_basins: True to stop centroids early once they're headed for a colour that's already been found
+                            (see Basins). this saves some of the searches, but can lose a few colours, so it's off by
+                            default. only used without workers, since the workers can't share what they've found
     :return: A list of colours that best represent the image
     """
+    cancel = as_token(cancel)
 
+    progress = as_progress(progress)
     min_movement = int(min_movement)
     max_centroids = int(max_centroids)
-    if max_centroids > 256 or max_centroids < 16:
+    if max_centroids > _max_seeds or max_centroids < 16:
         raise ValueError
+    if isinstance(points, ColorHistogram):
+        points, weights = points.colors, points.counts
+    elif weights is None:
+        points, weights = get_unique_points(points)
+    points = np.asarray(points)
     num_dimensions = len(points[0])
 
     # determine the size of the space. This assumes the space is dimensionally symmetric
-    space_max = points[0][0]
-    space_min = points[0][0]
-    for point in points:
-        for dimension in point:
-            if dimension > space_max:
-                space_max = dimension
-            if dimension < space_min:
-                space_min = dimension
+    space_max = points.max().item()
+    space_min = points.min().item()
 
     space_length = space_max - space_min + 1
 
@@ -41,16 +75,69 @@ def mine(points, output_thread, distance_alg=distance.euclidean, min_movement=3,
     # map the spheres into the euclidean space
     # The radius is chosen such that spheres will be as large as possible without any two spheres overlapping initially
     radius = space_length/spheres_per_dimension/2
-    centroids = map_centroids_into_space(radius, spheres_per_dimension, num_dimensions, space_min)
-    space = EuclideanSpace(points, spheres_per_dimension, space_min, space_max)
+    if seeding == 'lattice':
+        centroids = map_centroids_into_space(radius, spheres_per_dimension, num_dimensions, space_min)
+    elif seeding == 'occupancy':
+        # the cells are as wide as the spheres, so the seeds are no closer together than the lattice's
+        centroids = occupied_cell_seeds(points, weights, 2 * radius, min_seed_support, max_seeds)
+    else:
+        raise ValueError('unknown seeding: %s' % seeding)
+    progress.count('seeds', len(centroids))
+    space = EuclideanSpace(points, spheres_per_dimension, space_min, space_max, weights)
 
-    final_centroids = mine_final_centroids(space, centroids, distance_alg, radius, min_movement, output_thread)
+    final_centroids, _ = mine_final_centroids(space, centroids, distance_alg, radius, min_movement, progress, workers,
+                                              cancel, reuse_basins)
+    if not final_centroids:
+        # cancelled before any centroid found its points, so the best we can do is the average colour
+        weights = np.asarray(weights, dtype=np.float64)
+        final_centroids = [((points * weights[:, None]).sum(axis=0) / weights.sum()).tolist()]
+    # the centroids are sorted by support, so the strongest colours are kept
+    final_centroids = final_centroids[:_max_colors]
     for centroid in final_centroids:
         for i in range(len(centroid)):
             centroid[i] = int(centroid[i])
     return final_centroids
 
 
+def get_unique_points(points):
+    """
+    Counts the occurrences of each distinct point
+    :param points: an (N, D) array or a list of n-tuples
+    :return: a (unique points, counts) tuple of arrays
+    """
+    if can_pack(points):
+        histogram = ColorHistogram.from_colors(points)
+        return histogram.colors, histogram.counts
+    return np.unique(np.asarray(points), axis=0, return_counts=True)
+
+
+def occupied_cell_seeds(points, weights, cell_size, min_support=_min_seed_support, max_seeds=_max_seeds):
+    """
+    Starts centroids only where there are points, rather than over the whole space. The points are binned into a grid
+    of cell_size cells laid over their own bounding box (which can be a different size in each dimension), and every
+    cell holding enough of the weight gets one centroid, at the weighted average of its points. On sparse palettes
+    like logos, most of the space is empty, so this starts far fewer centroids than the lattice does, and none of
+    them start in empty space
+    :param points: an (N, D) array of distinct points
+    :param weights: the number of times each point occurs
+    :param cell_size: the width of each cell
+    :param min_support: the least fraction of the total weight a cell must hold
+    :param max_seeds: the most centroids. the cells with the most weight are kept
+    :return: a list of centroids, from the most supported cell to the least
+    """
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    cells = np.floor((points - points.min(axis=0)) / cell_size).astype(np.intp)
+    cell_ids, inverse = np.unique(np.ravel_multi_index(cells.T, tuple(cells.max(axis=0) + 1)), return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    totals = np.bincount(inverse, weights=weights)
+    sums = np.stack([np.bincount(inverse, weights=points[:, d] * weights) for d in range(points.shape[1])], axis=1)
+    keep = np.flatnonzero(totals >= min_support * weights.sum())
+    keep = keep[np.argsort(-totals[keep], kind='stable')][:max_seeds]
+    return (sums[keep] / totals[keep, None]).tolist()
+
+
 def map_centroids_into_space(radius, spheres_per_dimension, num_dimensions, space_min):
     """
     Creates initial potential centroids equally spaced throughout the euclidian space
@@ -89,47 +176,229 @@ def increment_counters(array, max_val):
         i += 1
 
 
-def mine_final_centroids(space, centroids, distance_alg, radius, min_movement, output_thread):
-    final_centroids = []
-    for i in range(len(centroids)):
-        output_thread.put("Moving centroid %d of %d" % (i+1, len(centroids)))
-        settled = False
-        current_centroid = centroids[i]
-        iteration = 1
-        while not settled:
-            potential_points_in_sphere = space.get_points_in_range(current_centroid, radius)
-            points_in_sphere = get_points_in_sphere(potential_points_in_sphere, current_centroid, distance_alg, radius)
-            if len(points_in_sphere) is 0:
-                break
-            average = get_average_of_points(points_in_sphere)
-            distance_moved = distance_alg(average, current_centroid)
-            current_centroid = average
-            output_thread.put("Moving centroid %d of %d\nIteration: %d, Shift: %.2f" % (i+1, len(centroids), iteration, distance_moved))
-            iteration += 1
-            if distance_moved < min_movement:
-                final_centroids.append(current_centroid)
-                settled = True
-
-    output_thread.put("Pruning similar centroids")
-    prune_similar_points_by_distance(final_centroids, distance_alg, min_movement)
-    output_thread.put("%d distinct colors found\nDrawing new image" % len(final_centroids))
-    return final_centroids
+def mine_final_centroids(space, centroids, distance_alg, radius, min_movement, progress, workers=None, cancel=None,
+                         reuse_basins=False):
+    """
+    Moves each centroid until it settles, then merges the ones that settled on the same colour
+    :param progress: a Progress (or NO_PROGRESS)
+    :param cancel: a CancelToken. centroids that haven't started moving by the time it's cancelled are left out
+    :param reuse_basins: True to stop centroids that are headed for an already settled centroid (see Basins).
+                            ignored with workers
+    :return: a (centroids, supports) tuple. supports holds the weight of the points around each centroid, and both
+                are sorted from the most supported centroid to the least
+    """
+    with progress.phase('Moving centroids'):
+        if workers:
+            settled = move_centroids_in_parallel(space, centroids, distance_alg, radius, min_movement, progress,
+                                                 workers, cancel)
+        else:
+            basins = Basins(space, distance_alg, min_movement) if reuse_basins else None
+            settled = []
+            for i, centroid in enumerate(centroids):
+                if cancel is not None and cancel.is_cancelled():
+                    break
+                settled.append(move_centroid(space, centroid, distance_alg, radius, min_movement, progress,
+                                             i / len(centroids), cancel, basins))
+    # centroids that ran out of points, or stopped in a settled centroid's basin, don't make it into the result
+    settled = [result for result in settled if result is not None]
+
+    with progress.phase('Pruning similar centroids'):
+        final_centroids, supports = merge_similar_centroids([centroid for centroid, _ in settled],
+                                                            [support for _, support in settled],
+                                                            distance_alg, min_movement)
+    progress.count('centroids settled', len(settled))
+    progress.report('Pruning similar centroids', 1, message='%d distinct colors found' % len(final_centroids),
+                    final=True)
+    return final_centroids, supports
 
 
-def get_points_in_sphere(points, center, distance_alg, radius):
+def move_centroid(space, centroid, distance_alg, radius, min_movement, progress=None, fraction=None, cancel=None,
+                  basins=None):
     """
-    Find all the points within a radius of the center
-    :param points: The entire set of points in the space
-    :param center: The center of the sphere
-    :param distance_alg: The distance algorithm to use
-    :param radius: the radius of the sphere
-    :return: The set of points within the sphere
+    Moves a centroid to the average of the points around it until it settles
+    :param space: a EuclideanSpace holding the points
+    :param centroid: the starting point
+    :param progress: a Progress to report each iteration to, or None
+    :param fraction: how much of the 'Moving centroids' phase was done before this centroid, for the reports
+    :param cancel: a CancelToken. if it's cancelled, the centroid stops where it is
+    :param basins: the Basins of the centroids settled so far, or None. if the centroid enters one, it stops there,
+                    and if it settles, its path is added as a new basin
+    :return: a (centroid, support) tuple with the settled centroid and the weight of the points around it, or None
+                if it ended up with no points around it, or stopped in a basin. that basin's centroid is already in
+                the results with its own support, so counting it again would count the same points twice
     """
-    points_in_sphere = []
-    for point in points:
-        if distance_alg(point, center) <= radius:
-            points_in_sphere.append(point)
-    return points_in_sphere
+    path = []
+    iteration = 1
+    while True:
+        if basins is not None:
+            if basins.find(centroid) is not None:
+                if progress is not None:
+                    progress.count('centroids captured')
+                return None
+            path.append(centroid)
+        inside = get_indexes_in_sphere(space, centroid, distance_alg, radius, progress)
+        if len(inside) == 0:
+            return None
+        average, support = get_weighted_average(space, inside)
+        if basins is not None:
+            if basins.find_claimed(inside, support) is not None:
+                if progress is not None:
+                    progress.count('centroids captured')
+                return None
+        distance_moved = distance_alg(average, centroid)
+        centroid = average
+        if progress is not None and progress.enabled:
+            progress.report('Moving centroids', fraction, iteration, distance_moved)
+        iteration += 1
+        if distance_moved < min_movement or (cancel is not None and cancel.is_cancelled()):
+            if basins is not None:
+                basins.add(path + [centroid], centroid, support, inside)
+            return centroid, support
+
+
+class Basins:
+    """
+    Remembers where the settled centroids came from, so later centroids headed the same way can stop early. Mean
+    shift is deterministic, so a centroid that comes within capture_distance of a window on a settled centroid's path
+    has almost the same points around it, and will follow the path to the same colour. A centroid whose window is
+    almost all points already around a settled centroid is about to settle on it too. Either way it's attributed to
+    that centroid, which is already in the results with the weight of its own window
+    """
+
+    def __init__(self, space, distance_alg, capture_distance, max_claimed=_max_claimed):
+        """
+        :param space: the EuclideanSpace the centroids move through
+        :param capture_distance: how close a centroid must come to a settled centroid's path to stop. mine uses
+                                    min_movement, the distance under which centroids are merged anyway
+        :param max_claimed: the fraction of a window's weight that must be around one settled centroid to stop there
+        """
+        self.space = space
+        self.distance_alg = distance_alg
+        self.capture_distance = capture_distance
+        self.max_claimed = max_claimed
+        # the settled (centroid, support) results, and which of them each point of the space settled around
+        self.results = []
+        self.owners = np.full(len(space.points), -1, dtype=np.intp)
+        # the windows on the settled centroids' paths, and the result each one led to
+        self.windows = []
+        self.window_results = []
+        # the windows are bucketed into capture_distance sized cells, like merge_similar_centroids
+        self.use_grid = distance.is_at_least_chebyshev(distance_alg) and self.capture_distance > 0
+        self.cells = {}
+
+    def add(self, path, centroid, support, inside):
+        """
+        Records a settled centroid
+        :param path: the centres of the windows it moved through, ending with where it settled
+        :param inside: the indexes of the points in its final window
+        """
+        result = len(self.results)
+        self.results.append((centroid, support))
+        unclaimed = inside[self.owners[inside] < 0]
+        self.owners[unclaimed] = result
+        for window in path:
+            if self.use_grid:
+                self.cells.setdefault(get_grid_cell(window, self.capture_distance), []).append(len(self.windows))
+            self.windows.append(window)
+            self.window_results.append(result)
+
+    def find(self, center):
+        """
+        :return: the (centroid, support) of the settled centroid whose path passes within capture_distance of the
+                    center, or None
+        """
+        if self.use_grid:
+            neighbours = get_grid_neighbours(self.cells, get_grid_cell(center, self.capture_distance))
+        else:
+            neighbours = range(len(self.windows))
+        for i in neighbours:
+            if self.distance_alg(self.windows[i], center) <= self.capture_distance:
+                return self.results[self.window_results[i]]
+        return None
+
+    def find_claimed(self, inside, support):
+        """
+        :param inside: the indexes of the points in a window
+        :param support: their total weight
+        :return: the (centroid, support) of the settled centroid that has at least max_claimed of the window's
+                    weight around it, or None
+        """
+        owners = self.owners[inside]
+        claimed = owners >= 0
+        if not claimed.any():
+            return None
+        weights = np.bincount(owners[claimed], weights=self.space.weights[inside][claimed])
+        best = int(weights.argmax())
+        if weights[best] < self.max_claimed * support:
+            return None
+        return self.results[best]
+
+
+def _move_centroid(centroid):
+    """Moves one centroid, in a worker process. The space is rebuilt from the shared arrays by the first task"""
+    if 'space' not in worker_state:
+        worker_state['space'] = EuclideanSpace.from_sorted(worker_state['points'], worker_state['weights'],
+                                                           worker_state['offsets'], worker_state['partitions'],
+                                                           worker_state['min_val'], worker_state['cell_size'])
+    return move_centroid(worker_state['space'], centroid, *worker_state['args'])
+
+
+def move_centroids_in_parallel(space, centroids, distance_alg, radius, min_movement, progress, workers,
+                               cancel=None):
+    """
+    Moves every centroid until it settles, spread across a pool of worker processes. The points of the space are
+    placed in shared memory once, rather than being sent with every centroid.
+    :param cancel: a CancelToken. once it's cancelled, centroids that haven't been started are skipped, but the ones
+                    already being moved by a worker are finished
+    :return: the results of move_centroid, in the same order as the starting centroids. skipped centroids are None
+    """
+    shared = SharedArrays(points=space.points, weights=space.weights, offsets=space.offsets)
+    try:
+        with create_worker_pool(workers, shared, partitions=space.partitions, min_val=space.min_val,
+                                cell_size=space.cell_size, args=(distance_alg, radius, min_movement)) as pool:
+            futures = [pool.submit(_move_centroid, centroid) for centroid in centroids]
+            for i, _ in enumerate(as_completed(futures)):
+                progress.report('Moving centroids', (i + 1) / len(centroids))
+                if cancel is not None and cancel.is_cancelled():
+                    for future in futures:
+                        future.cancel()
+                    break
+            return [None if future.cancelled() else future.result() for future in futures]
+    finally:
+        shared.close()
+
+
+def get_indexes_in_sphere(space, center, distance_alg, radius, progress=None):
+    """
+    Find the points of a space within a radius of the center. Works through the space's slices in place, without
+    gathering the points into a new list
+    :param progress: a Progress to count the windows and points tested in, or None
+    :return: an array of indexes into space.points
+    """
+    starts, stops = space.get_index_ranges(center, radius)
+    if progress is not None:
+        progress.count('windows')
+        progress.count('distance evaluations', int((stops - starts).sum()))
+    found = []
+    for start, stop in zip(starts, stops):
+        points = space.points[start:stop]
+        if distance.has_batch(distance_alg):
+            inside = distance_alg.batch(points, center) <= radius
+        else:
+            inside = np.array([distance_alg(point, center) <= radius for point in points], dtype=bool)
+        found.append(np.flatnonzero(inside) + start)
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.intp)
+
+
+def get_weighted_average(space, indexes):
+    """
+    :param indexes: a non-empty array of indexes into space.points
+    :return: an (average, total weight) tuple
+    """
+    weights = space.weights[indexes]
+    count = weights.sum().item()
+    # the points are integer colors, so weighting them gives exactly the same sums as repeating them
+    return (weights @ space.points[indexes] / count).tolist(), count
 
 
 def get_start_point(points, center, radius, min_val, max_val):
@@ -168,13 +437,68 @@ def prune_similar_points_by_distance(centroids, distance_alg, distinct_distance)
     :param distinct_distance: How far away two points must be to be considered distinct
     :return: Nothing, sets are changed in place
     """
-    for i in range(len(centroids)):
-        for j in range(i+1, len(centroids)):
-            if distance_alg(centroids[i], centroids[j]) < distinct_distance:
-                centroids[i] = None
+    centroids[:], _ = merge_similar_centroids(centroids, [1] * len(centroids), distance_alg, distinct_distance)
+
+
+def get_grid_cell(point, cell_size):
+    """
+    :return: the coordinates of the grid cell holding a point, as a tuple
+    """
+    return tuple(int(x // cell_size) for x in point)
+
+
+def get_grid_neighbours(cells, cell):
+    """
+    Gets what's been put in a grid cell and the cells around it. With cells as wide as the distance being searched
+    for, anything closer than that distance is in one of them
+    :param cells: a dictionary of lists, by cell coordinates
+    :param cell: the coordinates of the middle cell
+    :return: a list of everything in the 3^D cells
+    """
+    return [item for offset in product((-1, 0, 1), repeat=len(cell))
+            for item in cells.get(tuple(c + o for c, o in zip(cell, offset)), ())]
+
+
+def merge_similar_centroids(centroids, supports, distance_alg, distinct_distance):
+    """
+    Merges centroids that are closer than distinct_distance. Centroids are visited from the most supported to the
+    least, and each one is either kept, or merged into the first kept centroid it's too close to. Centroids that
+    settled on the same colour had almost the same points around them, so the kept centroid's support is left as the
+    weight of its own window, rather than counting those points again for every centroid merged into it. For p-norm
+    distances the kept centroids are bucketed into a grid of distinct_distance sized cells, so
+    each centroid is only compared with the kept centroids in the neighbouring cells.
+    :param centroids: Set of sphere centre points
+    :param supports: the weight of the points captured by each centroid
+    :param distance_alg: the distance algorithm to use
+    :param distinct_distance: How far away two points must be to be considered distinct
+    :return: a (centroids, supports) tuple of lists, sorted from the most supported centroid to the least. each
+                support is the largest support of the centroids merged together
+    """
+    order = sorted(range(len(centroids)), key=lambda i: -supports[i])
+    kept = []
+    kept_supports = []
+    use_grid = distance.is_at_least_chebyshev(distance_alg) and distinct_distance > 0
+    # the indexes of the kept centroids in each grid cell
+    cells = {}
+
+    for i in order:
+        centroid = centroids[i]
+        if use_grid:
+            cell = get_grid_cell(centroid, distinct_distance)
+            neighbours = get_grid_neighbours(cells, cell)
+        else:
+            neighbours = range(len(kept))
+
+        for j in neighbours:
+            if distance_alg(kept[j], centroid) < distinct_distance:
+                # visited from the most supported, so the kept centroid already has the largest support
                 break
-    while None in centroids:
-        centroids.remove(None)
+        else:
+            if use_grid:
+                cells.setdefault(cell, []).append(len(kept))
+            kept.append(centroid)
+            kept_supports.append(supports[i])
+    return kept, kept_supports
 
 
 def first(elem):
@@ -0,0 +1,79 @@
+"""
+Median cut: a fast palette in one pass over the color histogram, with no iterations.
+
+All the colors start in one box. The box whose colors are furthest from their mean (by weighted squared error) is
+cut in two along the channel it varies most in, at the weighted median, so each half holds about as many pixels.
+This repeats until there are k boxes, and the palette is the weighted mean color of each box.
+
+The palette is usually a little worse than K-Means, but it's found in a fraction of the time, and it makes a good
+starting point for K-Means (see seeding.median_cut_seeds).
+"""
+import heapq
+from itertools import count
+import numpy as np
+from colorclusters.cancellation import as_token
+
+
+def box_error(points, weights):
+    """
+    Measures how spread out the points in a box are
+    :param points: an (N, D) float array
+    :param weights: an (N,) float array
+    :return: a (sse, channel) tuple. sse is the weighted squared distance of the points from their mean, and channel
+                is the one they vary most in, which the box is cut along
+    """
+    mean = weights @ points / weights.sum()
+    variance = weights @ (points - mean) ** 2
+    return float(variance.sum()), int(variance.argmax())
+
+
+def cut_box(points, weights, indices, channel):
+    """
+    Cuts a box in two at the weighted median of a channel
+    :param indices: the indices of the box's points
+    :param channel: the channel to cut along
+    :return: a (lower, upper) tuple of index arrays, neither of them empty
+    """
+    indices = indices[np.argsort(points[indices, channel], kind='stable')]
+    cumulative = np.cumsum(weights[indices])
+    # the first point past half the weight goes in the lower box, but both boxes must keep at least one point
+    cut = min(max(int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1, 1), len(indices) - 1)
+    return indices[:cut], indices[cut:]
+
+
+def median_cut(points, weights, k_value, cancel=None):
+    """
+    Splits the points into at most k boxes with median cut
+    :param points: an (N, D) array of unique points, e.g. the colors of a histogram
+    :param weights: the number of times each point occurs
+    :param k_value: the most colors to return
+    :param cancel: a CancelToken checked between cuts. once it's cancelled, the boxes cut so far are used
+    :return: an (M, D) float array with the weighted mean of each box, from the most weight to the least.
+                M is k, unless there are fewer than k distinct points or the cutting was cancelled
+    """
+    cancel = as_token(cancel)
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # the boxes, with the largest error first. the counter breaks ties, so the index arrays are never compared
+    heap = []
+    order = count()
+
+    def add_box(indices):
+        sse, channel = box_error(points[indices], weights[indices])
+        heapq.heappush(heap, (-sse, next(order), indices, channel))
+
+    add_box(np.arange(len(points)))
+    while len(heap) < k_value and not cancel.is_cancelled():
+        negative_sse, _, indices, channel = heap[0]
+        if negative_sse >= 0:
+            # every box holds a single color, so cutting further wouldn't help
+            break
+        heapq.heappop(heap)
+        for half in cut_box(points, weights, indices, channel):
+            add_box(half)
+
+    boxes = [indices for _, _, indices, _ in heap]
+    totals = np.array([weights[indices].sum() for indices in boxes])
+    means = np.array([weights[indices] @ points[indices] for indices in boxes]) / totals[:, None]
+    return means[np.argsort(-totals, kind='stable')]
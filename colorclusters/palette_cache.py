@@ -0,0 +1,92 @@
+"""
+An on-disk cache of the palettes found for images, so re-quantizing the same image with the same options can skip
+clustering and go straight to remapping.
+
+Entries are keyed by a fingerprint of the image's color histogram (which colors it has and how often, but not where
+they are) and the parameters that affect the result. They are kept in an SQLite database, and once there are more
+than max_entries, the least recently used ones are removed.
+
+    with PaletteCache('palettes.sqlite') as cache:
+        image, stats = quantize_k_means(image, 16, cache=cache)
+"""
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+
+# the default number of palettes kept
+_max_entries = 10000
+# seconds to wait for another process that's writing to the cache
+_timeout = 30
+
+
+def fingerprint(keys, counts, parameters):
+    """
+    Hashes a color histogram together with the parameters of the algorithm that will run on it
+    :param keys: the sorted packed colors of the histogram
+    :param counts: the number of times each color occurs
+    :param parameters: a dictionary of JSON-serializable values
+    :return: a hex string
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(keys, dtype='<u4').tobytes())
+    digest.update(np.ascontiguousarray(counts, dtype='<u8').tobytes())
+    return digest.hexdigest()
+
+
+class PaletteCache:
+    """A size-bounded, least-recently-used store of palettes and their stats, backed by an SQLite file"""
+
+    def __init__(self, path, max_entries=_max_entries):
+        """
+        :param path: the database file, which is created if it doesn't exist. ':memory:' keeps the cache in memory
+        :param max_entries: the most palettes kept
+        """
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, timeout=_timeout)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS palettes ('
+                                    'key TEXT PRIMARY KEY, centroids TEXT, stats TEXT, last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS palettes_last_used ON palettes (last_used)')
+
+    def get(self, key):
+        """
+        Looks up a palette, marking it as recently used
+        :param key: a fingerprint
+        :return: a (centroids, stats) tuple, or None if the key isn't cached
+        """
+        with self.connection:
+            row = self.connection.execute('SELECT centroids, stats FROM palettes WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE palettes SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, key, centroids, stats):
+        """
+        Stores a palette, removing the least recently used palettes if the cache is full
+        :param key: a fingerprint
+        :param centroids: a list of colors
+        :param stats: a dictionary of JSON-serializable values, such as the iterations and sse
+        """
+        centroids = [list(centroid) for centroid in centroids]
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO palettes VALUES (?, ?, ?, ?)',
+                                    (key, json.dumps(centroids), json.dumps(stats), time.time()))
+            self.connection.execute('DELETE FROM palettes WHERE key NOT IN '
+                                    '(SELECT key FROM palettes ORDER BY last_used DESC LIMIT ?)',
+                                    (self.max_entries,))
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM palettes').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
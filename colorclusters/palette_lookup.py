@@ -0,0 +1,165 @@
+"""
+This module precomputes which palette color is closest to each region of the color space, so that remapping an
+image to a palette is a table lookup rather than a search of the palette for every distinct color.
+"""
+from collections import OrderedDict
+import numpy as np
+from colorclusters.distance import (euclidean, has_batch, is_at_least_chebyshev, closest_indices, pairwise_distances,
+                                    _chunk_elements)
+from colorclusters.histogram import pack_colors
+
+# the number of tables get_palette_lookup keeps around
+_cache_size = 8
+_cache = OrderedDict()
+
+
+class PaletteLookup:
+    """
+    A dense table over the RGB(A) color space, with one cell for every color that has the same top `bits` bits in
+    each channel. A cell stores a palette index when the triangle inequality proves that every color in the cell
+    is closest to that palette color, and -1 otherwise. Colors in the undecided cells are matched exactly, and
+    remembered for later lookups, so one table can be reused for any number of images that share a palette.
+    With bits=8 every cell is a single color, and the whole table is exact.
+    """
+    def __init__(self, colors, distance=euclidean, dimensions=None, bits=None):
+        """
+        Builds the table.
+        :param colors: a list of n-tuples used as the palette
+        :param distance: the distance function used to find the closest color
+        :param dimensions: the number of channels of the colors that will be looked up. defaults to the palette's
+        :param bits: the bits per channel used to index the table. defaults to 5 for RGB and 4 for RGBA
+        """
+        self.colors = np.asarray(colors, dtype=np.float64)
+        self.distance = distance
+        self.dimensions = dimensions or self.colors.shape[1]
+        if bits is None:
+            bits = 5 if self.dimensions <= 3 else 4
+        self.bits = bits
+        # palettes for paletted images fit in a byte
+        self.dtype = np.uint8 if len(self.colors) <= 256 else np.intp
+
+        # the packed colors matched exactly so far, and their palette indexes
+        self.known_keys = np.empty(0, dtype=np.uint32)
+        self.known_indices = np.empty(0, dtype=self.dtype)
+
+        self.table = self.build_table()
+
+    def build_table(self):
+        """
+        Finds the palette index for each cell of the table
+        :return: an array with an index (or -1) for each cell, in packed color order
+        """
+        width = 1 << (8 - self.bits)
+        cells = 1 << (self.bits * self.dimensions)
+        table = np.empty(cells, dtype=np.int16)
+        if not has_batch(self.distance) or not (width == 1 or getattr(self.distance, 'is_metric', False)):
+            # without the triangle inequality nothing can be decided ahead of time
+            table[:] = -1
+            return table
+
+        # every color in a cell is within `reach` of the cell's reference point. for p-norms the center of the
+        # cell gives the tightest reach. other metrics (like hamming) are measured from the cell's first color,
+        # which is at most the distance between the first and last colors away from any other color in the cell
+        if is_at_least_chebyshev(self.distance):
+            offset = (width - 1) / 2
+            reach = self.distance.batch(np.zeros(self.dimensions), np.full(self.dimensions, offset))
+        else:
+            offset = 0
+            reach = self.distance.batch(np.zeros(self.dimensions), np.full(self.dimensions, width - 1))
+        chunk = max(1, _chunk_elements // max(1, self.colors.size))
+        for start in range(0, cells, chunk):
+            index = np.arange(start, min(start + chunk, cells))
+            references = np.empty((len(index), self.dimensions))
+            for d in range(self.dimensions):
+                references[:, d] = (index >> (self.bits * (self.dimensions - 1 - d)) & ((1 << self.bits) - 1)) * width
+            references += offset
+            dist = pairwise_distances(references, self.colors, self.distance)
+            closest = dist.argmin(axis=1)
+            best = dist[np.arange(len(dist)), closest]
+            if width == 1:
+                # single-color cells are decided exactly, including ties
+                table[index] = closest
+                continue
+            # a palette color can only win somewhere in the cell if it's within 2 * reach of the best at the reference
+            candidates = np.count_nonzero(dist <= (best + 2 * reach)[:, None], axis=1)
+            table[index] = np.where(candidates == 1, closest, -1)
+        return table
+
+    def lookup(self, pixels, progress=None):
+        """
+        Finds the closest palette color for each pixel
+        :param pixels: an (N, D) array of colors with values from 0 to 255, or a list of n-tuples
+        :param progress: a Progress to count 'lookup table hits' in, and the cache hits and misses of exact matching
+        :return: an (N,) array of palette indexes. uint8 for palettes of up to 256 colors
+        """
+        pixels = np.asarray(pixels)
+        if pixels.dtype != np.uint8:
+            pixels = pixels.astype(np.uint8)
+        # the top bits of each channel, packed together
+        cells = np.zeros(len(pixels), dtype=np.intp)
+        for d in range(self.dimensions):
+            cells <<= self.bits
+            cells |= pixels[:, d] >> (8 - self.bits)
+        indices = self.table[cells]
+
+        undecided = np.flatnonzero(indices < 0)
+        if progress is not None:
+            progress.count('lookup table hits', len(pixels) - len(undecided))
+        if len(undecided) == 0:
+            return indices.astype(self.dtype)
+        result = indices.astype(self.dtype)
+        result[undecided] = self.match_exactly(pack_colors(pixels[undecided]), pixels[undecided], progress)
+        return result
+
+    def match_exactly(self, keys, pixels, progress=None):
+        """
+        Finds the closest palette color for colors the table couldn't decide, remembering the results
+        :param keys: the packed colors
+        :param pixels: the colors themselves
+        :param progress: a Progress to count 'color cache hits' and 'color cache misses' in
+        :return: the palette index for each color
+        """
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        if len(self.known_keys) > 0:
+            position = np.minimum(np.searchsorted(self.known_keys, unique_keys), len(self.known_keys) - 1)
+            known = self.known_keys[position] == unique_keys
+        else:
+            position = np.zeros(len(unique_keys), dtype=np.intp)
+            known = np.zeros(len(unique_keys), dtype=bool)
+
+        unique_indices = np.empty(len(unique_keys), dtype=self.dtype)
+        unique_indices[known] = self.known_indices[position[known]]
+        new = ~known
+        if progress is not None:
+            misses = int(np.count_nonzero(new))
+            progress.count('color cache misses', misses)
+            progress.count('color cache hits', len(keys) - misses)
+            progress.count('distance evaluations', misses * len(self.colors))
+        if new.any():
+            unique_indices[new] = closest_indices(pixels[first[new]], self.colors, self.distance)
+            # remember the new results, keeping the known keys sorted
+            keys = np.concatenate((self.known_keys, unique_keys[new]))
+            order = np.argsort(keys, kind='stable')
+            self.known_keys = keys[order]
+            self.known_indices = np.concatenate((self.known_indices, unique_indices[new]))[order]
+        return unique_indices[inverse.reshape(-1)]
+
+
+def get_palette_lookup(colors, distance=euclidean, dimensions=None, bits=None):
+    """
+    Gets a PaletteLookup for the palette, reusing a recent one if the same palette was used before
+    :param colors: a list of n-tuples used as the palette
+    :param distance: the distance function used to find the closest color
+    :param dimensions: the number of channels of the colors that will be looked up
+    :param bits: the bits per channel used to index the table
+    :return: a PaletteLookup
+    """
+    key = (tuple(tuple(color) for color in np.asarray(colors, dtype=np.float64).tolist()), distance, dimensions, bits)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    lookup = PaletteLookup(colors, distance, dimensions, bits)
+    _cache[key] = lookup
+    if len(_cache) > _cache_size:
+        _cache.popitem(last=False)
+    return lookup
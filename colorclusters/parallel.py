@@ -0,0 +1,101 @@
+"""
+This module shares read-only arrays with a pool of worker processes.
+The arrays are copied into shared memory once, and each worker attaches to them when it starts, so tasks only
+need to carry the small per-task arguments (e.g. the current centroids) instead of the data itself.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# arrays the current worker process has attached to, by the name they were shared under.
+# also keeps the shared memory alive for as long as the arrays are in use
+_attached = {}
+
+# the shared arrays and settings of a worker process started by create_worker_pool, for its tasks to read
+worker_state = {}
+
+
+class SharedArrays:
+    """
+    Copies a set of named arrays into shared memory. The creating process owns the memory, and must call close()
+    when it's done with it.
+    """
+    def __init__(self, **arrays):
+        self.memory = []
+        # (name, shape, dtype) for each array, which is all a worker needs to attach to it
+        self.descriptors = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            memory = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=memory.buf)[...] = array
+            self.memory.append(memory)
+            self.descriptors[key] = (memory.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """Frees the shared memory"""
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+        self.memory = []
+
+
+def attach_arrays(descriptors):
+    """
+    Attaches to arrays shared by a SharedArrays object. Meant to be called in a worker process.
+    :param descriptors: the descriptors attribute of a SharedArrays object
+    :return: a dictionary of read-only arrays, with the same keys the arrays were shared with
+    """
+    arrays = {}
+    for key, (name, shape, dtype) in descriptors.items():
+        if name not in _attached:
+            memory = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, dtype, buffer=memory.buf)
+            array.flags.writeable = False
+            _attached[name] = (memory, array)
+        arrays[key] = _attached[name][1]
+    return arrays
+
+
+def split_shards(length, shards):
+    """
+    Splits a range into nearly equal parts, e.g. one per worker
+    :param length: the number of items
+    :param shards: the most parts
+    :return: a list of (start, stop) tuples, none of them empty
+    """
+    bounds = np.linspace(0, length, shards + 1).astype(int)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop]
+
+
+def _init_worker(descriptors, settings):
+    worker_state.update(attach_arrays(descriptors))
+    worker_state.update(settings)
+
+
+def create_worker_pool(workers, shared, **settings):
+    """
+    Creates a process pool whose workers attach to shared arrays when they start. Tasks then find the arrays, and
+    the settings, in worker_state
+    :param workers: the number of worker processes
+    :param shared: a SharedArrays object
+    :param settings: anything else the tasks need, such as the distance function
+    :return: a concurrent.futures.ProcessPoolExecutor
+    """
+    return create_pool(workers, _init_worker, (shared.descriptors, settings))
+
+
+def create_pool(workers, initializer=None, initargs=()):
+    """
+    Creates a process pool. Uses fork where it's available, so that functions that can't be pickled
+    (like the closures in colorclusters.distance, or user-entered lambdas) can be handed to the initializer
+    :param workers: the number of worker processes
+    :param initializer: called in each worker when it starts
+    :param initargs: the arguments for the initializer
+    :return: a concurrent.futures.ProcessPoolExecutor
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=initializer, initargs=initargs)
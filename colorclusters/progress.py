@@ -0,0 +1,156 @@
+"""
+Progress reporting and profiling for the algorithms.
+
+The algorithms take a `progress` argument and report what they're doing to it as ProgressEvents, rather than
+formatting strings for the UI. A Progress passes events on to its subscribers (at most one every min_interval
+seconds, so tight loops don't flood them), and keeps counters and the wall time spent in each phase. When nobody is
+listening, NO_PROGRESS is used instead, which does nothing at all.
+
+    progress = Progress()
+    progress.subscribe(lambda event: print(format_event(event)))
+    quantize_k_means(image, 16, progress=progress)
+    print(progress.summary())
+"""
+from collections import namedtuple, defaultdict
+from contextlib import contextmanager, nullcontext
+import time
+
+# the shortest time between events passed on to the subscribers, in seconds
+_min_interval = 0.1
+
+# phase is the name of the step being run, and the rest are None unless the step has them.
+# fraction is how much of the phase is done (0 to 1), iteration and shift are for the iterative algorithms,
+# and message is any extra text worth showing
+ProgressEvent = namedtuple('ProgressEvent', 'phase fraction iteration shift message')
+
+
+class Progress:
+    """Passes progress events on to subscribers, and keeps counters and phase timings"""
+
+    def __init__(self, min_interval=_min_interval):
+        """
+        :param min_interval: the shortest time between events passed on to the subscribers, in seconds. events that
+                                start a new phase or are marked final are always passed on
+        """
+        self.min_interval = min_interval
+        self.subscribers = []
+        # total amounts, such as distance evaluations and cache hits, by name
+        self.counters = defaultdict(int)
+        # total wall time in seconds spent in each phase
+        self.timings = defaultdict(float)
+        self.last_phase = None
+        self.last_time = -float('inf')
+
+    @property
+    def enabled(self):
+        """True if anyone is listening for events. Loops can check this before working out what to report"""
+        return bool(self.subscribers)
+
+    def subscribe(self, callback):
+        """
+        Adds a subscriber
+        :param callback: a function taking a ProgressEvent
+        :return: the callback
+        """
+        self.subscribers.append(callback)
+        return callback
+
+    def report(self, phase, fraction=None, iteration=None, shift=None, message=None, final=False):
+        """
+        Sends a progress event to the subscribers, unless one was sent too recently
+        :param final: True to send the event even if one was just sent, for events that mustn't be missed
+        """
+        if not self.subscribers:
+            return
+        now = time.monotonic()
+        if not final and phase == self.last_phase and now - self.last_time < self.min_interval:
+            return
+        self.last_phase = phase
+        self.last_time = now
+        event = ProgressEvent(phase, fraction, iteration, shift, message)
+        for callback in self.subscribers:
+            callback(event)
+
+    def count(self, name, amount=1):
+        """Adds to a counter"""
+        self.counters[name] += amount
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times a phase of an algorithm, reporting its start
+        :param name: the phase name. time spent in phases of the same name is added together
+        """
+        self.report(name, final=True)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def summary(self):
+        """
+        :return: a dictionary with the counters and the seconds spent in each phase
+        """
+        return {'counters': dict(self.counters),
+                'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()}}
+
+
+class NullProgress:
+    """Stands in for a Progress when nobody is listening. Every method does nothing"""
+    enabled = False
+    counters = {}
+    timings = {}
+
+    def subscribe(self, callback):
+        raise TypeError('NO_PROGRESS can not be subscribed to. Create a Progress instead')
+
+    def report(self, phase, fraction=None, iteration=None, shift=None, message=None, final=False):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def phase(self, name):
+        return nullcontext(self)
+
+    def summary(self):
+        return {'counters': {}, 'timings': {}}
+
+
+NO_PROGRESS = NullProgress()
+
+
+def format_event(event):
+    """
+    Describes an event in a few lines of text for the UI
+    :param event: a ProgressEvent
+    :return: a string
+    """
+    lines = [event.message] if event.message else []
+    if event.fraction is None:
+        lines.append(event.phase)
+    else:
+        lines.append('%s: %d%% complete' % (event.phase, int(event.fraction * 100)))
+    if event.iteration is not None:
+        if event.shift is None:
+            lines.append('Iteration: %d' % event.iteration)
+        else:
+            lines.append('Iteration: %d, Shift: %.2f' % (event.iteration, event.shift))
+    return '\n'.join(lines)
+
+
+def as_progress(target):
+    """
+    Gets the Progress to report to, for functions that also accept an output queue
+    :param target: a Progress, None for no reporting, or a queue (anything with a put method) that should get the
+                    events as text
+    :return: a Progress or NO_PROGRESS
+    """
+    if target is None:
+        return NO_PROGRESS
+    if isinstance(target, (Progress, NullProgress)):
+        return target
+    progress = Progress()
+    progress.subscribe(lambda event: target.put(format_event(event)))
+    return progress
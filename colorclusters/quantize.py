@@ -0,0 +1,253 @@
+"""
+This module runs the clustering algorithms from start to finish on an image, producing the paletted result.
+It's shared by the GUI in main.py and the command line tool, so it must not depend on tkinter.
+"""
+import numpy as np
+from colorclusters import image_utils as img_utils, mean_shift
+from colorclusters.closest_color import get_sum_squared_error, map_pixels_to_closest_color_index
+from colorclusters.distance import euclidean, get_name
+from colorclusters.histogram import ColorHistogram, get_channel_bits
+from colorclusters.k_means import KMeans
+from colorclusters.median_cut import median_cut
+from colorclusters.palette_cache import fingerprint
+from colorclusters.progress import as_progress
+from colorclusters.cancellation import as_token
+
+# the most colors a paletted image can hold
+_max_colors = 256
+
+
+def get_rgb_image(image):
+    """Converts an image to RGB or RGBA (if it has transparency), since the palettes work off of those values"""
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+
+def get_cache_key(histogram, distance, parameters):
+    """
+    Gets the key a result is stored under in a PaletteCache
+    :param histogram: the ColorHistogram of the image
+    :param distance: the distance function
+    :param parameters: a dictionary of the algorithm's name and the other parameters that affect the result
+    :return: a fingerprint, or None if the distance is a user function that can't be identified across runs
+    """
+    name = get_name(distance)
+    if name is None:
+        return None
+    parameters = dict(parameters, distance=name, channels=histogram.channels)
+    return fingerprint(histogram.keys, histogram.counts, parameters)
+
+
+def bin_colors(histogram, bits, progress):
+    """
+    Bins the colors of a histogram for the algorithms to run on, reporting the number of bins
+    :param histogram: a ColorHistogram
+    :param bits: the bits kept in each channel (see histogram.get_channel_bits)
+    :param progress: a Progress (or NO_PROGRESS)
+    :return: a (colors, counts, error) tuple, like histogram.bin_histogram
+    """
+    with progress.phase('Binning colors'):
+        colors, counts, error = histogram.bin(bits)
+    progress.count('bins', error['bins'])
+    return colors, counts, error
+
+
+def quantize_k_means(image, k_value=4, max_shift=3, distance=euclidean, plus_plus=False, batch_size=None,
+                     workers=None, progress=None, cancel=None, seeding=None, random_state=None, cache=None,
+                     bits=None, use_bounds=False):
+    """
+    Reduces an image to k colors using K-Means
+    :param image: an Image object
+    :param k_value: the number of colors
+    :param max_shift: stop once no centroid shifts more than this
+    :param distance: the distance function
+    :param plus_plus: True to choose the initial centroids with K-Means++
+    :param batch_size: the mini-batch size, or None for full passes
+    :param workers: the number of worker processes, or None to run in this process
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken (or a function returning False when the algorithm should stop early). once it's
+                    cancelled, the image is built from the centroids found so far
+    :param seeding: how to choose the initial centroids: 'random', 'k-means++', 'k-means||' or 'median-cut'.
+                    overrides plus_plus
+    :param random_state: an int seed, so the same image and options always give the same result
+    :param cache: a PaletteCache. if an image with the same colors was quantized with the same options before, its
+                    centroids are reused instead of running K-Means
+    :param bits: if given, K-Means runs on the colors binned to this many bits per channel (e.g. (5, 5, 5) or
+                    (6, 6, 6, 4)), so its cost depends on the number of bins rather than the noise in the image.
+                    the pixels are still mapped to their exact closest centroid
+    :param use_bounds: True to skip the distance computations the triangle inequality rules out (see
+                        KMeans.assign_with_bounds). the result is the same. can't be combined with batch_size or
+                        workers
+    :return: a (paletted image, stats) tuple. stats is a dictionary with the colors, iterations and sse, whether
+                the run was cancelled, and whether the centroids came from the cache. with bits, it also has the
+                'binning' error (see histogram.bin_histogram)
+    """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    image = get_rgb_image(image)
+    pixels = img_utils.image_to_pixels(image)
+    histogram = ColorHistogram.from_colors(pixels) if cache is not None or bits else None
+
+    key = None
+    if cache is not None:
+        with progress.phase('Checking palette cache'):
+            parameters = {'algorithm': 'k-means', 'k_value': k_value, 'max_shift': max_shift,
+                          'seeding': seeding or ('k-means++' if plus_plus else 'random'), 'batch_size': batch_size,
+                          'random_state': random_state,
+                          'bits': bits and get_channel_bits(bits, pixels.shape[1])}
+            key = get_cache_key(histogram, distance, parameters)
+            cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            centroids, stats = cached
+            with progress.phase('Building final image'):
+                # the stored centroids are exact, so this matches the clustering K-Means ended with
+                res_image = img_utils.map_index_to_paletted_image(
+                    image.size,
+                    map_pixels_to_closest_color_index(pixels, centroids, distance),
+                    [[int(x) for x in centroid] for centroid in centroids])
+            return res_image, dict(stats, colors=k_value, cancelled=False, cached=True)
+
+    datapoints, weights, binning = pixels, None, None
+    if bits:
+        datapoints, weights, binning = bin_colors(histogram, bits, progress)
+
+    # initialize algorithm
+    with progress.phase('Choosing initial centroids'):
+        k_means = KMeans(k_value, datapoints, distance, use_kmeans_plus_plus=plus_plus,
+                         batch_size=batch_size, workers=workers, weights=weights, cancel=cancel, seeding=seeding,
+                         random_state=random_state, use_bounds=use_bounds)
+    try:
+        i, _ = run_k_means(k_means, max_shift, progress, cancel)
+    finally:
+        k_means.close()
+
+    with progress.phase('Building final image'):
+        if binning is None:
+            clustering = k_means.get_clustering()
+            sse = k_means.get_sum_square_error()
+        else:
+            # K-Means only saw the bins, so the pixels are matched and measured against the centroids here
+            clustering = map_pixels_to_closest_color_index(pixels, k_means.get_exact_centroids(), distance)
+            sse = get_sum_squared_error(pixels, clustering, k_means.get_exact_centroids(), distance)
+        res_image = img_utils.map_index_to_paletted_image(
+            image.size,
+            clustering,
+            k_means.get_centroids())
+    stats = {'iterations': i, 'sse': sse}
+    if binning is not None:
+        stats['binning'] = binning
+    # a cancelled run may not have finished, so it's not worth reusing
+    if key is not None and not cancel.is_cancelled():
+        cache.put(key, k_means.get_exact_centroids(), stats)
+    return res_image, dict(stats, colors=k_value, cancelled=cancel.is_cancelled(), cached=False)
+
+
+def run_k_means(k_means, max_shift, progress, cancel):
+    """
+    Shifts the centroids of a KMeans until none of them shift more than max_shift, reporting each iteration
+    :param k_means: a KMeans
+    :param progress: a Progress (or NO_PROGRESS)
+    :param cancel: a CancelToken (or NEVER_CANCEL) checked before each iteration
+    :return: an (iterations, last shift) tuple
+    """
+    shift = max_shift + 1  # arbitrary value greater than max, so that the loop is entered
+    i = 0
+    evaluations = k_means.distance_evaluations
+    with progress.phase('Shifting centroids'):
+        while shift > max_shift and not cancel.is_cancelled():
+            i += 1
+            k_means.shift_centroids()
+            shift = max(k_means.shift_distance)
+            progress.report('Shifting centroids', iteration=i, shift=shift)
+    progress.count('iterations', i)
+    progress.count('distance evaluations', k_means.distance_evaluations - evaluations)
+    return i, shift
+
+
+def quantize_mean_shift(image, max_shift=3, max_centroids=256, distance=euclidean, workers=None, progress=None,
+                        cancel=None, cache=None, bits=None, seeding='occupancy', max_seeds=4096, reuse_basins=False):
+    """
+    Reduces an image to the colors found by mean-shift
+    :param image: an Image object
+    :param max_shift: a centroid has settled once it moves less than this
+    :param max_centroids: the number of centroids in the lattice, which sets the size of the spheres
+    :param distance: the distance function
+    :param workers: the number of worker processes, or None to run in this process
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken (or a function returning False when the algorithm should stop early). once it's
+                    cancelled, the image is built from the colors found so far
+    :param cache: a PaletteCache. if an image with the same colors was quantized with the same options before, its
+                    palette is reused instead of running mean-shift
+    :param bits: if given, mean-shift runs on the colors binned to this many bits per channel, like quantize_k_means
+    :param seeding: 'occupancy' to start centroids only where there are colors, or 'lattice' to spread them evenly
+    :param max_seeds: the most centroids occupancy seeding starts
+    :param reuse_basins: True to stop centroids early once they're headed for a colour that's already been found
+                            (see mean_shift.Basins). fewer searches, but a few colours can be lost
+    :return: a (paletted image, stats) tuple. stats is a dictionary with the colors and sse, whether the run was
+                cancelled, and whether the palette came from the cache. with bits, it also has the 'binning' error
+    """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    image = get_rgb_image(image)
+    pixels = img_utils.image_to_pixels(image)
+    histogram = ColorHistogram.from_colors(pixels) if cache is not None or bits else None
+
+    key = cached = None
+    if cache is not None:
+        with progress.phase('Checking palette cache'):
+            parameters = {'algorithm': 'mean-shift', 'max_shift': max_shift, 'max_centroids': max_centroids,
+                          'bits': bits and get_channel_bits(bits, pixels.shape[1]), 'seeding': seeding,
+                          'max_seeds': max_seeds, 'reuse_basins': reuse_basins}
+            key = get_cache_key(histogram, distance, parameters)
+            cached = cache.get(key) if key is not None else None
+
+    points, weights, binning = pixels, None, None
+    if cached is not None:
+        color_palette, stats = cached
+    else:
+        if bits:
+            points, weights, binning = bin_colors(histogram, bits, progress)
+        color_palette = mean_shift.mine(points, progress, distance_alg=distance, min_movement=max_shift,
+                                        max_centroids=max_centroids, workers=workers, weights=weights, cancel=cancel,
+                                        seeding=seeding, max_seeds=max_seeds, reuse_basins=reuse_basins)
+    new_image = img_utils.map_to_paletted_image(image, color_palette, distance=distance, progress=progress,
+                                                cancel=cancel)
+    if cached is None:
+        stats = {'sse': get_sum_squared_error(pixels, np.asarray(new_image).reshape(-1), color_palette, distance)}
+        if binning is not None:
+            stats['binning'] = binning
+        if key is not None and not cancel.is_cancelled():
+            cache.put(key, color_palette, stats)
+    return new_image, dict(stats, colors=len(color_palette), cancelled=cancel.is_cancelled(),
+                           cached=cached is not None)
+
+
+def quantize_median_cut(image, k_value=16, distance=euclidean, progress=None, cancel=None):
+    """
+    Reduces an image to at most k colors using median cut, which is much faster than K-Means or mean-shift
+    :param image: an Image object
+    :param k_value: the most colors. at most 256 are used, as that's all a paletted image can hold, like
+                    mean_shift.mine
+    :param distance: the distance function used to map each pixel to its closest palette color
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken (or a function returning False when the algorithm should stop early). once it's
+                    cancelled, the image is built from the boxes cut so far
+    :return: a (paletted image, stats) tuple. stats is a dictionary with the colors and sse, and whether the run was
+                cancelled
+    """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    k_value = min(k_value, _max_colors)
+    image = get_rgb_image(image)
+    pixels = img_utils.image_to_pixels(image)
+
+    with progress.phase('Cutting boxes'):
+        histogram = ColorHistogram.from_colors(pixels)
+        centroids = median_cut(histogram.colors, histogram.counts, k_value, cancel)
+    color_palette = [[int(x) for x in centroid] for centroid in centroids]
+    progress.count('boxes', len(color_palette))
+    new_image = img_utils.map_to_paletted_image(image, color_palette, distance=distance, progress=progress,
+                                                cancel=cancel)
+    sse = get_sum_squared_error(pixels, np.asarray(new_image).reshape(-1), color_palette, distance)
+    return new_image, {'colors': len(color_palette), 'sse': sse, 'cancelled': cancel.is_cancelled()}
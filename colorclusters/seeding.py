@@ -0,0 +1,216 @@
+"""
+Ways of choosing the initial centroids for K-Means.
+
+Each seeding function takes the unique points and their weights (e.g. a color histogram), and a numpy random
+Generator, so a run can be repeated exactly by passing the same random_state to get_random. All of them return a
+(k, D) float array of centroids.
+
+k_means_plus_plus picks each centroid with probability proportional to its weighted squared distance from the
+centroids already picked. It has to make k passes over the points, one after another. k_means_parallel (k-means||)
+instead oversamples many candidates per pass, so only a few passes are needed however large k is, and then runs
+k_means_plus_plus on the weighted candidates to pick the final k. median_cut_seeds starts from the median cut palette,
+which doesn't need any random choices or distances at all.
+"""
+import numpy as np
+from colorclusters.cancellation import as_token
+from colorclusters.distance import euclidean, pairwise_distances, _chunk_elements
+from colorclusters.median_cut import median_cut
+from colorclusters.parallel import SharedArrays, create_worker_pool, split_shards, worker_state
+
+# the number of sampling passes k_means_parallel makes
+_parallel_rounds = 5
+
+def _shard_costs(start, stop, centers):
+    """Gets the costs of one shard of the points, in a worker process"""
+    return get_costs(worker_state['points'][start:stop], worker_state['weights'][start:stop], centers,
+                     worker_state['distance'])
+
+
+def get_random(random_state=None):
+    """
+    Gets a random number generator
+    :param random_state: a numpy Generator (returned as is), an int seed, or None for a fresh unpredictable seed
+    :return: a numpy Generator
+    """
+    if isinstance(random_state, np.random.Generator):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def sample_index(cumulative, random):
+    """
+    Picks an index with probability proportional to its weight
+    :param cumulative: the cumulative sum of the weights
+    :param random: a numpy Generator
+    :return: an index, or -1 if every weight is 0
+    """
+    total = cumulative[-1]
+    if total <= 0:
+        return -1
+    # the weights are non-negative, so the first cumulative weight above the target is the chosen one
+    return min(int(np.searchsorted(cumulative, random.random() * total, side='right')), len(cumulative) - 1)
+
+
+def get_costs(points, weights, centers, distance):
+    """
+    Gets the weighted squared distance from each point to its closest center, working through the points in chunks
+    :return: a (costs, closest) tuple of (N,) arrays. closest is the index of each point's closest center
+    """
+    costs = np.empty(len(points))
+    closest = np.empty(len(points), dtype=np.intp)
+    chunk = max(1, _chunk_elements // max(1, len(centers) * points.shape[1]))
+    for start in range(0, len(points), chunk):
+        stop = start + chunk
+        dist = pairwise_distances(points[start:stop], centers, distance)
+        closest[start:stop] = dist.argmin(axis=1)
+        costs[start:stop] = dist[np.arange(len(dist)), closest[start:stop]] ** 2
+    return costs * weights, closest
+
+
+def random_seeds(points, k_value, random):
+    """
+    Picks k points at random, each point being equally likely
+    :param points: an (N, D) array
+    :return: a (k, D) float array
+    """
+    return np.asarray(points, dtype=np.float64)[random.integers(len(points), size=k_value)]
+
+
+def k_means_plus_plus(points, weights, k_value, distance=euclidean, random=None, cancel=None):
+    """
+    Chooses initial centroids with K-Means++
+    :param points: an (N, D) array of unique points
+    :param weights: the number of times each point occurs
+    :param k_value: the number of centroids
+    :param distance: the distance function
+    :param random: a numpy Generator. a new unseeded one is used if not given
+    :param cancel: a CancelToken. if it's cancelled, the remaining centroids are picked at random
+    :return: a (k, D) float array. if there are fewer than k points with any weight, points are repeated
+    """
+    random = get_random(random)
+    cancel = as_token(cancel)
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    centroids = np.empty((k_value, points.shape[1]))
+
+    # the first centroid is weighted by how often each point occurs
+    index = sample_index(np.cumsum(weights), random)
+    centroids[0] = points[max(index, 0)]
+    # each point's weighted squared distance to its closest centroid so far
+    costs = get_costs(points, weights, centroids[:1], distance)[0]
+
+    for i in range(1, k_value):
+        if cancel.is_cancelled():
+            # out of time, so the rest are picked without looking at distances
+            centroids[i:] = random_seeds(points, k_value - i, random)
+            break
+        index = sample_index(np.cumsum(costs), random)
+        if index < 0:
+            # there are fewer unique points than centroids, so every point is already a centroid
+            centroids[i:] = centroids[i - 1]
+            break
+        centroids[i] = points[index]
+        np.minimum(costs, get_costs(points, weights, centroids[i:i + 1], distance)[0], out=costs)
+    return centroids
+
+
+def k_means_parallel(points, weights, k_value, distance=euclidean, random=None, oversampling=None,
+                     rounds=_parallel_rounds, cancel=None, workers=None):
+    """
+    Chooses initial centroids with K-Means|| (Bahmani et al., "Scalable K-Means++"). Each round samples every point
+    independently, with probability proportional to its weighted squared distance to the candidates so far, so each
+    round adds about `oversampling` candidates in a single pass. The candidates are then weighted by the points
+    closest to them, and reduced to k with K-Means++.
+    This computes more distances than K-Means++, but in a few large passes that can be split across processes,
+    rather than k small passes that have to run one after another.
+    :param points: an (N, D) array of unique points
+    :param weights: the number of times each point occurs
+    :param k_value: the number of centroids
+    :param distance: the distance function
+    :param random: a numpy Generator. a new unseeded one is used if not given
+    :param oversampling: the expected number of candidates added each round. k/2 by default
+    :param rounds: the number of sampling rounds
+    :param cancel: a CancelToken checked between rounds. if it's cancelled, the candidates found so far are used
+    :param workers: if given, each round is split across this many worker processes
+    :return: a (k, D) float array
+    """
+    random = get_random(random)
+    cancel = as_token(cancel)
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    oversampling = oversampling or max(1, k_value // 2)
+
+    shared = pool = None
+    if workers:
+        shared = SharedArrays(points=points, weights=weights)
+        pool = create_worker_pool(workers, shared, distance=distance)
+        shards = split_shards(len(points), workers)
+
+    # each point's cost, and the index of the point that is its closest candidate
+    costs = np.full(len(points), np.inf)
+    owners = np.zeros(len(points), dtype=np.intp)
+
+    def add_candidates(new):
+        if pool is None:
+            results = [(0, len(points), get_costs(points, weights, points[new], distance))]
+        else:
+            futures = [(start, stop, pool.submit(_shard_costs, start, stop, points[new])) for start, stop in shards]
+            results = [(start, stop, future.result()) for start, stop, future in futures]
+        for start, stop, (new_costs, closest) in results:
+            better = new_costs < costs[start:stop]
+            costs[start:stop][better] = new_costs[better]
+            owners[start:stop][better] = new[closest[better]]
+
+    try:
+        first = max(sample_index(np.cumsum(weights), random), 0)
+        chosen = np.zeros(len(points), dtype=bool)
+        chosen[first] = True
+        add_candidates(np.array([first]))
+
+        for _ in range(rounds):
+            total = costs.sum()
+            if total <= 0 or cancel.is_cancelled():
+                break
+            new = np.flatnonzero(random.random(len(points)) < oversampling * costs / total)
+            if len(new) > 0:
+                chosen[new] = True
+                add_candidates(new)
+
+        candidates = np.flatnonzero(chosen)
+        if len(candidates) <= k_value:
+            return k_means_plus_plus(points, weights, k_value, distance, random, cancel)
+        # weight each candidate by the points closest to it, then pick k of them
+        candidate_weights = np.bincount(owners, weights=weights, minlength=len(points))[candidates]
+        return k_means_plus_plus(points[candidates], candidate_weights, k_value, distance, random, cancel)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+            shared.close()
+
+
+def median_cut_seeds(points, weights, k_value, distance=euclidean, random=None, cancel=None):
+    """
+    Chooses initial centroids with median cut (see median_cut.py). The cuts are already close to a good clustering,
+    so K-Means usually needs fewer iterations from them than from random or K-Means++ starts
+    :param points: an (N, D) array of unique points
+    :param weights: the number of times each point occurs
+    :param k_value: the number of centroids
+    :param distance: unused, since the cuts are made along the channels. accepted like the other seedings
+    :param random: a numpy Generator, only used to fill in centroids if there are fewer than k boxes
+    :param cancel: a CancelToken. if it's cancelled, the rest of the centroids are picked at random
+    :return: a (k, D) float array
+    """
+    centroids = np.empty((k_value, np.shape(points)[1]))
+    found = median_cut(points, weights, k_value, cancel)
+    centroids[:len(found)] = found
+    # there are fewer distinct points than centroids, or the cutting was cancelled
+    centroids[len(found):] = random_seeds(points, k_value - len(found), get_random(random))
+    return centroids
+
+
+# the seeding functions by name, for KMeans(seeding=...)
+SEEDINGS = {
+    'k-means++': k_means_plus_plus,
+    'k-means||': k_means_parallel,
+    'median-cut': median_cut_seeds,
+}
@@ -0,0 +1,216 @@
+"""
+This module quantizes the frames of an animation (an animated GIF or APNG) or a numbered image sequence.
+
+Consecutive frames usually share most of their pixels, so most of the work from one frame carries over to the next:
+- each frame's color histogram is the previous frame's, updated with just the pixels that changed
+- K-Means starts from the previous frame's centroids, so it usually converges in an iteration or two
+- frames that didn't change at all reuse the previous frame's result
+With global_palette=True, the histograms of every frame are added together instead, and one palette is found for the
+whole animation.
+
+    with Image.open('animation.gif') as image:
+        frames, stats = quantize_sequence(image, 16)
+        save_animation(frames, 'out.gif', loop=image.info.get('loop', 0))
+"""
+import re
+import numpy as np
+from PIL import Image, ImageSequence
+from colorclusters.closest_color import get_sum_squared_error
+from colorclusters.distance import euclidean, closest_indices
+from colorclusters.histogram import ColorHistogram, pack_colors
+from colorclusters.image_utils import image_to_pixels, map_index_to_paletted_image
+from colorclusters.k_means import KMeans
+from colorclusters.progress import as_progress
+from colorclusters.cancellation import as_token
+from colorclusters.quantize import get_rgb_image, run_k_means
+
+# once more than this fraction of a frame's pixels have changed, its histogram is counted from scratch instead
+_max_changed = 0.5
+
+
+def sort_numbered(paths):
+    """
+    Sorts file names by the numbers in them, so frame2.png comes before frame10.png
+    :param paths: a list of file paths
+    :return: a sorted list
+    """
+    return sorted(paths, key=lambda path: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)])
+
+
+def count_frames(source):
+    """Gets the number of frames in an animated Image, or a list of Images or file paths"""
+    return getattr(source, 'n_frames', 1) if isinstance(source, Image.Image) else len(source)
+
+
+def iter_frames(source):
+    """
+    Reads the frames of an animation or image sequence. Can be called again to read them again
+    :param source: an animated Image (e.g. a GIF or APNG), or a list of Images or file paths
+    :return: a generator of RGB or RGBA Images. every frame is converted to the mode of the first frame, which is
+                RGBA if the first frame has transparency
+    """
+    frames = ImageSequence.Iterator(source) if isinstance(source, Image.Image) else source
+    mode = None
+    for frame in frames:
+        # frames given as paths are opened here, so they're closed here too
+        opened = not isinstance(frame, Image.Image)
+        if opened:
+            frame = Image.open(frame)
+        try:
+            if mode is None:
+                mode = get_rgb_image(frame).mode
+            yield frame if frame.mode == mode else frame.convert(mode)
+        finally:
+            if opened:
+                frame.close()
+
+
+def frame_histograms(frames):
+    """
+    Counts the colors of each frame. Rather than counting every pixel again, the previous frame's histogram is
+    updated with just the pixels that changed, unless most of them did
+    :param frames: an iterable of RGB or RGBA Images, all in the same mode
+    :return: a generator of (frame, packed, histogram, changed) tuples. packed is the frame's pixels as packed colors,
+                histogram is its ColorHistogram, and changed is the number of pixels that differ from the previous
+                frame (all of them for the first frame, or a frame of a different size)
+    """
+    previous = histogram = None
+    for frame in frames:
+        pixels = image_to_pixels(frame)
+        packed = pack_colors(pixels)
+        changed = None
+        if previous is not None and len(previous) == len(packed):
+            changed = np.flatnonzero(packed != previous)
+        if changed is None or len(changed) > _max_changed * len(packed):
+            histogram = ColorHistogram.from_packed(packed, pixels.shape[1])
+        elif len(changed) > 0:
+            histogram = histogram.update(previous[changed], packed[changed])
+        yield frame, packed, histogram, len(packed) if changed is None else len(changed)
+        previous = packed
+
+
+def remap_frame(packed, histogram, centroids, distance):
+    """
+    Maps a frame's pixels to their closest centroids through its histogram, so each distinct color is only matched
+    once
+    :param packed: the frame's pixels as packed colors
+    :param histogram: the frame's ColorHistogram
+    :param centroids: a list of colors
+    :return: an (index data, sse) tuple
+    """
+    clustering = closest_indices(histogram.colors, centroids, distance)
+    sse = get_sum_squared_error(histogram.colors, clustering, centroids, distance, histogram.counts)
+    return clustering[histogram.find(packed)], sse
+
+
+def quantize_sequence(source, k_value=4, max_shift=3, distance=euclidean, seeding='k-means++', random_state=None,
+                      global_palette=False, progress=None, cancel=None):
+    """
+    Reduces each frame of an animation or image sequence to k colors using K-Means. The first frame is seeded as
+    usual, and each frame after it starts from the centroids of the frame before
+    :param source: an animated Image (e.g. a GIF or APNG), or a list of Images or file paths
+    :param k_value: the number of colors
+    :param max_shift: stop once no centroid shifts more than this
+    :param distance: the distance function
+    :param seeding: how to choose the first frame's centroids: 'random', 'k-means++', 'k-means||' or 'median-cut'
+    :param random_state: an int seed, so the same frames and options always give the same result
+    :param global_palette: True to find one palette for every frame, from the histogram of the whole sequence
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken. once it's cancelled, K-Means stops shifting, and the rest of the frames use the
+                    centroids found so far. every frame is still remapped
+    :return: a (list of paletted images, stats) tuple. each image keeps its frame's duration in info. stats is a
+                dictionary with the number of frames, the iterations of each frame, the total sse, the number of
+                pixels that changed between frames, and whether the run was cancelled
+    """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    total_frames = count_frames(source)
+    results = []
+    iterations = []
+    stats = {'sse': 0.0, 'changed_pixels': 0}
+
+    def add_frame(frame, index_data, colors, sse, changed):
+        result = map_index_to_paletted_image(frame.size, index_data, colors)
+        if 'duration' in frame.info:
+            result.info['duration'] = frame.info['duration']
+        # the first frame has nothing to change from
+        if results:
+            stats['changed_pixels'] += changed
+        results.append(result)
+        stats['sse'] += sse
+        progress.count('frames')
+        progress.report('Quantizing frames', fraction=len(results) / total_frames,
+                        message='Frame %d of %d' % (len(results), total_frames))
+
+    if global_palette:
+        with progress.phase('Counting colors'):
+            total = None
+            for _, _, histogram, _ in frame_histograms(iter_frames(source)):
+                total = histogram if total is None else total.merge(histogram)
+        with progress.phase('Choosing initial centroids'):
+            k_means = KMeans(k_value, total, distance, cancel=cancel, seeding=seeding, random_state=random_state)
+        i, _ = run_k_means(k_means, max_shift, progress, cancel)
+        iterations.append(i)
+        centroids = k_means.get_exact_centroids()
+        colors = [[int(x) for x in centroid] for centroid in centroids]
+        with progress.phase('Building final image'):
+            # every frame's colors are in the combined histogram, so each color is only matched once
+            clustering = closest_indices(total.colors, centroids, distance)
+            for frame, packed, histogram, changed in frame_histograms(iter_frames(source)):
+                index = total.find(histogram.keys)
+                sse = get_sum_squared_error(total.colors[index], clustering[index], centroids, distance,
+                                            histogram.counts)
+                add_frame(frame, clustering[total.find(packed)], colors, sse, changed)
+    else:
+        centroids = colors = index_data = sse = None
+        for frame, packed, histogram, changed in frame_histograms(iter_frames(source)):
+            if results and changed == 0:
+                # nothing moved, so the previous frame's result still stands
+                iterations.append(0)
+                add_frame(frame, index_data, colors, sse, changed)
+                continue
+            with progress.phase('Choosing initial centroids'):
+                k_means = KMeans(k_value, histogram, distance, cancel=cancel, seeding=seeding,
+                                 random_state=random_state, initial_centroids=centroids)
+            i, _ = run_k_means(k_means, max_shift, progress, cancel)
+            iterations.append(i)
+            centroids = k_means.get_exact_centroids()
+            colors = [[int(x) for x in centroid] for centroid in centroids]
+            with progress.phase('Building final image'):
+                index_data, sse = remap_frame(packed, histogram, centroids, distance)
+                add_frame(frame, index_data, colors, sse, changed)
+
+    return results, dict(stats, frames=len(results), iterations=iterations, colors=k_value,
+                         cancelled=cancel.is_cancelled())
+
+
+def save_animation(frames, path, loop=0):
+    """
+    Saves paletted frames as an animated GIF or APNG, depending on the file extension. An APNG only has one palette,
+    so if the frames have their own palettes, they're saved in full color instead. A GIF can only make one color of
+    each frame fully transparent, so partly transparent colors are made either opaque or transparent
+    :param frames: a list of Images. each frame's duration is taken from its info
+    :param loop: the number of times the animation repeats, or 0 to repeat forever
+    """
+    if path.lower().endswith('.gif'):
+        frames = [_with_gif_transparency(frame) for frame in frames]
+    elif any(frame.getpalette() != frames[0].getpalette() for frame in frames):
+        frames = [frame.convert('RGBA' if 'transparency' in frame.info else 'RGB') for frame in frames]
+    durations = [frame.info.get('duration', 100) for frame in frames]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=durations, loop=loop)
+
+
+def _with_gif_transparency(frame):
+    """Swaps a frame's alpha values for the single transparent color a GIF can have: the most transparent one"""
+    alpha = frame.info.get('transparency')
+    if not isinstance(alpha, bytes):
+        return frame
+    frame = frame.copy()
+    # the alpha values are padded out to 256, so only look at the palette's own colors
+    alpha = alpha[:len(frame.getpalette()) // 3]
+    index = min(range(len(alpha)), key=alpha.__getitem__)
+    if alpha[index] < 128:
+        frame.info['transparency'] = index
+    else:
+        del frame.info['transparency']
+    return frame
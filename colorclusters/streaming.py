@@ -0,0 +1,173 @@
+"""
+This module quantizes images a strip of rows at a time, for images too large to cluster in one piece.
+Each strip is folded into the color histogram, K-Means runs on the histogram, and then each strip is remapped
+straight into the output image. Given a .npy file of pixels, each strip is read from the file on its own, so
+only one strip is in memory at a time, on top of the histogram and the paletted output (one byte per pixel). An array
+that's already in memory, such as a decoded PIL image, is only spared the copies the whole-image pipeline makes.
+A numpy.memmap works too, but the pages it has read stay resident until the OS needs the memory back.
+"""
+import os
+import numpy as np
+from colorclusters.closest_color import get_sum_squared_error
+from colorclusters.distance import euclidean, closest_indices
+from colorclusters.histogram import ColorHistogram, get_channel_bits
+from colorclusters.image_utils import map_index_to_paletted_image
+from colorclusters.k_means import KMeans
+from colorclusters.palette_lookup import get_palette_lookup
+from colorclusters.progress import as_progress
+from colorclusters.cancellation import as_token
+from colorclusters.quantize import bin_colors, get_cache_key, run_k_means
+
+# the default number of rows per strip
+_strip_rows = 256
+
+
+def array_strips(array, strip_rows=_strip_rows):
+    """
+    Splits a (height, width, channels) array (or memmap) into strips of rows, without copying it
+    :return: a generator of (rows, width, channels) arrays
+    """
+    for top in range(0, len(array), strip_rows):
+        yield array[top:top + strip_rows]
+
+
+def npy_shape(path):
+    """
+    Reads the header of a .npy file of pixels
+    :return: a (shape, offset of the data) tuple
+    """
+    with open(path, 'rb') as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        if dtype != np.uint8 or fortran_order or len(shape) != 3 or shape[2] not in (3, 4):
+            raise ValueError('expected (height, width, 3 or 4) uint8 pixels in %s' % path)
+        return shape, file.tell()
+
+
+def npy_strips(path, strip_rows=_strip_rows):
+    """
+    Reads a .npy file of (height, width, channels) uint8 pixels a strip of rows at a time, so the rest of the file
+    is never in memory
+    :return: a generator of (rows, width, channels) arrays
+    """
+    (height, width, channels), offset = npy_shape(path)
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for top in range(0, height, strip_rows):
+            rows = min(strip_rows, height - top)
+            strip = np.fromfile(file, dtype=np.uint8, count=rows * width * channels)
+            if len(strip) < rows * width * channels:
+                raise ValueError('%s ends before its last row' % path)
+            yield strip.reshape(rows, width, channels)
+
+
+def stream_histogram(strips, cancel=None):
+    """
+    Counts the colors of an image, one strip at a time
+    :param strips: an iterable of (rows, width, channels) uint8 arrays
+    :param cancel: a CancelToken. once it's cancelled, no more strips are read, so only the colors of the strips read
+                    so far are counted
+    :return: a ColorHistogram, or None if there were no strips
+    """
+    histogram = None
+    for strip in strips:
+        if histogram is not None and cancel is not None and cancel.is_cancelled():
+            break
+        strip_histogram = ColorHistogram.from_colors(strip.reshape(-1, strip.shape[-1]))
+        histogram = strip_histogram if histogram is None else histogram.merge(strip_histogram)
+    return histogram
+
+
+def stream_remap(strips, size, centroids, distance=euclidean):
+    """
+    Remaps an image to a palette one strip at a time, writing straight into the paletted image's data
+    :param strips: an iterable of (rows, width, channels) uint8 arrays
+    :param size: the (width, height) of the image
+    :param centroids: a list of colors. each pixel is matched to the closest exact centroid, and the palette holds
+                        them rounded down, like quantize.quantize_k_means
+    :param distance: the function used to compute the closest palette color for each pixel's color
+    :return: a paletted image
+    """
+    index_data = np.empty((size[1], size[0]), dtype=np.uint8)
+    top = 0
+    lookup = None
+    for strip in strips:
+        if lookup is None:
+            lookup = get_palette_lookup(centroids, distance, strip.shape[-1])
+        rows = len(strip)
+        index_data[top:top + rows] = lookup.lookup(strip.reshape(-1, strip.shape[-1])).reshape(rows, -1)
+        top += rows
+    return map_index_to_paletted_image(size, index_data, [[int(x) for x in centroid] for centroid in centroids])
+
+
+def quantize_streaming(pixels, k_value=4, max_shift=3, distance=euclidean, plus_plus=False, strip_rows=_strip_rows,
+                       progress=None, cancel=None, seeding=None, random_state=None, cache=None, bits=None,
+                       use_bounds=False):
+    """
+    Reduces an image to k colors using K-Means on its histogram, reading the image one strip at a time
+    :param pixels: a (height, width, channels) uint8 array of RGB or RGBA pixels, or the path of a .npy file of them.
+                    they're read twice, once to count the colors and once to remap them. a file is read a strip at a
+                    time, so the whole image is never in memory
+    :param strip_rows: the number of rows in each strip
+    :param progress: a Progress to report to, or a queue for text updates
+    :param cancel: a CancelToken. once it's cancelled, the colors are clustered from the strips counted so far, and
+                    the centroids found so far are used. the image is always remapped in full
+    :param seeding: how to choose the initial centroids, like quantize.quantize_k_means
+    :param random_state: an int seed, so the same image and options always give the same result
+    :param cache: a PaletteCache, like quantize.quantize_k_means
+    :param bits: the bits kept in each channel when binning the colors, like quantize.quantize_k_means
+    :param use_bounds: True to skip the distance computations the triangle inequality rules out, like
+                        quantize.quantize_k_means
+    :return: a (paletted image, stats) tuple, like quantize.quantize_k_means
+    """
+    progress = as_progress(progress)
+    cancel = as_token(cancel)
+    if isinstance(pixels, (str, os.PathLike)):
+        (height, width, _), _ = npy_shape(pixels)
+        read_strips = npy_strips
+    else:
+        height, width = pixels.shape[:2]
+        read_strips = array_strips
+
+    with progress.phase('Counting colors'):
+        histogram = stream_histogram(read_strips(pixels, strip_rows), cancel)
+
+    key = cached = None
+    if cache is not None and not cancel.is_cancelled():
+        parameters = {'algorithm': 'k-means (streaming)', 'k_value': k_value, 'max_shift': max_shift,
+                      'seeding': seeding or ('k-means++' if plus_plus else 'random'), 'random_state': random_state,
+                      'bits': bits and get_channel_bits(bits, histogram.channels)}
+        key = get_cache_key(histogram, distance, parameters)
+        cached = cache.get(key) if key is not None else None
+
+    if cached is not None:
+        centroids, stats = cached
+    else:
+        datapoints, weights, binning = histogram, None, None
+        if bits:
+            datapoints, weights, binning = bin_colors(histogram, bits, progress)
+        with progress.phase('Choosing initial centroids'):
+            k_means = KMeans(k_value, datapoints, distance, use_kmeans_plus_plus=plus_plus,
+                             weights=weights, cancel=cancel, seeding=seeding, random_state=random_state,
+                             use_bounds=use_bounds)
+        i, _ = run_k_means(k_means, max_shift, progress, cancel)
+        centroids = k_means.get_exact_centroids()
+        # if counting was cancelled, the sse only covers the strips that were counted
+        if binning is None:
+            stats = {'iterations': i, 'sse': k_means.get_sum_square_error()}
+        else:
+            # the sse is measured against the real colors, not the bins
+            colors = histogram.colors
+            sse = get_sum_squared_error(colors, closest_indices(colors, centroids, distance), centroids, distance,
+                                        histogram.counts)
+            stats = {'iterations': i, 'sse': sse, 'binning': binning}
+        if key is not None and not cancel.is_cancelled():
+            cache.put(key, centroids, stats)
+
+    with progress.phase('Building final image'):
+        # matched against the same exact centroids the sse was measured with
+        res_image = stream_remap(read_strips(pixels, strip_rows), (width, height), centroids, distance)
+    return res_image, dict(stats, colors=k_value, cancelled=cancel.is_cancelled(), cached=cached is not None)
@@ -1,80 +1,113 @@
-import math
+import numpy as np
 
 
 class EuclideanSpace(object):
-    def __init__(self, points, partitions, min_val, max_val, dimension=0):
-        if len(points) == 0:
-            self.points = points
-            self.sub_spaces = None
-            self.total_points = 0
-        else:
-            if dimension == len(points[0]):
-                self.points = points
-                self.sub_spaces = None
-                self.total_points = len(points)
-            else:
-                self.points = None
-                self.sub_spaces = generate_sub_spaces(points, partitions, min_val, max_val, dimension)
-                self.total_points = 0
-                for sub_space in self.sub_spaces.values():
-                    self.total_points += sub_space.total_points
-
-    def get_points_in_range(self, center, radius, dimension=0):
+    """
+    A uniform grid over a set of points, stored like a compressed sparse row matrix: the points are sorted by the
+    cell they fall in and kept in one contiguous array, and offsets[c]:offsets[c+1] is the slice holding cell c.
+    Cells are numbered in row-major order, so the cells along the last dimension of a query box are one slice.
+    """
+    def __init__(self, points, partitions, min_val, max_val, weights=None):
         """
-        Find all points in a cube surrounding the sphere centered at 'center' and with radius 'radius'
-        :param center: Center of the sphere
-        :param radius: Radius of sphere
-        :return: The set of points within the bounds
+        Sorts the points into the grid. The caller's points are not modified.
+        :param points: an (N, D) array or a list of n-tuples
+        :param partitions: the number of cells along each dimension
+        :param min_val: the minimum value of any dimension
+        :param max_val: the maximum value of any dimension
+        :param weights: an (N,) array with the number of times each point occurs. each point occurs once by default
         """
-        if self.points is not None:
-            return self.points
-        else:
-            min_val = center[dimension] - radius
-            max_val = center[dimension] + radius
-            sub_spaces_to_get = []
-            for key in self.sub_spaces.keys():
-                if ranges_intersect(key, (min_val, max_val)):
-                    sub_spaces_to_get.append(self.sub_spaces[key])
-            points_to_return = []
-            for sub_space in sub_spaces_to_get:
-                points_to_return = points_to_return + sub_space.get_points_in_range(center, radius, dimension+1)
-            return points_to_return
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2:
+            points = points.reshape(len(points), -1)
+        self.partitions = max(1, int(partitions))
+        self.dimensions = points.shape[1]
+        self.min_val = min_val
+        self.cell_size = (max_val + 1 - min_val) / self.partitions
+        self.total_points = len(points)
 
+        cells = np.ravel_multi_index(self.get_cell_coordinates(points).T, self.get_shape())
+        # the index of each sorted point in the original points
+        self.order = np.argsort(cells, kind='stable')
+        self.points = points[self.order]
+        # the weight of each sorted point
+        self.weights = np.ones(len(points)) if weights is None else np.asarray(weights)[self.order]
 
-def generate_sub_spaces(points, partitions, min_val, max_val, dimension):
-    sub_spaces = {}
-    partition_size = (max_val+1-min_val)/partitions
-    sort_function = sort_by(dimension)
-    points.sort(key=sort_function)
+        counts = np.bincount(cells, minlength=self.partitions ** self.dimensions)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=self.offsets[1:])
 
-    last_partition_ended_at = 0
-    for i in range(int(partitions)):
-        sub_space_points = []
-        min_val_for_sub_space = min_val + partition_size*(i)
-        max_val_for_sub_space = min_val + partition_size*(i+1)
-        for j in range(last_partition_ended_at, len(points)):
-            if points[j][dimension] < max_val_for_sub_space:
-                sub_space_points.append(points[j])
-            else:
-                last_partition_ended_at = j
-                break
-            if j == len(points) - 1:
-                last_partition_ended_at = j+1
-        sub_spaces[(min_val_for_sub_space, max_val_for_sub_space)] = \
-            (EuclideanSpace(sub_space_points, partitions, min_val, max_val, dimension+1))
+    @classmethod
+    def from_sorted(cls, points, weights, offsets, partitions, min_val, cell_size):
+        """
+        Recreates a space from the arrays of an existing one, without sorting the points again.
+        Used to share one space between processes
+        :param points: the points attribute of the original space
+        :param weights: the weights attribute of the original space
+        :param offsets: the offsets attribute of the original space
+        :return: a space using the given arrays. its order attribute is None
+        """
+        space = cls.__new__(cls)
+        space.partitions = partitions
+        space.dimensions = points.shape[1]
+        space.min_val = min_val
+        space.cell_size = cell_size
+        space.total_points = len(points)
+        space.order = None
+        space.points = points
+        space.weights = weights
+        space.offsets = offsets
+        return space
 
-    return sub_spaces
+    def get_shape(self):
+        return (self.partitions,) * self.dimensions
+
+    def get_cell_coordinates(self, points):
+        """Finds the grid coordinates of the cell each point falls in. Points outside the grid use the edge cells"""
+        coordinates = np.floor((np.asarray(points) - self.min_val) / self.cell_size).astype(np.intp)
+        return np.clip(coordinates, 0, self.partitions - 1)
+
+    def get_index_ranges(self, center, radius):
+        """
+        Find the slices of self.points covering a cube surrounding the sphere centered at 'center' and with radius
+        'radius'. No points are copied.
+        :param center: Center of the sphere
+        :param radius: Radius of sphere
+        :return: a (starts, stops) tuple of arrays. every non-empty slice points[start:stop] is returned
+        """
+        center = np.asarray(center, dtype=np.float64)[:self.dimensions]
+        low = self.get_cell_coordinates(center - radius)
+        high = self.get_cell_coordinates(center + radius)
 
+        # the first cell of each row of cells along the last dimension
+        strides = self.partitions ** np.arange(self.dimensions - 1, -1, -1)
+        first_cells = np.zeros(1, dtype=np.intp)
+        for d in range(self.dimensions - 1):
+            first_cells = (first_cells[:, None] + np.arange(low[d], high[d] + 1) * strides[d]).reshape(-1)
 
-def sort_by(x):
-    def sort_by_elem(elem):
-        return elem[x]
-    return sort_by_elem
+        starts = self.offsets[first_cells + low[-1]]
+        stops = self.offsets[first_cells + high[-1] + 1]
+        non_empty = starts < stops
+        return starts[non_empty], stops[non_empty]
 
+    def get_slices_in_range(self, center, radius):
+        """
+        Find all points in a cube surrounding the sphere centered at 'center' and with radius 'radius'
+        :param center: Center of the sphere
+        :param radius: Radius of sphere
+        :return: a list of views into self.points, which together hold the points within the bounds
+        """
+        return [self.points[start:stop] for start, stop in zip(*self.get_index_ranges(center, radius))]
 
-def ranges_intersect(space_key, centroid_range):
-    space_key_min = space_key[0]
-    space_key_max = space_key[1]
-    centroid_range_min = centroid_range[0]
-    centroid_range_max = centroid_range[1]
-    return space_key_min <= centroid_range_min < space_key_max or space_key_min <= centroid_range_max <space_key_max
+    def get_points_in_range(self, center, radius):
+        """
+        Find all points in a cube surrounding the sphere centered at 'center' and with radius 'radius'
+        :param center: Center of the sphere
+        :param radius: Radius of sphere
+        :return: an (M, D) array of the points within the bounds. a view if they're all in one slice
+        """
+        slices = self.get_slices_in_range(center, radius)
+        if len(slices) == 1:
+            return slices[0]
+        if len(slices) == 0:
+            return self.points[:0]
+        return np.concatenate(slices)
@@ -4,8 +4,9 @@ from tkinter import filedialog
 from PIL import Image, ImageTk, ImageOps
 import threading
 import queue
-from colorclusters import image_utils as img_utils, mean_shift, closest_color, distance as dist_func
-from colorclusters.k_means import KMeans
+from colorclusters import image_utils as img_utils, quantize, distance as dist_func
+from colorclusters.progress import Progress, format_event
+from colorclusters.cancellation import CancelToken
 from ast import literal_eval
 
 # the maximum size of the image labels
@@ -55,13 +56,13 @@ class Window(Frame):
         self.init_menu()
 
         self.input_image = Image.new("RGBA", _img_size, 0)
+        # both labels start out as the same empty grid
         photo = ImageTk.PhotoImage(img_utils.add_transparency_grid(self.input_image))
         self.input_label = Label(self, image=photo)
         self.input_label.image = photo
         self.input_label.pack(side=LEFT)
 
         self.output_image = Image.new("RGBA", _img_size, 0)
-        photo = ImageTk.PhotoImage(img_utils.add_transparency_grid(self.input_image))
         self.out_label = Label(self, image=photo)
         self.out_label.image = photo
         self.out_label.pack(side=RIGHT)
@@ -133,8 +134,8 @@ class Window(Frame):
         self.set_button_state(DISABLED)
 
         # set required arguments
-        self.thread_run_flag = BooleanVar()
-        self.thread_run_flag.set(True)
+        # the algorithms check this between chunks of work, so "Suggest Stop" can end any phase
+        self.thread_run_flag = CancelToken()
         if 'image' not in kwargs:
             kwargs['image'] = self.input_image
         if 'run_var' not in kwargs:
@@ -152,7 +153,7 @@ class Window(Frame):
 
     def halt_thread(self):
         if self.thread_run_flag is not None:
-            self.thread_run_flag.set(False)
+            self.thread_run_flag.cancel()
 
     def add_algorithm(self, name, algorithm, **kwargs):
         options = Frame(self.algorithms)
@@ -257,58 +258,77 @@ _k_mean_args = \
     {'k_value': ('K Value:', 4),
      'max_shift': ('End if shift less than:', 3),
      'distance': ('Distance function:', 'euclidean'),
-     'plus_plus': ('Use K-Means++', True)}
+     'batch_size': ('Mini-batch size (0 for full passes):', 0),
+     'workers': ('Worker processes (0 for none):', 0),
+     'plus_plus': ('Use K-Means++', True),
+     'use_bounds': ('Skip distances with bounds (full passes only)', False)}
 _mean_shift_args = \
     {'max_shift': ('End if shift less than:', 3),
-     'max_centroids': ('Initial sampling (min 16, max 256):', 256),
+     'max_centroids': ('Initial sampling (min 16, max 4096):', 256),
+     'workers': ('Worker processes (0 for none):', 0),
+     'distance': ('Distance function:', 'euclidean'),
+     'reuse_basins': ('Stop centroids headed for a found colour', False)}
+_median_cut_args = \
+    {'k_value': ('Maximum colours:', 16),
      'distance': ('Distance function:', 'euclidean')}
 
 
-def run_k_means(image, run_var, thread_queue, k_value=4, max_shift=3, plus_plus=False, distance=dist_func.euclidean):
+def run_k_means(image, run_var, thread_queue, k_value=4, max_shift=3, plus_plus=False, distance=dist_func.euclidean,
+                batch_size=0, workers=0, use_bounds=False):
     # args have to be converted from input strings
     k_value = int(k_value)
+    batch_size = int(batch_size)
+    workers = int(workers)
     max_shift = float(max_shift)
     plus_plus = bool(plus_plus)
+    use_bounds = bool(use_bounds)
     if isinstance(distance, str):
         distance = dist_func.decode_string(distance)
 
-    # initialize algorithm
-    thread_queue.put("Choosing initial centroids")
-    k_means = KMeans(k_value, list(image.getdata()), distance, use_kmeans_plus_plus=plus_plus)
-    shift = max_shift + 1  # arbitrary value greater than max, so that the loop is entered
-    i = 0
-
-    # run loop with display output
-    thread_queue.put("Shifting centroids")
-    while shift > max_shift and run_var.get():
-        i += 1
-        k_means.shift_centroids()
-        shift = max(k_means.shift_distance)
-        thread_queue.put("Iteration: %d, Shift: %.2f" % (i, shift))
-    thread_queue.put("Iteration: %d, Shift: %.2f\nBuilding final image" % (i, shift))
-    # create and send final result
-    res_image = img_utils.map_index_to_paletted_image(
-        image.size,
-        k_means.get_clustering(),
-        k_means.get_centroids())
-
+    progress = subscribe_progress(thread_queue)
+    res_image, stats = quantize.quantize_k_means(image, k_value, max_shift, distance, plus_plus, batch_size or None,
+                                                 workers or None, progress, run_var, use_bounds=use_bounds)
     thread_queue.put(res_image)
-    thread_queue.put("Iterations: %d\nSSE: %d" % (i,k_means.get_sum_square_error()))
+    thread_queue.put("Iterations: %d\nSSE: %d\n%s" % (stats['iterations'], stats['sse'], format_timings(progress)))
+
 
-def run_mean_shift(image, run_var, thread_queue, distance=dist_func.euclidean, max_shift=3, max_centroids=256):
+def run_mean_shift(image, run_var, thread_queue, distance=dist_func.euclidean, max_shift=3, max_centroids=256,
+                   workers=0, reuse_basins=False):
     # convert args from input strings
     max_shift = int(max_shift)
+    workers = int(workers)
+    reuse_basins = bool(reuse_basins)
     if isinstance(distance, str):
         distance = dist_func.decode_string(distance)
 
-    pixels = list(image.getdata())
-    color_palette = mean_shift.mine(pixels, thread_queue, distance_alg=distance, min_movement=max_shift, max_centroids=max_centroids)
-    new_image = img_utils.map_to_paletted_image(image, color_palette, distance=distance, output_queue=thread_queue)
+    progress = subscribe_progress(thread_queue)
+    new_image, stats = quantize.quantize_mean_shift(image, max_shift, max_centroids, distance, workers or None,
+                                                    progress, run_var, reuse_basins=reuse_basins)
+    thread_queue.put(new_image)
+    thread_queue.put("Colours used: %d\nSSE: %d\n%s" % (stats['colors'], stats['sse'], format_timings(progress)))
+
 
+def run_median_cut(image, run_var, thread_queue, k_value=16, distance=dist_func.euclidean):
+    # convert args from input strings
+    k_value = int(k_value)
+    if isinstance(distance, str):
+        distance = dist_func.decode_string(distance)
+
+    progress = subscribe_progress(thread_queue)
+    new_image, stats = quantize.quantize_median_cut(image, k_value, distance, progress, run_var)
     thread_queue.put(new_image)
-    thread_queue.put("Colours used: %d\nSSE: %d" %
-                     (len(color_palette),
-                      closest_color.get_sum_squared_error(pixels, list(new_image.getdata()), color_palette, distance)))
+    thread_queue.put("Colours used: %d\nSSE: %d\n%s" % (stats['colors'], stats['sse'], format_timings(progress)))
+
+
+def subscribe_progress(thread_queue):
+    # the UI only checks the queue every _delay_time, so there's no point sending updates faster than that
+    progress = Progress(min_interval=_delay_time / 1000)
+    progress.subscribe(lambda event: thread_queue.put(format_event(event)))
+    return progress
+
+
+def format_timings(progress):
+    return '\n'.join("%s: %.2fs" % (phase, seconds) for phase, seconds in progress.timings.items())
 
 
 if __name__ == '__main__':
@@ -317,4 +337,5 @@ if __name__ == '__main__':
     app = Window(root)
     app.add_algorithm("K-Means", run_k_means, **_k_mean_args)
     app.add_algorithm("Mean-Shift", run_mean_shift, **_mean_shift_args)
+    app.add_algorithm("Median-Cut", run_median_cut, **_median_cut_args)
     root.mainloop()
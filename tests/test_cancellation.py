@@ -0,0 +1,63 @@
+from colorclusters import mean_shift
+from colorclusters.cancellation import CancelToken, NEVER_CANCEL, as_token
+from colorclusters.closest_color import map_pixels_to_closest_color_index
+from colorclusters.distance import euclidean, manhattan
+from colorclusters.image_utils import image_to_pixels
+from colorclusters.k_means import KMeans
+from colorclusters.quantize import quantize_k_means, quantize_mean_shift
+from benchmarks.images import noisy_photo
+
+palette = [(0, 0, 0), (255, 255, 255), (200, 30, 30)]
+
+
+def cancelled():
+    token = CancelToken()
+    token.cancel()
+    return token
+
+
+def test_token():
+    assert as_token(None) is NEVER_CANCEL
+    assert CancelToken(budget=0).is_cancelled()
+    assert CancelToken(budget=0).remaining() == 0
+    assert not CancelToken(budget=60).is_cancelled()
+    assert CancelToken(budget=60).remaining() > 59
+    running = [True]
+    token = as_token(lambda: running[0])
+    assert not token.is_cancelled()
+    running[0] = False
+    assert token.is_cancelled()
+    # stays cancelled
+    running[0] = True
+    assert token.is_cancelled()
+
+
+def test_k_means_plus_plus_still_picks_k_centroids():
+    algorithm = KMeans(8, image_to_pixels(noisy_photo((30, 20))), use_kmeans_plus_plus=True, cancel=cancelled())
+    assert len(algorithm.centroids) == 8
+
+
+def test_quantize_returns_image_when_cancelled():
+    image = noisy_photo((40, 30))
+    result, stats = quantize_k_means(image, 8, 0, cancel=cancelled())
+    assert result.size == image.size and stats['iterations'] == 0 and stats['cancelled']
+    result, stats = quantize_mean_shift(image, cancel=cancelled())
+    assert result.size == image.size and stats['cancelled']
+
+
+def test_mean_shift_falls_back_to_average():
+    points = [(0, 0, 0)] * 3 + [(40, 80, 120)]
+    assert mean_shift.mine(points, cancel=cancelled()) == [[10, 20, 30]]
+
+
+def test_cancelled_remap_uses_the_distance():
+    pixels = image_to_pixels(noisy_photo((20, 10)))
+    slow = lambda x, y: manhattan(x, y)
+    expected = list(map_pixels_to_closest_color_index(pixels, palette, manhattan))
+    assert expected != list(map_pixels_to_closest_color_index(pixels, palette, euclidean))
+    # 8-bit colors, a list of tuples, and colors too large to pack into a lookup table
+    doubled = [tuple(2 * x for x in color) for color in palette]
+    for data, colors in ((pixels, palette), ([tuple(pixel) for pixel in pixels.tolist()], palette),
+                         (pixels * 2.0, doubled)):
+        for dist in (manhattan, slow):
+            assert list(map_pixels_to_closest_color_index(data, colors, dist, cancel=cancelled())) == expected
@@ -0,0 +1,90 @@
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from colorclusters import cli
+from colorclusters.image_utils import image_to_array
+from benchmarks.images import flat_art
+
+
+def read_report(directory):
+    with open(os.path.join(directory, 'report.jsonl')) as report:
+        return [json.loads(line) for line in report]
+
+
+def test_parse_bits():
+    assert cli.parse_bits('5') == 5
+    assert cli.parse_bits('6,6,6,4') == [6, 6, 6, 4]
+    assert cli.parse_bits('5-5-5') == [5, 5, 5]
+    for text in ('9', 'five'):
+        with pytest.raises(Exception):
+            cli.parse_bits(text)
+
+
+@pytest.mark.parametrize('flags', [['--frames', '--cache', 'palettes.sqlite'], ['--sequence', '--bin-bits', '5'],
+                                   ['--frames', '--batch-size', '100'], ['--frames', '-a', 'mean-shift'],
+                                   ['--bounds', '--batch-size', '100'], ['--sequence', '--bounds'], ['-d', 'nonsense']])
+def test_rejects_unsupported_options(flags):
+    with pytest.raises(SystemExit):
+        cli.parse_args(['in.png', '-o', 'out'] + flags)
+
+
+@pytest.mark.parametrize('algorithm', cli.ALGORITHMS)
+def test_quantizes_and_skips_up_to_date(tmp_path, algorithm):
+    flat_art((24, 16), colors=4, seed=1).save(tmp_path / 'art.png')
+    output = tmp_path / 'out'
+    argv = [str(tmp_path / '*.png'), '-o', str(output), '-a', algorithm, '-k', '4', '-j', '1', '--seed', '0']
+    assert cli.main(argv) == 0
+    with Image.open(output / 'art.png') as result:
+        assert result.mode == 'P'
+    assert cli.main(argv) == 0
+    assert [record['status'] for record in read_report(output)] == ['done', 'skipped']
+
+
+def test_strips_of_npy_inputs(tmp_path):
+    image = flat_art((24, 16), colors=4, seed=1)
+    np.save(tmp_path / 'art.npy', image_to_array(image))
+    output = tmp_path / 'out'
+    assert cli.main([str(tmp_path / 'art.npy'), '-o', str(output), '-k', '4', '-j', '1', '--strip-rows', '5']) == 0
+    with Image.open(output / 'art.png') as result:
+        assert result.size == image.size
+    np.save(tmp_path / 'flat.npy', np.zeros((4, 4), dtype=np.uint8))
+    assert cli.main([str(tmp_path / 'flat.npy'), '-o', str(output), '-j', '1', '--strip-rows', '5']) == 1
+
+
+def test_sequence_saves_every_frame(tmp_path):
+    for i in (1, 2, 10):
+        flat_art((16, 16), colors=3, seed=i).save(tmp_path / ('frame%d.png' % i))
+    output = tmp_path / 'out'
+    assert cli.main([str(tmp_path / 'frame*.png'), '-o', str(output), '-k', '3', '--sequence', '--seed', '0']) == 0
+    assert sorted(os.listdir(output)) == ['frame1.png', 'frame10.png', 'frame2.png', 'report.jsonl']
+    assert read_report(output)[0]['frames'] == 3
+
+
+def test_mirrors_input_directories(tmp_path):
+    for directory in ('a', 'b'):
+        (tmp_path / 'in' / directory).mkdir(parents=True)
+        flat_art((16, 16), colors=3, seed=1).save(tmp_path / 'in' / directory / 'art.png')
+    output = tmp_path / 'out'
+    assert cli.main([str(tmp_path / 'in' / '**' / '*.png'), '-o', str(output), '-k', '3', '-j', '1']) == 0
+    assert (output / 'a' / 'art.png').exists() and (output / 'b' / 'art.png').exists()
+
+    # patterns from different roots can still name the same output, which isn't overwritten
+    clash = tmp_path / 'clash'
+    assert cli.main([str(tmp_path / 'in' / 'a' / '*.png'), str(tmp_path / 'in' / 'b' / '*.png'), '-o', str(clash),
+                     '-k', '3', '-j', '1']) == 1
+    assert sorted(record['status'] for record in read_report(clash)) == ['done', 'error']
+
+
+def test_empty_sequence_is_reported(tmp_path):
+    output = tmp_path / 'out'
+    assert cli.main([str(tmp_path / 'missing*.png'), '-o', str(output), '--sequence']) == 1
+    assert read_report(output)[0]['status'] == 'error'
+
+
+def test_reports_errors(tmp_path):
+    (tmp_path / 'broken.png').write_bytes(b'not an image')
+    output = tmp_path / 'out'
+    assert cli.main([str(tmp_path / 'broken.png'), '-o', str(output), '-j', '1']) == 1
+    assert read_report(output)[0]['status'] == 'error'
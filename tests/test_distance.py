@@ -0,0 +1,34 @@
+from colorclusters import distance
+from colorclusters.closest_color import get_closest_color_index, map_pixels_to_closest_color_index
+
+colors = [(0, 0, 0), (12, 250, 3), (255, 255, 255), (100, 7, 200), (31, 31, 31)]
+palette = [(10, 10, 10), (240, 0, 240), (30, 180, 30), (128, 128, 128)]
+functions = [distance.euclidean, distance.manhattan, distance.chebyshev, distance.hamming, distance.norm(3),
+             distance.scaled(distance.euclidean, (1, 2))]
+
+
+def test_batch_matches_pairs():
+    for func in functions:
+        matrix = distance.pairwise_distances(colors, palette, func)
+        for i, color in enumerate(colors):
+            for j, other in enumerate(palette):
+                assert abs(matrix[i, j] - func(color, other)) < 1e-9
+
+
+def test_closest_indices_match_pairs():
+    for func in functions + [lambda x, y: distance.manhattan(x, y)]:
+        expected = [get_closest_color_index(color, palette, func) for color in colors]
+        assert list(distance.closest_indices(colors, palette, func)) == expected
+        assert list(map_pixels_to_closest_color_index(colors * 3, palette, func)) == expected * 3
+
+
+def test_shared_dimensions():
+    assert distance.pairwise_distances([(1, 2, 3, 4)], [(1, 2, 6)], distance.euclidean)[0, 0] == 3
+
+
+def test_closest_two():
+    indices, closest, second = distance.closest_two(colors, palette, distance.manhattan)
+    for color, index, first, other in zip(colors, indices, closest, second):
+        dists = sorted(distance.manhattan(color, p) for p in palette)
+        assert index == get_closest_color_index(color, palette, distance.manhattan)
+        assert (first, other) == (dists[0], dists[1])
@@ -0,0 +1,20 @@
+import numpy as np
+from datastructures.EuclideanSpace import EuclideanSpace
+
+
+def test_range_covers_cube():
+    points = np.random.default_rng(4).integers(0, 256, (5000, 3))
+    space = EuclideanSpace(points, 6, 0, 255)
+    assert space.total_points == len(points)
+    for center, radius in [((10, 200, 128), 21), ((255, 255, 255), 30), ((0, 0, 0), 5), ((128, 128, 128), 100)]:
+        found = {tuple(point) for point in space.get_points_in_range(center, radius).astype(int).tolist()}
+        in_cube = {tuple(point) for point in points.tolist() if np.all(np.abs(np.subtract(point, center)) <= radius)}
+        assert in_cube <= found
+
+
+def test_slices_are_views():
+    points = [(1, 1, 1), (200, 200, 200), (2, 2, 2)]
+    space = EuclideanSpace(points, 4, 0, 255)
+    for view in space.get_slices_in_range((0, 0, 0), 10):
+        assert view.base is space.points
+    assert points == [(1, 1, 1), (200, 200, 200), (2, 2, 2)]
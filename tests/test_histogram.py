@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from colorclusters.histogram import can_pack, pack_colors, unpack_colors, color_histogram, merge_histograms, \
+    update_histogram, bin_histogram, get_channel_bits, ColorHistogram
+
+
+def test_pack_round_trip():
+    colors = [(0, 0, 0, 0), (255, 128, 1, 200), (12, 34, 56, 78)]
+    assert pack_colors(colors).tolist() == [0, 0xFF8001C8, 0x0C22384E]
+    assert unpack_colors(pack_colors(colors), 4).tolist() == [list(color) for color in colors]
+
+
+def test_histogram_counts():
+    keys, counts = color_histogram([(1, 2, 3), (4, 5, 6), (1, 2, 3)])
+    assert unpack_colors(keys, 3).tolist() == [[1, 2, 3], [4, 5, 6]]
+    assert counts.tolist() == [2, 1]
+
+
+def test_can_pack():
+    assert can_pack([(0, 255, 3)])
+    assert not can_pack([(0, 256, 3)])
+    assert not can_pack([(0, 1.5, 3)])
+    assert not can_pack([(1, 2, 3, 4, 5)])
+
+
+def test_merge_histograms():
+    first = [(1, 2, 3), (4, 5, 6), (1, 2, 3)]
+    second = [(4, 5, 6), (7, 8, 9)]
+    keys, counts = merge_histograms(*color_histogram(first), *color_histogram(second))
+    expected_keys, expected_counts = color_histogram(first + second)
+    assert keys.tolist() == expected_keys.tolist()
+    assert counts.tolist() == expected_counts.tolist()
+
+
+def test_update_histogram():
+    before = [(1, 2, 3), (4, 5, 6), (1, 2, 3), (7, 8, 9)]
+    after = [(1, 2, 3), (4, 5, 6), (10, 11, 12), (10, 11, 12)]
+    keys, counts = update_histogram(*color_histogram(before), pack_colors(before[2:]), pack_colors(after[2:]))
+    expected_keys, expected_counts = color_histogram(after)
+    assert keys.tolist() == expected_keys.tolist()
+    assert counts.tolist() == expected_counts.tolist()
+    assert counts.dtype == expected_counts.dtype
+
+
+def test_channel_bits():
+    assert get_channel_bits(5, 3) == (5, 5, 5)
+    assert get_channel_bits((6, 6, 6, 4), 3) == (6, 6, 6)
+    assert get_channel_bits((6, 6, 6), 4) == (6, 6, 6, 8)
+    with pytest.raises(ValueError):
+        get_channel_bits(0, 3)
+
+
+def test_bin_histogram():
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (5000, 4))
+    keys, counts = color_histogram(pixels)
+    colors, bin_counts, error = bin_histogram(keys, counts, 4, (5, 5, 5, 4))
+    assert error['bins'] == len(colors) < len(keys)
+    assert bin_counts.sum() == counts.sum()
+    # the means keep the overall average color, and each color moves less than the size of its bin
+    assert np.allclose((colors * bin_counts[:, None]).sum(axis=0), pixels.sum(axis=0))
+    assert error['mean_error'] <= error['max_error'] < np.hypot(np.hypot(8, 8), np.hypot(8, 16))
+    # with every bit kept, nothing moves
+    colors, _, error = bin_histogram(keys, counts, 4, 8)
+    assert len(colors) == len(keys) and error['max_error'] == 0
+
+
+def test_color_histogram_class():
+    colors = [(1, 2, 3, 4), (5, 6, 7, 8), (1, 2, 3, 4)]
+    histogram = ColorHistogram.from_colors(colors)
+    assert len(histogram) == 2 and histogram.total() == 3
+    assert list(histogram) == [((1, 2, 3, 4), 2), ((5, 6, 7, 8), 1)]
+    assert histogram.colors.tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert histogram.find([(5, 6, 7, 8), (0, 0, 0, 0), (255, 255, 255, 255)]).tolist() == [1, -1, -1]
+    assert histogram.count_of(pack_colors([(1, 2, 3, 4), (9, 9, 9, 9)])).tolist() == [2, 0]
+
+    merged = histogram.merge(ColorHistogram.from_colors([(5, 6, 7, 8), (0, 0, 0, 0)]))
+    assert list(merged) == [((0, 0, 0, 0), 1), ((1, 2, 3, 4), 2), ((5, 6, 7, 8), 2)]
+    chunks = list(merged.chunks(2))
+    assert [len(counts) for _, counts in chunks] == [2, 1]
+    assert np.concatenate([colors for colors, _ in chunks]).tolist() == merged.colors.tolist()
+
+
+def test_color_histogram_serialization():
+    rng = np.random.default_rng(0)
+    histogram = ColorHistogram.from_colors(rng.integers(0, 256, (1000, 3)))
+    restored = ColorHistogram.from_bytes(histogram.to_bytes())
+    assert restored.channels == 3
+    assert restored.keys.tolist() == histogram.keys.tolist()
+    assert restored.counts.tolist() == histogram.counts.tolist()
+    assert len(ColorHistogram.from_bytes(ColorHistogram.from_colors(np.empty((0, 3))).to_bytes())) == 0
+    with pytest.raises(ValueError):
+        ColorHistogram.from_bytes(b'not a histogram at all')
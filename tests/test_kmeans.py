@@ -1,19 +1,156 @@
-from PIL import Image
-from colorclusters import distance
-from colorclusters.image_utils import map_index_to_paletted_image
+import numpy as np
+import pytest
+from colorclusters import distance, palette_lookup
+from colorclusters.histogram import ColorHistogram
+from colorclusters.image_utils import image_to_pixels
 from colorclusters.k_means import KMeans
-from timeit import default_timer
+from colorclusters.quantize import quantize_k_means
+from colorclusters.seeding import k_means_plus_plus, k_means_parallel
+from benchmarks.images import flat_art, noisy_photo
 
-img = Image.open("./images/flower.png")
 
-algorithm = KMeans(16,list(img.getdata()),distance.chebyshev)
+@pytest.mark.parametrize('dist', [distance.euclidean, distance.chebyshev, distance.manhattan])
+def test_flat_colors_are_found_exactly(dist):
+    pixels = image_to_pixels(flat_art((48, 32), colors=4, seed=1))
+    algorithm = KMeans(4, pixels, dist, use_kmeans_plus_plus=True, random_state=0)
+    algorithm.compute_until_max_distance(0)
+    assert sorted(map(tuple, algorithm.get_centroids())) == sorted(set(map(tuple, pixels)))
+    assert algorithm.get_sum_square_error() == 0
 
-start = default_timer()
-algorithm.compute_until_max_distance(5, True)
-end = default_timer()
-print((end-start)//60,"minutes",round((end-start)%60,3),"seconds")
 
-img = map_index_to_paletted_image(img.size, algorithm.get_clustering(), algorithm.get_centroids())
+def test_histogram_matches_plain_data():
+    pixels = image_to_pixels(flat_art((40, 40), colors=8, seed=2))
+    results = []
+    for use_histogram in (True, False):
+        algorithm = KMeans(5, pixels, use_histogram=use_histogram, random_state=3)
+        for _ in range(4):
+            algorithm.shift_centroids()
+        results.append(algorithm.get_centroids())
+    assert results[0] == results[1]
 
-# save the indexed result
-img.save("./images/post_flower_test.png")
+    # a histogram counted beforehand gives the same result as counting the pixels
+    results = []
+    for data in (pixels, ColorHistogram.from_colors(pixels)):
+        algorithm = KMeans(5, data, seeding='k-means++', random_state=3)
+        for _ in range(4):
+            algorithm.shift_centroids()
+        results.append(algorithm.get_centroids())
+    assert results[0] == results[1]
+
+
+def test_iterations_build_no_lookup_tables(monkeypatch):
+    # the centroids change every iteration, so a table built for them would be thrown away
+    def build(*_):
+        raise AssertionError('built a PaletteLookup')
+    monkeypatch.setattr(palette_lookup.PaletteLookup, '__init__', build)
+    algorithm = KMeans(4, image_to_pixels(noisy_photo((20, 20))), use_histogram=False, random_state=0)
+    for _ in range(3):
+        algorithm.shift_centroids()
+    assert len(algorithm.get_clustering()) == 400
+
+
+def test_random_seeding_is_weighted_by_counts():
+    # black is 98% of the pixels, so it should be picked about as often from the histogram as from the pixels
+    pixels = np.array([[0, 0, 0]] * 98 + [[255, 255, 255]] * 2)
+    for data in (pixels, ColorHistogram.from_colors(pixels)):
+        seeds = [KMeans(1, data, seeding='random', random_state=state).centroids[0] for state in range(200)]
+        assert seeds.count([0, 0, 0]) > 180
+
+
+def test_more_centroids_than_colors():
+    algorithm = KMeans(8, [(1, 2, 3)] * 10 + [(200, 100, 0)] * 5, use_kmeans_plus_plus=True, random_state=0)
+    algorithm.compute_until_max_distance(0)
+    assert algorithm.get_sum_square_error() == 0
+
+
+@pytest.mark.parametrize('seeding', ['random', 'k-means++', 'k-means||'])
+def test_seeding_is_reproducible(seeding):
+    pixels = image_to_pixels(noisy_photo((40, 30)))
+    first = KMeans(12, pixels, seeding=seeding, random_state=7).centroids
+    assert KMeans(12, pixels, seeding=seeding, random_state=7).centroids == first
+    assert len(first) == 12
+
+
+@pytest.mark.parametrize('seed', [k_means_plus_plus, k_means_parallel])
+def test_seeding_finds_separate_clusters(seed):
+    # with heavy weights on three far apart points, each should get a centroid
+    points = np.array([[0, 0, 0], [255, 0, 0], [0, 255, 0], [1, 1, 1], [254, 1, 0]])
+    weights = np.array([1000, 1000, 1000, 1, 1])
+    for state in range(10):
+        centroids = seed(points, weights, 3, random=np.random.default_rng(state))
+        clusters = distance.closest_indices(centroids, points[:3])
+        assert sorted(clusters.tolist()) == [0, 1, 2]
+
+
+def test_quantize_binned_colors():
+    image = noisy_photo((80, 60))
+    exact, stats = quantize_k_means(image, 8, 1, seeding='k-means++', random_state=0)
+    binned, binned_stats = quantize_k_means(image, 8, 1, seeding='k-means++', random_state=0, bits=5)
+    assert binned.size == exact.size
+    assert binned_stats['binning']['bins'] < len(np.unique(image_to_pixels(image), axis=0))
+    # the sse is still measured against the real pixels, and binning barely changes it
+    assert binned_stats['sse'] < 1.1 * stats['sse']
+
+
+def test_mini_batch_approaches_full_batch():
+    pixels = image_to_pixels(noisy_photo((80, 60)))
+    full = KMeans(8, pixels, seeding='k-means++', random_state=4)
+    full.compute_until_max_distance(1)
+    batch = KMeans(8, pixels, seeding='k-means++', random_state=4, batch_size=256)
+    for _ in range(60):
+        batch.shift_centroids()
+    assert batch.get_sum_square_error() < 1.1 * full.get_sum_square_error()
+
+
+@pytest.mark.parametrize('dist', [distance.euclidean, distance.manhattan, distance.chebyshev, distance.hamming,
+                                  distance.norm(3), distance.scaled(distance.euclidean, (1, 2, 1))])
+def test_bounded_assignment_matches_full(dist):
+    pixels = image_to_pixels(noisy_photo((60, 40)))
+    full = KMeans(16, pixels, dist, seeding='k-means++', random_state=5)
+    bounded = KMeans(16, pixels, dist, seeding='k-means++', random_state=5, use_bounds=True)
+    for _ in range(8):
+        full.shift_centroids()
+        bounded.shift_centroids()
+        assert bounded.centroids == full.centroids
+    if dist is distance.euclidean:
+        assert bounded.distance_evaluations < full.distance_evaluations / 2
+
+
+def test_quantize_with_bounds():
+    image = noisy_photo((40, 30))
+    expected, expected_stats = quantize_k_means(image, 8, 1, seeding='k-means++', random_state=0)
+    result, stats = quantize_k_means(image, 8, 1, seeding='k-means++', random_state=0, use_bounds=True)
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+    assert stats['iterations'] == expected_stats['iterations']
+    # the sampled and sharded passes don't keep bounds
+    for options in ({'batch_size': 100}, {'workers': 2}):
+        with pytest.raises(ValueError):
+            KMeans(8, image_to_pixels(image), use_bounds=True, **options)
+
+
+def test_workers_match_serial():
+    pixels = image_to_pixels(noisy_photo((60, 40)))
+    results = []
+    for workers in (None, 1, 2):
+        with KMeans(8, pixels, seeding='k-means++', random_state=6, workers=workers) as algorithm:
+            for _ in range(5):
+                algorithm.shift_centroids()
+            results.append(algorithm.centroids)
+    assert results[0] == results[1] == results[2]
+
+
+def test_parallel_seeding_workers_match_serial():
+    histogram = ColorHistogram.from_colors(image_to_pixels(noisy_photo((60, 40))))
+    seeds = [k_means_parallel(histogram.colors, histogram.counts, 8, random=np.random.default_rng(2), workers=workers)
+             for workers in (None, 2)]
+    assert np.array_equal(seeds[0], seeds[1])
+
+
+def test_random_seeding_of_bins_is_weighted_by_pixels():
+    # nearly every pixel is in the dark bin, so random seeding should almost always start there
+    pixels = np.array([[0, 0, 0]] * 97 + [[1, 2, 3]] + [[250, 250, 250], [100, 0, 200]])
+    histogram = ColorHistogram.from_colors(pixels)
+    means, counts, _ = histogram.bin(4)
+    seeds = [KMeans(1, means, seeding='random', weights=counts, random_state=state).centroids[0]
+             for state in range(200)]
+    assert sum(max(seed) < 16 for seed in seeds) > 180
@@ -0,0 +1,90 @@
+import queue
+import numpy as np
+from PIL import Image
+from colorclusters import distance, mean_shift
+from colorclusters.progress import Progress
+from colorclusters.quantize import quantize_mean_shift
+from datastructures.EuclideanSpace import EuclideanSpace
+
+
+def test_merge_keeps_most_supported():
+    centroids = [[10, 10, 10], [11, 10, 10], [100, 100, 100], [12, 11, 10]]
+    kept, supports = mean_shift.merge_similar_centroids(centroids, [5, 20, 7, 1], distance.euclidean, 3)
+    assert kept == [[11, 10, 10], [100, 100, 100]]
+    # the merged centroids cover the same points, so they aren't counted again
+    assert supports == [20, 7]
+    # a distance without a grid falls back to comparing against every kept centroid
+    assert mean_shift.merge_similar_centroids(centroids, [5, 20, 7, 1], lambda x, y: distance.euclidean(x, y), 3)[1] == [20, 7]
+
+
+def test_mine_weighted_matches_repeated():
+    rng = np.random.default_rng(1)
+    centers = rng.integers(20, 236, (5, 3))
+    pixels = np.clip(centers[rng.integers(0, 5, 20000)] + rng.normal(0, 6, (20000, 3)), 0, 255).astype(int)
+    # a few colors repeated many times, so the averages are off if the repeats aren't weighted
+    pixels = np.concatenate((pixels, np.repeat(pixels[:20], 500, axis=0)))
+    unique, counts = np.unique(pixels, axis=0, return_counts=True)
+    palette = mean_shift.mine(unique, queue.Queue(), max_centroids=64, weights=counts)
+    # with weights given, the repeated pixels aren't counted up first, so every repeat is averaged on its own
+    assert palette == mean_shift.mine(pixels, queue.Queue(), max_centroids=64, weights=np.ones(len(pixels)))
+    assert palette != mean_shift.mine(unique, queue.Queue(), max_centroids=64, weights=np.ones(len(unique)))
+    assert 3 <= len(palette) <= 64
+
+
+def test_occupied_cell_seeds():
+    points = np.array([[0, 0, 0], [2, 2, 2], [100, 0, 0], [0, 200, 0]])
+    seeds = mean_shift.occupied_cell_seeds(points, np.array([1, 3, 6, 1]), 20, min_support=0.1)
+    # the first two points share a cell, and the last cell holds too little of the weight
+    assert seeds == [[100, 0, 0], [1.5, 1.5, 1.5]]
+    assert mean_shift.occupied_cell_seeds(points, np.ones(4), 20, max_seeds=1) == [[1, 1, 1]]
+
+
+def test_occupancy_seeding_starts_fewer_centroids():
+    colors = np.array([[255, 255, 255], [200, 30, 30], [30, 30, 200], [20, 20, 20]])
+    pixels = colors[np.random.default_rng(2).integers(0, 4, 5000)]
+    progress = {seeding: Progress() for seeding in ('lattice', 'occupancy')}
+    palettes = {seeding: mean_shift.mine(pixels, progress[seeding], seeding=seeding) for seeding in progress}
+    assert progress['occupancy'].counters['seeds'] * 4 <= progress['lattice'].counters['seeds']
+    assert sorted(palettes['occupancy']) == sorted(colors.tolist())
+
+
+def test_basins_stop_centroids_on_a_settled_path():
+    rng = np.random.default_rng(3)
+    centers = np.array([[40, 40, 40], [200, 60, 120], [90, 220, 30]])
+    pixels = np.clip(centers[rng.integers(0, 3, 6000)] + rng.normal(0, 4, (6000, 3)), 0, 255).astype(int)
+    progress = {reuse: Progress() for reuse in (False, True)}
+    palettes = {reuse: mean_shift.mine(pixels, progress[reuse], seeding='lattice', max_centroids=512,
+                                       min_movement=1, reuse_basins=reuse) for reuse in progress}
+    assert sorted(palettes[True]) == sorted(palettes[False])
+    assert progress[True].counters['centroids captured'] > 0
+    assert progress[True].counters['windows'] < progress[False].counters['windows']
+
+    # quantize_mean_shift passes the option on
+    image = Image.fromarray(pixels.reshape(60, 100, 3).astype(np.uint8))
+    quantized = Progress()
+    quantize_mean_shift(image, 1, 512, progress=quantized, seeding='lattice', reuse_basins=True)
+    assert quantized.counters['centroids captured'] > 0
+
+
+def test_parallel_matches_serial():
+    rng = np.random.default_rng(4)
+    centers = rng.integers(20, 236, (6, 3))
+    pixels = np.clip(centers[rng.integers(0, 6, 8000)] + rng.normal(0, 8, (8000, 3)), 0, 255).astype(int)
+    serial = mean_shift.mine(pixels, max_centroids=64)
+    assert mean_shift.mine(pixels, max_centroids=64, workers=2) == serial
+
+
+def test_captured_centroids_add_no_support():
+    rng = np.random.default_rng(3)
+    centers = np.array([[40, 40, 40], [200, 60, 120], [90, 220, 30]])
+    pixels = np.clip(centers[rng.integers(0, 3, 6000)] + rng.normal(0, 4, (6000, 3)), 0, 255).astype(int)
+    points, weights = mean_shift.get_unique_points(pixels)
+    space = EuclideanSpace(np.asarray(points), 8, 0, 255, weights)
+    seeds = mean_shift.map_centroids_into_space(16, 8, 3, 0)
+    progress = Progress()
+    centroids, supports = mean_shift.mine_final_centroids(space, seeds, distance.euclidean, 16, 1, progress,
+                                                          reuse_basins=True)
+    assert progress.counters['centroids captured'] > 0
+    # each colour's support is the pixels around it, however many seeds ended up there
+    assert len(centroids) == 3
+    assert sum(supports) <= len(pixels)
@@ -0,0 +1,46 @@
+import numpy as np
+from colorclusters import distance
+from colorclusters.image_utils import image_to_pixels
+from colorclusters.k_means import KMeans
+from colorclusters.median_cut import median_cut
+from colorclusters.quantize import quantize_median_cut
+from colorclusters.seeding import median_cut_seeds
+from benchmarks.images import flat_art, noisy_photo
+
+
+def test_every_box_is_used():
+    rng = np.random.default_rng(0)
+    points = rng.integers(0, 256, (3000, 3))
+    weights = rng.integers(1, 10, 3000)
+    centroids = median_cut(points, weights, 16)
+    assert centroids.shape == (16, 3)
+    # each mean is inside its own box, so every palette color ends up closest to some of the points
+    clustering = distance.closest_indices(points, centroids)
+    assert len(np.unique(clustering)) == 16
+
+
+def test_few_colors_are_found_exactly():
+    image = flat_art((60, 40))
+    colors = np.unique(image_to_pixels(image), axis=0)
+    result, stats = quantize_median_cut(image, 64)
+    assert stats['colors'] == len(colors) and stats['sse'] == 0
+    assert sorted(map(tuple, np.asarray(result.convert('RGB')).reshape(-1, 3).tolist())) == \
+        sorted(map(tuple, image_to_pixels(image).tolist()))
+
+
+def test_median_cut_seeding():
+    pixels = image_to_pixels(noisy_photo((80, 60)))
+    unique, counts = np.unique(pixels, axis=0, return_counts=True)
+    # it doesn't depend on the random generator unless there are too few boxes
+    assert np.array_equal(median_cut_seeds(unique, counts, 8, random=1), median_cut_seeds(unique, counts, 8, random=2))
+    assert median_cut_seeds(unique[:3], counts[:3], 8).shape == (8, 3)
+
+    k_means = KMeans(8, pixels, seeding='median-cut', random_state=0)
+    assert np.allclose(k_means.centroids, median_cut(unique, counts, 8))
+
+
+def test_quantize_keeps_at_most_256_colors():
+    image = noisy_photo((60, 40))
+    result, stats = quantize_median_cut(image, 1000)
+    assert stats['colors'] == 256
+    assert len(result.getcolors()) <= 256
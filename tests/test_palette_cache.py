@@ -0,0 +1,51 @@
+import numpy as np
+from colorclusters import distance
+from colorclusters.histogram import color_histogram
+from colorclusters.palette_cache import PaletteCache, fingerprint
+from colorclusters.quantize import quantize_k_means, quantize_mean_shift
+from benchmarks.images import noisy_photo
+
+
+def test_round_trip_and_eviction():
+    with PaletteCache(':memory:', max_entries=2) as cache:
+        cache.put('a', [(1, 2, 3)], {'sse': 1.5})
+        cache.put('b', [(4, 5, 6)], {'sse': 2})
+        assert cache.get('a') == ([[1, 2, 3]], {'sse': 1.5})
+        # 'b' is now the least recently used
+        cache.put('c', [(7, 8, 9)], {'sse': 3})
+        assert len(cache) == 2
+        assert cache.get('b') is None
+        assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_fingerprint():
+    keys, counts = color_histogram([(1, 2, 3), (4, 5, 6), (1, 2, 3)])
+    key = fingerprint(keys, counts, {'k_value': 4})
+    assert key == fingerprint(keys.copy(), counts.astype(np.uint64), {'k_value': 4})
+    assert key != fingerprint(keys, counts, {'k_value': 5})
+    assert key != fingerprint(keys, counts + 1, {'k_value': 4})
+
+
+def test_quantize_reuses_palette():
+    image = noisy_photo((50, 40))
+    with PaletteCache(':memory:') as cache:
+        first, stats = quantize_k_means(image, 8, 1, plus_plus=True, random_state=2, cache=cache)
+        second, cached_stats = quantize_k_means(image, 8, 1, plus_plus=True, random_state=2, cache=cache)
+        assert not stats['cached'] and cached_stats['cached']
+        assert cached_stats['sse'] == stats['sse'] and cached_stats['iterations'] == stats['iterations']
+        assert first.tobytes() == second.tobytes() and first.getpalette() == second.getpalette()
+        # different options miss
+        _, stats = quantize_k_means(image, 6, 1, plus_plus=True, random_state=2, cache=cache)
+        assert not stats['cached']
+
+        first, _ = quantize_mean_shift(image, cache=cache)
+        second, stats = quantize_mean_shift(image, cache=cache)
+        assert stats['cached'] and first.tobytes() == second.tobytes()
+        _, stats = quantize_mean_shift(image, cache=cache, reuse_basins=True)
+        assert not stats['cached']
+
+
+def test_user_distances_are_not_cached():
+    with PaletteCache(':memory:') as cache:
+        quantize_k_means(noisy_photo((20, 10)), 4, 1, distance=lambda x, y: distance.euclidean(x, y), cache=cache)
+        assert len(cache) == 0
@@ -0,0 +1,30 @@
+import numpy as np
+from colorclusters import distance
+from colorclusters.palette_lookup import PaletteLookup, get_palette_lookup
+
+
+def test_lookup_matches_search():
+    rng = np.random.default_rng(2)
+    for dimensions in (3, 4):
+        palette = rng.integers(0, 256, (24, dimensions))
+        pixels = rng.integers(0, 256, (20000, dimensions)).astype(np.uint8)
+        for func in (distance.euclidean, distance.manhattan, distance.chebyshev, distance.hamming,
+                     distance.scaled(distance.euclidean, (1, 2, 1, 1))):
+            lookup = PaletteLookup(palette, func)
+            expected = distance.closest_indices(pixels, palette, func)
+            assert (lookup.lookup(pixels) == expected).all()
+            # the second pass uses the remembered matches
+            assert (lookup.lookup(pixels) == expected).all()
+
+
+def test_full_table_is_exact():
+    palette = [(0, 0, 0), (255, 255, 255), (255, 0, 0)]
+    lookup = PaletteLookup(palette, bits=8)
+    assert (lookup.table >= 0).all()
+    assert lookup.lookup([(10, 10, 10), (250, 240, 255), (200, 30, 10)]).tolist() == [0, 1, 2]
+
+
+def test_lookups_are_reused():
+    palette = [(0, 0, 0), (255, 255, 255)]
+    assert get_palette_lookup(palette) is get_palette_lookup([[0, 0, 0], [255, 255, 255]])
+    assert get_palette_lookup(palette) is not get_palette_lookup(palette, distance.manhattan)
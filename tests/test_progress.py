@@ -0,0 +1,51 @@
+import queue
+from colorclusters import mean_shift
+from colorclusters.progress import Progress, ProgressEvent, NO_PROGRESS, format_event, as_progress
+from colorclusters.quantize import quantize_k_means
+from benchmarks.images import flat_art
+
+
+def test_reports_are_rate_limited():
+    progress = Progress(min_interval=60)
+    events = []
+    progress.subscribe(events.append)
+    for i in range(100):
+        progress.report('Shifting centroids', iteration=i)
+    progress.report('Shifting centroids', iteration=100, final=True)
+    progress.report('Remapping pixels', 0.5)
+    assert [(event.phase, event.iteration) for event in events] == \
+        [('Shifting centroids', 0), ('Shifting centroids', 100), ('Remapping pixels', None)]
+
+
+def test_no_progress_does_nothing():
+    assert as_progress(None) is NO_PROGRESS
+    NO_PROGRESS.count('distance evaluations', 10)
+    with NO_PROGRESS.phase('Moving centroids'):
+        NO_PROGRESS.report('Moving centroids', 0.5)
+    assert NO_PROGRESS.summary() == {'counters': {}, 'timings': {}}
+
+
+def test_format_event():
+    assert format_event(ProgressEvent('Remapping pixels', 0.25, None, None, '12 distinct colors found')) == \
+        '12 distinct colors found\nRemapping pixels: 25% complete'
+    assert format_event(ProgressEvent('Shifting centroids', None, 3, 1.5, None)) == \
+        'Shifting centroids\nIteration: 3, Shift: 1.50'
+
+
+def test_queues_get_text():
+    output = queue.Queue()
+    mean_shift.mine([(0, 0, 0), (200, 200, 200)] * 10, output)
+    messages = []
+    while not output.empty():
+        messages.append(output.get())
+    assert messages[0] == 'Moving centroids'
+    assert all(isinstance(message, str) for message in messages)
+
+
+def test_counters_and_timings():
+    progress = Progress()
+    _, stats = quantize_k_means(flat_art((40, 30), colors=4), 4, 0, plus_plus=True, progress=progress)
+    summary = progress.summary()
+    assert summary['counters']['iterations'] == stats['iterations']
+    assert summary['counters']['distance evaluations'] > 0
+    assert set(summary['timings']) == {'Choosing initial centroids', 'Shifting centroids', 'Building final image'}
@@ -0,0 +1,77 @@
+import numpy as np
+from PIL import Image
+from colorclusters.histogram import color_histogram
+from colorclusters.image_utils import image_to_pixels
+from colorclusters.sequence import frame_histograms, iter_frames, quantize_sequence, save_animation, sort_numbered
+from benchmarks.images import noisy_photo
+
+
+def moving_square(count=6, size=(60, 40)):
+    """Frames of a red square moving across a noisy background, with the last frame repeated"""
+    background = np.asarray(noisy_photo(size))
+    frames = []
+    for i in range(count):
+        pixels = background.copy()
+        pixels[10:20, 5 * i:5 * i + 10] = (250, 20, 20)
+        frames.append(Image.fromarray(pixels))
+    return frames + [frames[-1]]
+
+
+def test_incremental_histograms_match_recounting():
+    for frame, _, histogram, _ in frame_histograms(moving_square()):
+        expected_keys, expected_counts = color_histogram(image_to_pixels(frame))
+        assert histogram.keys.tolist() == expected_keys.tolist()
+        assert histogram.counts.tolist() == expected_counts.tolist()
+
+
+def test_warm_start():
+    frames = moving_square()
+    results, stats = quantize_sequence(frames, 8, 1, random_state=0)
+    assert stats['frames'] == len(frames) == len(results)
+    # each frame starts from the last one's centroids, so it settles almost straight away
+    assert max(stats['iterations'][1:]) < stats['iterations'][0]
+    # the repeated frame doesn't need any iterations
+    assert stats['iterations'][-1] == 0
+    assert results[-1].tobytes() == results[-2].tobytes()
+    assert stats['changed_pixels'] == 5 * 10 * 2 * 5
+
+
+def test_global_palette(tmp_path):
+    frames = moving_square()
+    results, stats = quantize_sequence(frames, 8, 1, random_state=0, global_palette=True)
+    assert len(stats['iterations']) == 1
+    assert all(result.getpalette() == results[0].getpalette() for result in results)
+
+    # frames read from files give the same result
+    paths = []
+    for i, frame in enumerate(frames):
+        paths.append(str(tmp_path / ('frame%d.png' % i)))
+        frame.save(paths[-1])
+    assert sort_numbered(paths[::-1]) == paths
+    from_files, _ = quantize_sequence(paths, 8, 1, random_state=0, global_palette=True)
+    assert [result.tobytes() for result in from_files] == [result.tobytes() for result in results]
+
+
+def test_animation_round_trip(tmp_path):
+    frames = moving_square()[:-1]
+    for frame in frames:
+        frame.info['duration'] = 40
+    results, _ = quantize_sequence(frames, 8, 1, random_state=0)
+    save_animation(results, str(tmp_path / 'out.png'))
+    with Image.open(str(tmp_path / 'out.png')) as image:
+        assert image.n_frames == len(frames)
+        read = [image_to_pixels(frame).copy() for frame in iter_frames(image)]
+    assert all(np.array_equal(pixels, image_to_pixels(result.convert('RGB'))) for pixels, result in zip(read, results))
+
+
+def test_random_seeding_is_weighted_by_pixels():
+    # 98 black pixels and 2 white ones. k=2 seeded uniformly among the two distinct colors would start from white
+    # half the time, and after one iteration white would be in the palette. weighted by pixels it rarely is
+    frame = Image.new('RGB', (10, 10))
+    frame.putpixel((0, 0), (255, 255, 255))
+    frame.putpixel((1, 0), (255, 255, 255))
+    found = 0
+    for state in range(20):
+        frames, _ = quantize_sequence([frame], 2, max_shift=1000, seeding='random', random_state=state)
+        found += bool((image_to_pixels(frames[0]) == 255).all(axis=1).any())
+    assert found <= 4
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from colorclusters.quantize import quantize_k_means
+from colorclusters.streaming import array_strips, npy_strips, quantize_streaming, stream_histogram
+from colorclusters.histogram import ColorHistogram
+from colorclusters.image_utils import image_to_array, image_to_pixels
+from benchmarks.images import noisy_photo, rgba_alpha
+
+
+@pytest.mark.parametrize('make', [noisy_photo, rgba_alpha])
+def test_matches_whole_image(make):
+    image = make((60, 45))
+    expected, expected_stats = quantize_k_means(image, 8, 1, seeding='k-means++', random_state=0)
+    result, stats = quantize_streaming(image_to_array(image), 8, 1, strip_rows=7, seeding='k-means++', random_state=0)
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+    assert result.getpalette() == expected.getpalette()
+    assert stats['sse'] == pytest.approx(expected_stats['sse'])
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_reads_npy_files(tmp_path, mmap):
+    image = noisy_photo((40, 30))
+    np.save(tmp_path / 'pixels.npy', image_to_array(image))
+    pixels = np.load(tmp_path / 'pixels.npy', mmap_mode='r') if mmap else str(tmp_path / 'pixels.npy')
+    expected, _ = quantize_k_means(image, 4, 1, seeding='k-means++', random_state=0)
+    result, _ = quantize_streaming(pixels, 4, 1, strip_rows=8, seeding='k-means++', random_state=0)
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+
+def test_npy_strips(tmp_path):
+    array = image_to_array(noisy_photo((30, 20)))
+    np.save(tmp_path / 'pixels.npy', array)
+    assert np.array_equal(np.concatenate(list(npy_strips(tmp_path / 'pixels.npy', 7))), array)
+    np.save(tmp_path / 'flat.npy', array[..., 0])
+    with pytest.raises(ValueError):
+        list(npy_strips(tmp_path / 'flat.npy'))
+
+
+def test_stream_histogram_counts_every_strip():
+    array = image_to_array(noisy_photo((30, 20)))
+    histogram = stream_histogram(array_strips(array, 3))
+    expected = ColorHistogram.from_colors(image_to_pixels(noisy_photo((30, 20))))
+    assert np.array_equal(histogram.keys, expected.keys)
+    assert np.array_equal(histogram.counts, expected.counts)
+    assert stream_histogram([]) is None
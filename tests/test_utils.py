@@ -1,6 +1,6 @@
 from PIL import Image
 from colorclusters import distance
-from colorclusters.image_utils import map_to_paletted_image as map_img
+from colorclusters.image_utils import add_transparency_grid, map_to_paletted_image as map_img
 
 # creates a gradient image
 img = Image.new('RGBA',(255,255))
@@ -12,4 +12,13 @@ colors = [(10,10,10,150),(240,0,240,200),(30,180,30,180),(255,255,255,255)]
 img = map_img(img, colors, distance.chebyshev)
 
 #save the indexed result
-img.save("./post_map_test.png")
\ No newline at end of file
+img.save("./post_map_test.png")
+
+def test_transparency_grid_is_row_major():
+    # wider than it is tall, so swapping x and y would change the size or the pattern
+    grid = add_transparency_grid(size=(20, 12), grid_spacing=4, color1=0xFF0000FF, color2=0xFF00FF00)
+    assert grid.size == (20, 12)
+    for y in range(12):
+        for x in range(20):
+            expected = (255, 0, 0, 255) if (x // 4 + y // 4) % 2 == 0 else (0, 255, 0, 255)
+            assert grid.getpixel((x, y)) == expected